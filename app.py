@@ -1,6 +1,15 @@
 import streamlit as st
-from db import get_conn, insert_artifact, get_artifact, list_artifacts, search_artifacts, list_changes, merge_db_file, create_job, get_pending_jobs, update_job, get_job
-from utils import generate_id, timestamp, save_image_file, run_ocr, recognize_image, generate_qr, reconstruct_stub, image_to_datauri, generate_reconstruction_genai, generate_reconstruction_huggingface
+from db import get_conn, insert_artifact, get_artifact, list_artifacts, search_artifacts, page_cursor, estimate_artifact_count, list_changes, merge_db_file, MERGE_POLICIES, create_job, get_pending_jobs, update_job, get_job, update_reconstructions_batch, get_artifact_rows, get_duplicate_group
+from utils import reconstruct_stub, image_to_datauri, generate_reconstruction_genai, generate_reconstruction_huggingface
+from cache import get_cache
+from providers import provider_status
+from model_server import server_stats
+from jobs import start_background_worker
+from capture import create_artifact
+from reconstruction import PRESETS, DEFAULT_PRESET
+from imaging import ImageSource, InvalidImage
+from qrcodes import qr_png, qr_svg, label_sheet_pdf, artifact_labels
+from dedupe import find_duplicates, from_db
 import os, json, threading, time
 
 st.set_page_config(page_title='SiteScan', layout='wide')
@@ -41,6 +50,12 @@ st.markdown("""
 
 conn = get_conn()
 
+GALLERY_PAGE_SIZE = 24
+# most records put on one label sheet from the gallery (the CLI has no limit: qrcodes.py sheet)
+LABEL_SHEET_LIMIT = 5000
+# encoded in QR codes and label sheets; codes hold the bare id without it
+BASE_URL = st.query_params.get('base_url', [None])[0]
+
 st.markdown('<div class="main-container">', unsafe_allow_html=True)
 
 st.markdown('<div class="hero"><h1 style="font-family:Merriweather, serif; color:#214b39;">SiteScan</h1><div style="color:#5e7a6a">Capture and preserve archaeological discoveries</div></div>', unsafe_allow_html=True)
@@ -59,51 +74,63 @@ with cols[0]:
         if not upload:
             st.error('Please upload an image')
         else:
-            aid = generate_id()
-            img_path = save_image_file(upload, aid)
-            ocr_text = run_ocr(img_path)
-            try:
-                labels = recognize_image(img_path)
-            except Exception:
-                labels = []
-            qr_path = generate_qr(aid, base_url=st.query_params.get('base_url', [None])[0])
-            recon_path = reconstruct_stub(img_path, aid)
-            record = {
-                'id': aid,
-                'filename': upload.name,
-                'image_path': img_path,
-                'qr_path': qr_path,
-                'ocr_text': ocr_text,
-                'labels': labels,
-                'reconstruction_path': recon_path,
-                'metadata': {
-                    'site': site_name,
-                    'spot': spot,
-                    'fragile': fragile,
-                    'tags': [t.strip() for t in tags.split(',') if t.strip()],
-                    'notes': notes
-                },
-                'created_at': timestamp()
+            metadata = {
+                'site': site_name,
+                'spot': spot,
+                'fragile': fragile,
+                'tags': [t.strip() for t in tags.split(',') if t.strip()],
+                'notes': notes
             }
-            insert_artifact(conn, record)
-            st.success(f'Artifact created: {aid}')
+            # OCR and thumbnails run concurrently (QR codes are rendered on demand);
+            # labels and the reconstruction are queued as jobs and appear in the
+            # detail view when they finish
+            try:
+                record, timings = create_artifact(conn, upload, metadata)
+            except InvalidImage as e:
+                st.error(f'Not saved: {e}')
+            else:
+                worker = start_background_worker()
+                if worker is not None:
+                    worker.notify()
+                st.success(f"Artifact created: {record['id']} ({timings['total']:.1f}s); recognition and reconstruction are running in the background")
+                dups = find_duplicates(conn, from_db(record['phash']), exclude=record['id'])
+                if dups:
+                    st.warning('Looks like an artifact already on file: ' +
+                               ', '.join(f"[{aid[:8]}](?id={aid}) ({d} bits)" for d, aid in dups[:5]))
     st.markdown('</div>', unsafe_allow_html=True)
 
 with cols[2]:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader('Artifacts')
-    q = st.text_input('Search by ID, site, filename, tags', value='')
-    rows = []
-    if q.strip():
-        rows = search_artifacts(conn, query=q, limit=200)
+    q = st.text_input('Search by ID, site, tag, filename, OCR text, notes or label', value='')
+    # keyset pagination so each rerun only ships one page of small thumbnails to the browser;
+    # the cursor is ('after'|'before', (created_at, id)) relative to the previous page
+    if st.session_state.get('gallery_query') != q:
+        st.session_state['gallery_query'] = q
+        st.session_state['gallery_page'] = 0
+        st.session_state['gallery_cursor'] = None
+    page = st.session_state.get('gallery_page', 0)
+    direction, cursor = st.session_state.get('gallery_cursor') or (None, None)
+    fetch = (lambda **kw: search_artifacts(conn, query=q, **kw)) if q.strip() else (lambda **kw: list_artifacts(conn, **kw))
+    # fetch one extra row to know whether there is another page in the paging direction
+    if direction == 'before':
+        rows = fetch(limit=GALLERY_PAGE_SIZE + 1, before=cursor)
+        if len(rows) > GALLERY_PAGE_SIZE:
+            rows = rows[1:]
+        else:
+            page = st.session_state['gallery_page'] = 0
+        has_next = True
     else:
-        rows = list_artifacts(conn, limit=200)
+        rows = fetch(limit=GALLERY_PAGE_SIZE + 1, after=cursor)
+        has_next = len(rows) > GALLERY_PAGE_SIZE
+        rows = rows[:GALLERY_PAGE_SIZE]
     for r in rows:
-        aid, fname, imgpath, created = r
+        aid, fname, imgpath, created, thumbpath = r
         cols_inner = st.columns([1,3,1])
         with cols_inner[0]:
             try:
-                st.image(imgpath, width=120)
+                # rows from before thumbnails existed fall back to the original until backfilled
+                st.image(thumbpath or imgpath, width=120)
             except Exception:
                 st.write('No image')
         with cols_inner[1]:
@@ -113,6 +140,36 @@ with cols[2]:
                 st.experimental_rerun()
         with cols_inner[2]:
             st.write(created)
+    pager = st.columns([1,2,1])
+    with pager[0]:
+        if page > 0 and rows and st.button('Previous'):
+            st.session_state['gallery_page'] = page - 1
+            st.session_state['gallery_cursor'] = ('before', page_cursor(rows[0]))
+            st.experimental_rerun()
+    with pager[1]:
+        if q.strip():
+            st.caption(f'Page {page + 1}')
+        else:
+            pages = max(1, -(-estimate_artifact_count(conn) // GALLERY_PAGE_SIZE))
+            st.caption(f'Page {page + 1} of ~{pages}')
+    with pager[2]:
+        if has_next and rows and st.button('Next'):
+            st.session_state['gallery_page'] = page + 1
+            st.session_state['gallery_cursor'] = ('after', page_cursor(rows[-1]))
+            st.experimental_rerun()
+    if st.button('Find duplicate groups'):
+        # hashes older records and rebuilds dup_group in the background (dedupe.py)
+        create_job(conn, None, 'dedupe')
+        worker = start_background_worker()
+        if worker is not None:
+            worker.notify()
+        st.info('Duplicate search queued; groups show up in the detail view when it finishes')
+    # all matches (not just this page) in capture order, rendered in one pass
+    if st.button('Prepare label sheet'):
+        all_rows = fetch(limit=LABEL_SHEET_LIMIT) if q.strip() else list_artifacts(conn, limit=LABEL_SHEET_LIMIT)
+        labels = artifact_labels(conn, [r[0] for r in reversed(all_rows)])
+        st.download_button(f'Download label sheet ({len(labels)} labels, PDF)', label_sheet_pdf(labels, base_url=BASE_URL),
+                           file_name='sitescan-labels.pdf', mime='application/pdf')
     st.markdown('</div>', unsafe_allow_html=True)
 
 # Detail view
@@ -126,20 +183,45 @@ if 'id' in params:
         left, right = st.columns([2,1])
         with left:
             try:
-                st.image(rec['image_path'], use_column_width=True)
+                if rec.get('thumb_md_path') and ImageSource(rec['image_path']).too_large():
+                    # Streamlit would decode the whole scan; show the medium thumbnail instead
+                    st.image(rec['thumb_md_path'], use_column_width=True, caption='Preview (full scan too large to display)')
+                else:
+                    st.image(rec['image_path'], use_column_width=True)
             except Exception:
                 st.write('Image not available')
             edited = st.text_area('Edit OCR result before saving', value=rec.get('ocr_text',''))
+            words = rec.get('ocr_words') or []
+            if words:
+                low = [w['text'] for w in words if w['conf'] < 60]
+                st.caption(f"OCR confidence {sum(w['conf'] for w in words) / len(words):.0f}/100 over {len(words)} words"
+                           + (f"; check: {', '.join(low[:10])}" if low else ''))
             if st.button('Save OCR'):
+                # re-read so labels/reconstruction written by background jobs are not overwritten
+                rec = get_artifact(conn, aid)
                 rec['ocr_text'] = edited
                 insert_artifact(conn, rec)
                 st.success('OCR updated')
             st.subheader('Recognition')
-            st.write(rec.get('labels', []))
+            if rec.get('labels'):
+                st.write(rec['labels'])
+            else:
+                st.caption('No labels yet (recognition may still be running; refresh to update)')
+            dups = find_duplicates(conn, from_db(rec.get('phash')), exclude=aid)
+            if dups:
+                st.subheader('Possible duplicates')
+                dist = {a: d for d, a in dups}
+                for r in get_artifact_rows(conn, [a for _, a in dups[:8]]):
+                    st.markdown(f"[{r[1] or r[0]}](?id={r[0]}) ({dist[r[0]]} bits apart, {r[3]})")
+            # members linked only through other duplicates (set by the 'dedupe' job)
+            group = [r for r in get_duplicate_group(conn, aid) if r[0] not in {a for _, a in dups}]
+            if group:
+                st.caption('Same duplicate group: ' + ', '.join(f"[{r[1] or r[0]}](?id={r[0]})" for r in group[:20]))
             st.subheader('Metadata')
             st.json(rec.get('metadata', {}))
             note = st.text_area('Add note', '')
             if st.button('Add note'):
+                rec = get_artifact(conn, aid)
                 md = rec.get('metadata', {})
                 notes_val = md.get('notes','') + '\n' + note if md.get('notes') else note
                 md['notes'] = notes_val
@@ -147,13 +229,17 @@ if 'id' in params:
                 insert_artifact(conn, rec)
                 st.success('Note added')
         with right:
-            st.image(rec.get('qr_path'), caption='QR code')
+            st.image(qr_png(aid, BASE_URL), caption='QR code')
+            st.download_button('QR code (SVG)', qr_svg(aid, BASE_URL), file_name=f'{aid}.svg', mime='image/svg+xml')
             st.write('Reconstruction')
-            st.image(rec.get('reconstruction_path'))
+            if rec.get('reconstruction_path'):
+                st.image(rec['reconstruction_path'])
+            else:
+                st.caption('Reconstruction pending')
+            preset = st.selectbox('Reconstruction preset', list(PRESETS), index=list(PRESETS).index(DEFAULT_PRESET))
             if st.button('Regenerate reconstruction'):
-                new_recon = reconstruct_stub(rec['image_path'], aid)
-                rec['reconstruction_path'] = new_recon
-                insert_artifact(conn, rec)
+                new_recon = reconstruct_stub(rec['image_path'], aid, preset=preset)
+                update_reconstructions_batch(conn, {aid: new_recon})
                 st.experimental_rerun()
             if st.button('Generate AI reconstruction (GenAI)'):
                 job_id = create_job(conn, aid, 'genai_reconstruct', {'method': os.environ.get('GENAI_PROVIDER')})
@@ -189,62 +275,41 @@ with st.sidebar:
         with open(dbfile, 'rb') as f:
             st.download_button('Download DB file', data=f, file_name='sitescan.db')
     import_file = st.file_uploader('Import DB (merge)', type=['db'])
+    merge_policy = st.selectbox('On conflicting IDs', options=list(MERGE_POLICIES),
+                                format_func=lambda p: {'keep_local': 'Keep local', 'keep_remote': 'Keep imported',
+                                                       'keep_newest': 'Keep newest'}[p])
     if import_file is not None:
         tmp = 'data/_import_tmp.db'
         with open(tmp, 'wb') as f:
             f.write(import_file.getbuffer())
-        ok = merge_db_file(conn, tmp)
-        if ok:
-            st.success('Imported and merged records')
+        report = merge_db_file(conn, tmp, policy=merge_policy)
+        if report:
+            st.success(f"Merged in {report['elapsed']:.1f}s: {report['inserted']} inserted, "
+                       f"{report['updated']} updated, {report['skipped']} skipped")
         else:
             st.error('Import failed')
+    st.markdown('---')
+    cs = get_cache().stats()
+    st.caption(f"Result cache: {cs['hits']} hits / {cs['misses']} misses, {cs['entries']} entries, {cs['bytes'] // (1024 * 1024)} MB")
+    if os.environ.get('SITESCAN_MODEL_SERVER'):
+        ms = server_stats()
+        if ms is None:
+            st.caption('Model server: not reachable, recognition runs in this process')
+        else:
+            st.caption(f"Model server: {ms['queue_depth']} images queued, {ms['batches']} batches, "
+                       f"last batch {ms.get('batch_ms', {}).get('last', 0)} ms")
+    for name, ps in provider_status().items():
+        if ps['state'] != 'closed':
+            st.warning(f"{name}: circuit {ps['state']}, GenAI jobs paused ({ps['retry_after']:.0f}s)")
 
 st.markdown('</div>', unsafe_allow_html=True)
 
-# start a lightweight in-process job worker if not already
-def start_worker_once():
-    if 'worker_started' in st.session_state:
-        return
-    def worker():
-        c = get_conn()
-        while True:
-            pending = get_pending_jobs(c, limit=5)
-            if not pending:
-                time.sleep(2)
-                continue
-            for job in pending:
-                jid, artid, jtype, params = job
-                update_job(c, jid, status='running', progress=5)
-                rec = get_artifact(c, artid)
-                if not rec:
-                    update_job(c, jid, status='failed', result='artifact missing')
-                    continue
-                method = (json.loads(params).get('method') if params else None) or os.environ.get('GENAI_PROVIDER')
-                result_path = None
-                try:
-                    if method == 'replicate':
-                        result_path = generate_reconstruction_genai(rec['image_path'], artid)
-                    elif method in ('huggingface','hf'):
-                        result_path = generate_reconstruction_huggingface(rec['image_path'], artid)
-                    else:
-                        result_path = reconstruct_stub(rec['image_path'], artid)
-                    if result_path:
-                        rec['reconstruction_path'] = result_path
-                        insert_artifact(c, rec)
-                        update_job(c, jid, status='succeeded', result=result_path, progress=100)
-                    else:
-                        update_job(c, jid, status='failed', result='no result')
-                except Exception as e:
-                    update_job(c, jid, status='failed', result=str(e))
-            time.sleep(1)
-    t = threading.Thread(target=worker, daemon=True)
-    t.start()
-    st.session_state['worker_started'] = True
-
-start_worker_once()
+# process-wide job worker (one per server process, not per session); jobs are
+# claimed with leases so a standalone `python jobs.py` worker can run alongside
+start_background_worker()
 import streamlit as st
 from db import get_conn, insert_artifact, get_artifact, list_artifacts
-from utils import generate_id, timestamp, save_image_file, run_ocr, recognize_image, generate_qr, reconstruct_stub, image_to_datauri
+from utils import reconstruct_stub, image_to_datauri
 from utils import generate_reconstruction_genai, get_replicate_latest_version, generate_reconstruction_huggingface
 from db import create_job, get_pending_jobs, update_job, get_job
 import threading
@@ -355,34 +420,25 @@ if not can_edit:
 
 if upload is not None:
     if st.sidebar.button('Create artifact record'):
-        aid = generate_id()
-        img_path = save_image_file(upload, aid)
-        ocr_text = run_ocr(img_path)
-        labels = recognize_image(img_path)
-        qr_path = generate_qr(aid, base_url=st.query_params.get('base_url', [None])[0])
-        recon_path = reconstruct_stub(img_path, aid)
-        record = {
-            'id': aid,
-            'filename': upload.name,
-            'image_path': img_path,
-            'qr_path': qr_path,
-            'ocr_text': ocr_text,
-            'labels': labels,
-            'reconstruction_path': recon_path,
-            'metadata': {
-                'site': site_name,
-                'spot': spot,
-                'fragile': fragile,
-                'tags': [t.strip() for t in tags.split(',') if t.strip()],
-                'notes': notes
-            },
-            'created_at': timestamp()
+        metadata = {
+            'site': site_name,
+            'spot': spot,
+            'fragile': fragile,
+            'tags': [t.strip() for t in tags.split(',') if t.strip()],
+            'notes': notes
         }
-        insert_artifact(conn, record)
-        st.success(f'Artifact created: {aid}')
-        st.image(img_path, caption='Uploaded image')
-        st.image(qr_path, caption='QR Code')
-        st.image(recon_path, caption='AI Reconstruction (estimated)')
+        # same path as the capture form: the slow stages run as background jobs
+        try:
+            record, timings = create_artifact(conn, upload, metadata)
+        except InvalidImage as e:
+            st.sidebar.error(f'Not saved: {e}')
+        else:
+            worker = start_background_worker()
+            if worker is not None:
+                worker.notify()
+            st.success(f"Artifact created: {record['id']} ({timings['total']:.1f}s); recognition and reconstruction are running in the background")
+            st.image(record['image_path'], caption='Uploaded image')
+            st.image(qr_png(record['id']), caption='QR Code')
 
 # Main area: search / list
 st.header('Artifacts')
@@ -0,0 +1,109 @@
+"""
+Concurrent UI reads while the job worker writes.
+
+Runs one writer thread (insert_artifact, one commit per record, like the worker and
+"Save OCR") against several reader threads (gallery listing + search), first with
+the old rollback journal and then with WAL, and reports throughput, read latency
+and "database is locked" errors.
+
+    python benchmarks/bench_db_concurrency.py --seconds 5 --readers 4
+"""
+import argparse
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import ConnectionManager, insert_artifact, list_artifacts, search_artifacts, timestamp  # noqa: E402
+
+
+def _record(i):
+    return {
+        'id': f'bench-{i}',
+        'filename': f'IMG_{i:05d}.jpg',
+        'image_path': f'data/images/bench-{i}.jpg',
+        'ocr_text': f'context {i % 50} sherd rim',
+        'labels': [{'label': 'vase', 'score': 0.4}],
+        'metadata': {'site': f'Trench {i % 5}', 'spot': f'C{i % 20}', 'tags': ['pottery'], 'notes': 'bench'},
+        'created_at': timestamp(),
+    }
+
+
+def run(path, wal, seconds, readers, seed_rows):
+    manager = ConnectionManager(path, wal=wal)
+    conn = manager.connection()
+    for i in range(seed_rows):
+        insert_artifact(conn, _record(i))
+
+    stop = threading.Event()
+    writes = [0]
+    errors = [0]
+    latencies = []
+    lat_lock = threading.Lock()
+
+    def writer():
+        c = manager.connection()
+        i = seed_rows
+        while not stop.is_set():
+            try:
+                insert_artifact(c, _record(i))
+                writes[0] += 1
+            except sqlite3.OperationalError:
+                errors[0] += 1
+            i += 1
+
+    def reader(n):
+        c = manager.connection()
+        local = []
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                if n % 2:
+                    search_artifacts(c, query='sherd', limit=24)
+                else:
+                    list_artifacts(c, limit=24)
+                local.append(time.perf_counter() - t0)
+            except sqlite3.OperationalError:
+                errors[0] += 1
+        with lat_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    return {
+        'mode': 'WAL' if wal else 'rollback journal',
+        'writes/s': writes[0] / seconds,
+        'reads/s': len(latencies) / seconds,
+        'read p50 ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'read p99 ms': p99 * 1000,
+        'errors': errors[0],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seed-rows', type=int, default=2000)
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        for wal in (False, True):
+            res = run(Path(tmp) / f"bench_{'wal' if wal else 'delete'}.db", wal, args.seconds, args.readers, args.seed_rows)
+            print(' | '.join(f'{k}: {v:.1f}' if isinstance(v, float) else f'{k}: {v}' for k, v in res.items()))
+
+
+if __name__ == '__main__':
+    main()
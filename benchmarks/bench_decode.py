@@ -0,0 +1,89 @@
+"""
+Decode cost of the per-image stages, separate vs shared ImageSource.
+
+Generates large JPEG and TIFF scans, then runs OCR, thumbnails, the recognition
+input and the stub reconstruction on each image twice: once with every stage
+opening the file itself (as before imaging.ImageSource) and once with all stages
+sharing one source. Reports decodes, decode time and total stage time per image.
+The result cache is disabled so every stage does its work.
+
+    python benchmarks/bench_decode.py --images 4 --width 4000 --height 3000
+    python benchmarks/bench_decode.py --no-reconstruction
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ['SITESCAN_CACHE_MAX_MB'] = '0'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imaging import ImageSource  # noqa: E402
+from utils import make_thumbnails, run_ocr, reconstruct_stub, RECOGNITION_SIZE  # noqa: E402
+
+
+def make_scans(out_dir, count, width, height):
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        # smooth gradient plus noise: compresses like a photo, not like a flat colour
+        y, x = np.mgrid[0:height, 0:width]
+        base = ((x * 255 // width + y * 255 // height) // 2).astype(np.uint8)
+        noise = rng.integers(0, 40, (height, width), dtype=np.uint8)
+        rgb = np.stack([base, 255 - base, base // 2], axis=-1) + noise[..., None]
+        img = Image.fromarray(rgb.astype(np.uint8), 'RGB')
+        ext = 'tif' if i % 2 else 'jpg'
+        path = Path(out_dir) / f'scan_{i}.{ext}'
+        img.save(path, quality=92) if ext == 'jpg' else img.save(path)
+        paths.append(str(path))
+    return paths
+
+
+def run_stages(path, shared, aid, reconstruction=True):
+    """Returns (decodes, decode seconds, wall seconds) for all stages on one image."""
+    sources = []
+
+    def source():
+        if shared and sources:
+            return sources[0]
+        sources.append(ImageSource(path))
+        return sources[-1]
+
+    t0 = time.perf_counter()
+    run_ocr(source())
+    make_thumbnails(source(), aid)
+    source().recognition_array(RECOGNITION_SIZE)
+    if reconstruction:
+        reconstruct_stub(source(), aid)
+    wall = time.perf_counter() - t0
+    return sum(s.decodes for s in sources), sum(s.decode_seconds for s in sources), wall
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark decode-once image sharing')
+    parser.add_argument('--images', type=int, default=4)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--no-reconstruction', action='store_true',
+                        help='skip the stub reconstruction (its PNG encode dominates the total)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        paths = make_scans(tmp, args.images, args.width, args.height)
+        print(f'{args.images} scans of {args.width}x{args.height} (JPEG and TIFF)')
+        print(f"{'mode':<10}{'decodes/img':>12}{'decode ms/img':>15}{'total ms/img':>14}")
+        for label, shared in (('separate', False), ('shared', True)):
+            runs = [run_stages(p, shared, f'{label}-{i}', not args.no_reconstruction) for i, p in enumerate(paths)]
+            print(f"{label:<10}{statistics.mean(r[0] for r in runs):>12.1f}"
+                  f"{statistics.mean(r[1] for r in runs) * 1000:>15.1f}"
+                  f"{statistics.mean(r[2] for r in runs) * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Near-duplicate lookups: multi-index hashing vs scanning every hash.
+
+Seeds a temporary database with --rows random 64-bit hashes, 1% of them planted
+as near-copies (1-8 bits flipped) of other rows, and reports:
+
+  - load       dedupe's index built from the phash column (cold process)
+  - refresh    the per-lookup "anything new?" check when nothing changed
+  - query      lookups at DUPLICATE_DISTANCE: HashIndex.search (bucket probes at
+               or above SCAN_ROWS, a NumPy scan below), find_duplicates (the
+               same plus the refresh check), a Python loop over all hashes, and
+               a NumPy XOR + popcount over all hashes
+  - cluster    cluster_duplicates over the whole table (no backfill; skip it
+               with --no-cluster for multi-million row runs)
+  - hash       dedupe.image_phash on a --width x --height JPEG
+
+    python benchmarks/bench_dedupe.py --rows 100000
+    python benchmarks/bench_dedupe.py --rows 50000         # below SCAN_ROWS
+    python benchmarks/bench_dedupe.py --rows 1000000 --no-cluster
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def seed(conn, rows, rng):
+    from dedupe import to_db
+    hashes = [int(h) for h in rng.integers(0, 1 << 64, rows, dtype='uint64')]
+    planted = rng.choice(rows, rows // 100, replace=False)
+    for i in planted:
+        src = hashes[int(rng.integers(rows))]
+        for b in rng.choice(64, int(rng.integers(1, 9)), replace=False):
+            src ^= 1 << int(b)
+        hashes[i] = src
+    conn.executemany('INSERT INTO artifacts (id, filename, image_path, created_at, phash) VALUES (?, ?, ?, ?, ?)',
+                     ((f'bench-{i}', f'IMG_{i:06d}.jpg', '', f'2026-06-14T09:00:{i % 60:02d}Z', to_db(h))
+                      for i, h in enumerate(hashes)))
+    conn.commit()
+    return hashes
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000
+
+
+def _hash_time(width, height):
+    import numpy as np
+    from PIL import Image
+    from dedupe import image_phash
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'photo.jpg')
+        small = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+        Image.fromarray(small).resize((width, height), Image.BILINEAR).save(path, quality=90)
+        return _ms(lambda: image_phash(path), 5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the perceptual-hash duplicate index')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--no-cluster', action='store_true')
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    import dedupe
+    from db import ConnectionManager
+    rng = np.random.default_rng(0)
+    radius = dedupe.DUPLICATE_DISTANCE
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = ConnectionManager(Path(tmp) / 'bench.db').connection()
+        hashes = seed(conn, args.rows, rng)
+        mode = 'NumPy scan' if args.rows < dedupe.SCAN_ROWS else 'bucket probes'
+        print(f'{args.rows} hashes, radius {radius} bits, index lookups use {mode}')
+
+        t0 = time.perf_counter()
+        dedupe.get_index(conn)
+        print(f"{'load':<16}{(time.perf_counter() - t0) * 1000:>10.1f} ms")
+        print(f"{'refresh':<16}{_ms(lambda: dedupe.get_index(conn), 50):>10.3f} ms")
+
+        queries = [hashes[int(i)] ^ (1 << int(rng.integers(64))) for i in rng.integers(args.rows, size=args.queries)]
+        packed = np.array(hashes, dtype=np.uint64)
+        has_popcount = hasattr(np, 'bitwise_count')
+
+        def linear_py(q):
+            return sorted((d, i) for i, h in enumerate(hashes) if (d := (h ^ q).bit_count()) <= radius)
+
+        def linear_np(q):
+            x = packed ^ np.uint64(q)
+            d = np.bitwise_count(x) if has_popcount else np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(1)
+            return np.nonzero(d <= radius)[0]
+
+        index = dedupe.get_index(conn)
+        for q in queries:  # warm up: first touches of the bucket arrays page them in
+            index.search(q)
+        found = []
+        for name, fn, n in (('query index', index.search, args.queries),
+                            ('find_duplicates', lambda q: found.append(dedupe.find_duplicates(conn, q)), args.queries),
+                            ('query python', linear_py, max(1, args.queries // 20)),
+                            ('query numpy', linear_np, args.queries)):
+            t0 = time.perf_counter()
+            for q in queries[:n]:
+                fn(q)
+            print(f'{name:<16}{(time.perf_counter() - t0) * 1000 / n:>10.3f} ms')
+        # the index must find exactly what a full scan finds
+        for q, hits in zip(queries[:20], found):
+            assert [d for d, _ in hits] == [d for d, _ in linear_py(q)]
+
+        if not args.no_cluster:
+            t0 = time.perf_counter()
+            stats = dedupe.cluster_duplicates(conn, backfill=False, log=lambda msg: None)
+            print(f"{'cluster':<16}{(time.perf_counter() - t0) * 1000:>10.1f} ms"
+                  f"  ({stats['groups']} groups, {stats['duplicates']} artifacts)")
+
+    print(f"{'hash':<16}{_hash_time(args.width, args.height):>10.1f} ms  ({args.width}x{args.height} JPEG)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Import-time report for the SiteScan modules.
+
+Imports each entry point in a fresh interpreter with `python -X importtime`,
+reports the best cumulative import time over a few runs and the slowest
+dependencies it pulled in, and fails (exit code 1) if a module that should
+stay cheap loads one of the heavy libraries at import time. OCR, recognition,
+QR and GenAI dependencies must only be imported when first used.
+
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --runs 5 --top 8 --max-ms 150
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# name -> modules imported together
+TARGETS = {
+    'db': ['db'],
+    'cache': ['cache'],
+    'utils': ['utils'],
+    'jobs': ['jobs'],
+    'ingest': ['ingest'],
+    'model_server': ['model_server'],
+    # what app.py imports before Streamlit renders anything (streamlit itself excluded)
+    'app (without streamlit)': ['db', 'utils', 'cache', 'providers', 'model_server', 'jobs'],
+    'genai': ['genai'],
+}
+
+HEAVY = ('numpy', 'PIL', 'pytesseract', 'qrcode', 'requests', 'aiohttp', 'tensorflow', 'cv2')
+# genai is only imported when a reconstruction is requested and needs aiohttp up front
+ALLOW_HEAVY = {'genai': ('aiohttp',)}
+
+
+def _importtime(modules):
+    """Run `import modules` under -X importtime; returns [(depth, name, self_us, cumulative_us)]."""
+    code = 'import ' + ', '.join(modules)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                          capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+    if proc.returncode != 0:
+        raise RuntimeError(f'{code} failed:\n{proc.stderr[-2000:]}')
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cum_us, name = line.split(':', 1)[1].split('|')
+        self_us = int(self_us)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((depth, name.strip(), self_us, int(cum_us)))
+    return rows
+
+
+def _loaded_heavy(modules):
+    code = ('import sys, ' + ', '.join(modules) + '\n'
+            'print(" ".join(sorted({m.split(".")[0] for m in sys.modules})))')
+    proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    loaded = set(proc.stdout.split())
+    return sorted(loaded.intersection(HEAVY))
+
+
+def measure(modules, runs, startup):
+    best, best_rows = None, None
+    for _ in range(runs):
+        rows = _importtime(modules)
+        total = sum(cum for depth, name, _, cum in rows if depth == 0 and name in modules)
+        if best is None or total < best:
+            best, best_rows = total, rows
+    slowest = sorted(((s, n) for _, n, s, _ in best_rows if n not in startup and n not in modules), reverse=True)
+    return best / 1000.0, slowest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report and check import time of SiteScan modules')
+    parser.add_argument('--runs', type=int, default=3, help='runs per target (best is reported)')
+    parser.add_argument('--top', type=int, default=5, help='slowest dependencies to list per target')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if a target (except genai) takes longer')
+    args = parser.parse_args(argv)
+
+    # modules every interpreter loads at startup (site, encodings, ...) are not ours to optimise
+    startup = {name for _, name, _, _ in _importtime(['sys'])}
+    failed = False
+    print(f"{'target':<26}{'best ms':>9}  slowest dependencies (self ms)")
+    for target, modules in TARGETS.items():
+        ms, slowest = measure(modules, args.runs, startup)
+        deps = ', '.join(f'{n} {s / 1000:.1f}' for s, n in slowest[:args.top])
+        print(f'{target:<26}{ms:>9.1f}  {deps}')
+        heavy = [m for m in _loaded_heavy(modules) if m not in ALLOW_HEAVY.get(target, ())]
+        if heavy:
+            print(f'  ! {target} imports {", ".join(heavy)} at module load')
+            failed = True
+        if args.max_ms is not None and target not in ALLOW_HEAVY and ms > args.max_ms:
+            print(f'  ! {target} over budget ({ms:.1f} ms > {args.max_ms:.0f} ms)')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
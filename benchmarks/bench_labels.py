@@ -0,0 +1,124 @@
+"""
+QR codes: stored per artifact vs rendered on demand, and label-sheet throughput.
+
+For --labels random artifact ids:
+
+  - stored     the old generate_qr: best-mask search, qrcode's PIL image, PNG
+               written per artifact
+  - png cold   qrcodes.qr_png with an empty LRU
+  - png warm   the most recent QR_CACHE_SIZE ids again (LRU hits, what a
+               detail-view rerun costs), scaled to --labels
+  - sheet pdf  qrcodes.label_sheet_pdf for all ids (A4, 3 x 8, 300 dpi)
+  - sheet png  qrcodes.label_sheet_pngs for all ids
+
+The sheet figures include encoding every code (the LRU is cleared first).
+Afterwards the first page is cut into labels and decoded with OpenCV to check
+that the fixed-mask codes scan.
+
+    python benchmarks/bench_labels.py --labels 1000
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+BASE_URL = 'https://sitescan.example.org/'
+
+
+def _stored(ids, out_dir):
+    """The pre-on-demand generate_qr, kept here for comparison."""
+    import qrcode
+    for aid in ids:
+        qr = qrcode.QRCode(box_size=6, border=2)
+        qr.add_data(f'{BASE_URL}?id={aid}')
+        qr.make(fit=True)
+        img = qr.make_image(fill_color="#2D5F4C", back_color="white")
+        buf = io.BytesIO()
+        img.save(buf)
+        Path(out_dir, f'{aid}.png').write_bytes(buf.getvalue())
+
+
+def _clear():
+    import qrcodes
+    for fn in (qrcodes.qr_matrix, qrcodes.qr_png, qrcodes.qr_svg, qrcodes._text_line):
+        fn.cache_clear()
+
+
+def _check_scans(ids):
+    """Decode the labels of the first sheet page; returns (decoded, tried)."""
+    import cv2
+    import numpy as np
+    import qrcodes
+    labels = [(aid, [aid[:8], 'Trench A / 12', 'IMG_0001.JPG']) for aid in ids]
+    page = np.asarray(next(qrcodes.label_pages(labels, base_url=BASE_URL)).convert('L'))
+    cols, rows = qrcodes.SHEET_GRID
+    h, w = page.shape
+    detector = cv2.QRCodeDetector()
+    ok = tried = 0
+    for i, (aid, _) in enumerate(labels[:cols * rows]):
+        cell = page[(i // cols) * h // rows:(i // cols + 1) * h // rows, (i % cols) * w // cols:(i % cols + 1) * w // cols]
+        text, _, _ = detector.detectAndDecode(np.ascontiguousarray(cell))
+        tried += 1
+        ok += text == qrcodes.qr_data(aid, BASE_URL)
+    return ok, tried
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark on-demand QR codes and label sheets')
+    parser.add_argument('--labels', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    import qrcodes
+    ids = [str(uuid.uuid4()) for _ in range(args.labels)]
+    labels = [(aid, [aid[:8], 'Trench A / 12', f'IMG_{i:04d}.JPG']) for i, aid in enumerate(ids)]
+    print(f'{args.labels} labels')
+    print(f"{'mode':<11}{'total s':>9}{'ms/label':>10}{'output':>10}")
+
+    def report(name, seconds, output=''):
+        print(f'{name:<11}{seconds:>9.2f}{seconds * 1000 / args.labels:>10.3f}{output:>10}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        _stored(ids, tmp)
+        report('stored', time.perf_counter() - t0,
+               f'{sum(os.path.getsize(p) for p in Path(tmp).iterdir()) / 1e6:.1f} MB')
+
+    _clear()
+    t0 = time.perf_counter()
+    for aid in ids:
+        qrcodes.qr_png(aid, BASE_URL)
+    report('png cold', time.perf_counter() - t0)
+    # a detail view re-run: the most recent codes, all still in the LRU
+    recent = ids[-qrcodes.QR_CACHE_SIZE:]
+    t0 = time.perf_counter()
+    for aid in recent:
+        qrcodes.qr_png(aid, BASE_URL)
+    report('png warm', (time.perf_counter() - t0) * args.labels / len(recent))
+
+    _clear()
+    t0 = time.perf_counter()
+    pdf = qrcodes.label_sheet_pdf(labels, base_url=BASE_URL)
+    pages = -(-args.labels // (qrcodes.SHEET_GRID[0] * qrcodes.SHEET_GRID[1]))
+    report('sheet pdf', time.perf_counter() - t0, f'{len(pdf) / 1e6:.1f} MB')
+    _clear()
+    t0 = time.perf_counter()
+    pngs = qrcodes.label_sheet_pngs(labels, base_url=BASE_URL)
+    report('sheet png', time.perf_counter() - t0, f'{sum(map(len, pngs)) / 1e6:.1f} MB')
+    print(f'{pages} pages')
+
+    try:
+        ok, tried = _check_scans(ids)
+        print(f'decoded {ok}/{tried} labels of page 1 with OpenCV')
+    except ImportError:
+        print('OpenCV not installed, scan check skipped')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Peak memory and time of the per-image stages on a very large scan, whole vs tiled.
+
+Writes one large uncompressed TIFF (a textured "trench" with printed labels
+scattered over it) and a baseline JPEG of the same content, then runs OCR,
+thumbnails, the recognition input and the local reconstruction on a shared
+ImageSource:
+
+  - whole   SITESCAN_MAX_DECODE_MB high enough to decode the full raster
+  - tiled   SITESCAN_MAX_DECODE_MB=--ceiling-mb, so the stages go through tiles.py
+
+Each run is a fresh process; peak MB is the resident high-water mark above the
+post-import baseline. The result cache is disabled. Without the tesseract binary
+OCR returns nothing, but region detection and tiling still run.
+
+    python benchmarks/bench_large_image.py --width 16000 --height 12000 --ceiling-mb 256
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ['SITESCAN_CACHE_MAX_MB'] = '0'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_reconstruction import _peak_rss_mb  # noqa: E402
+
+
+def make_scan(out_dir, width, height):
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFont
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(90, 140, (height // 16, width // 16, 3), dtype=np.uint8)).resize(
+        (width, height), Image.BILINEAR)
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype('DejaVuSans-Bold.ttf', 48)
+    except OSError:
+        font = ImageFont.load_default(size=48)
+    for i in range(40):
+        x, y = int(rng.integers(0, width - 600)), int(rng.integers(0, height - 150))
+        draw.rectangle((x, y, x + 560, y + 130), fill=(235, 232, 220))
+        draw.text((x + 20, y + 20), f'FIND {1000 + i}\nLOCUS {300 + i}', fill=(20, 20, 20), font=font)
+    path = Path(out_dir) / 'scan.tif'
+    img.save(path)
+    return str(path)
+
+
+def run_stages(path, ceiling_mb):
+    """Child process: returns {stage: seconds} plus 'peak_mb'."""
+    os.environ['SITESCAN_MAX_DECODE_MB'] = str(ceiling_mb)
+    os.chdir(Path(path).parent)
+    # imported only so their own memory lands in the baseline below, not in a stage
+    for name in ('cv2', 'numpy'):
+        importlib.import_module(name)
+    from imaging import ImageSource
+    from ocr import ocr_image
+    from utils import make_thumbnails, reconstruct_stub, RECOGNITION_SIZE
+    base = _peak_rss_mb()
+    src = ImageSource(path)
+    times = {}
+    for name, fn in (('ocr', lambda: ocr_image(src)),
+                     ('thumbnails', lambda: make_thumbnails(src, 'bench')),
+                     ('recognition', lambda: src.recognition_array(RECOGNITION_SIZE)),
+                     ('reconstruction', lambda: reconstruct_stub(src, 'bench'))):
+        t0 = time.perf_counter()
+        fn()
+        times[name] = time.perf_counter() - t0
+    times['peak_mb'] = _peak_rss_mb() - base
+    times['tiled'] = src.too_large()
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark tiled processing of large scans')
+    parser.add_argument('--width', type=int, default=16000)
+    parser.add_argument('--height', type=int, default=12000)
+    parser.add_argument('--ceiling-mb', type=int, default=256)
+    args = parser.parse_args(argv)
+
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_scan(tmp, args.width, args.height)
+        raw_mb = args.width * args.height * 3 / 2 ** 20
+        print(f'{args.width}x{args.height} uncompressed TIFF ({raw_mb:.0f} MB decoded)')
+        print(f"{'mode':<7}{'ocr s':>8}{'thumbs s':>10}{'recog s':>9}{'recon s':>9}{'peak MB':>9}")
+        for mode, ceiling in (('whole', int(raw_mb * 4) + 1), ('tiled', args.ceiling_mb)):
+            with ctx.Pool(1) as pool:
+                r = pool.apply(run_stages, (path, ceiling))
+            assert r['tiled'] == (mode == 'tiled')
+            print(f"{mode:<7}{r['ocr']:>8.1f}{r['thumbnails']:>10.1f}{r['recognition']:>9.2f}"
+                  f"{r['reconstruction']:>9.1f}{r['peak_mb']:>9.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Local reconstruction: time, peak memory and output size per preset vs the old stub.
+
+Generates photos of a symmetric "vessel" on a plain background with a piece
+broken off and a crack drawn across it, then reconstructs each one with:
+
+  - stub      the old reconstruct_stub (1.6x Lanczos upscale, blur, autocontrast, PNG)
+  - fast / balanced / quality   the presets in reconstruction.PRESETS (plus PNG encode)
+
+Every mode runs in a fresh process, so the peak-RSS figure (high-water mark above the
+post-import baseline) covers only that mode's decode and processing. The error
+column is the mean absolute RGB error inside the broken-off region against the
+intact original; the stub does not fill it, so its error stays at the
+background-vs-vessel difference.
+
+    python benchmarks/bench_reconstruction.py --images 3 --width 4000 --height 3000
+"""
+import argparse
+import importlib
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_vessels(out_dir, count, width, height):
+    """Writes (photo, intact original as .npy, broken-region mask as .npy) triples."""
+    import cv2
+    import numpy as np
+    rng = np.random.default_rng(0)
+    samples = []
+    yy, xx = np.mgrid[0:height, 0:width]
+    for i in range(count):
+        bg = np.array([200, 195, 185]) + rng.integers(-15, 15, 3)
+        cx, cy = width // 2 + rng.integers(-width // 20, width // 20), height // 2
+        rx, ry = width * 0.22, height * 0.4
+        inside = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 < 1
+        tex = cv2.resize(rng.normal(0, 8, (height // 8, width // 8)).astype(np.float32), (width, height))
+        body = np.stack([150 + tex + (yy - cy) / (height / 75), 80 + tex, 50 + tex], -1)
+        truth = np.where(inside[..., None], body, bg).clip(0, 255).astype(np.uint8)
+        photo = truth.copy()
+        broken = inside & (xx > cx + rx * 0.3) & (yy < cy - ry * 0.25)
+        photo[broken] = truth[0, 0]
+        cv2.line(photo, (int(cx - rx * 0.3), int(cy + ry * 0.2)), (int(cx + rx * 0.1), int(cy + ry * 0.6)),
+                 (40, 25, 20), max(2, width // 700))
+        path = Path(out_dir) / f'vessel_{i}.jpg'
+        cv2.imwrite(str(path), cv2.cvtColor(photo, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 92])
+        np.save(path.with_suffix('.truth.npy'), truth)
+        np.save(path.with_suffix('.broken.npy'), broken)
+        samples.append(str(path))
+    return samples
+
+
+def _stub(path):
+    """The pre-engine reconstruct_stub, kept here for comparison."""
+    import io
+    import numpy as np
+    from PIL import Image, ImageFilter, ImageOps
+    img = Image.open(path).convert('RGB')
+    w, h = img.size
+    recon = img.resize((int(w * 1.6), int(h * 1.6)), Image.LANCZOS)
+    recon = ImageOps.autocontrast(recon.filter(ImageFilter.GaussianBlur(radius=1)))
+    buf = io.BytesIO()
+    recon.save(buf, format='PNG')
+    return np.asarray(recon), len(buf.getvalue())
+
+
+def _engine(path, preset):
+    from imaging import ImageSource
+    from reconstruction import reconstruct, encode_png, PRESETS
+    side = PRESETS[preset]['max_side']
+    out, _ = reconstruct(ImageSource(path).draft((side, side)), preset)
+    return out, len(encode_png(out))
+
+
+def _peak_rss_mb():
+    # VmHWM starts fresh in a spawned process; ru_maxrss is inherited across exec
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_mode(mode, path):
+    """Child process: returns (seconds, peak MB above baseline, output MB, broken-region error)."""
+    import cv2
+    import numpy as np
+    # imported only so their own memory lands in the baseline below, not in the mode
+    for name in ('PIL.Image', 'reconstruction'):
+        importlib.import_module(name)
+    base = _peak_rss_mb()
+    t0 = time.perf_counter()
+    out, size = _stub(path) if mode == 'stub' else _engine(path, mode)
+    elapsed = time.perf_counter() - t0
+    peak = _peak_rss_mb() - base
+    h, w = out.shape[:2]
+    truth = cv2.resize(np.load(Path(path).with_suffix('.truth.npy')), (w, h), interpolation=cv2.INTER_AREA)
+    broken = cv2.resize(np.load(Path(path).with_suffix('.broken.npy')).astype(np.uint8), (w, h)) > 0
+    err = float(np.abs(out[broken].astype(np.int16) - truth[broken]).mean())
+    return elapsed, peak, size / 1e6, err
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark local reconstruction presets')
+    parser.add_argument('--images', type=int, default=3)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    args = parser.parse_args(argv)
+
+    from reconstruction import PRESETS
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_vessels(tmp, args.images, args.width, args.height)
+        print(f'{args.images} photos of {args.width}x{args.height}')
+        print(f"{'mode':<10}{'ms/img':>9}{'peak MB':>9}{'PNG MB':>8}{'error':>7}")
+        for mode in ('stub', *PRESETS):
+            runs = []
+            for path in paths:
+                with ctx.Pool(1) as pool:
+                    runs.append(pool.apply(run_mode, (mode, path)))
+            print(f'{mode:<10}{statistics.mean(r[0] for r in runs) * 1000:>9.0f}'
+                  f'{max(r[1] for r in runs):>9.0f}{statistics.mean(r[2] for r in runs):>8.1f}'
+                  f'{statistics.mean(r[3] for r in runs):>7.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
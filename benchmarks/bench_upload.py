@@ -0,0 +1,110 @@
+"""
+Storing a new image: the old copy-then-reopen path vs the single streaming pass.
+
+Writes JPEG photos with EXIF (capture time, GPS, camera) and stores each one the
+way an ingest worker does before OCR starts:
+
+  - old     blobstore.put_file (one read to hash, one to copy), then the hash,
+            header and EXIF read back from the stored file
+  - stream  utils.store_image: one read that hashes, writes, checks the header
+            and extracts EXIF
+
+"read MB" is the bytes the process read per image (rchar from /proc/self/io).
+The result cache is not involved.
+
+    python benchmarks/bench_upload.py --images 20 --width 4000 --height 3000
+"""
+import argparse
+import importlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_photos(out_dir, count, width, height):
+    import numpy as np
+    from PIL import Image
+    from PIL.TiffImagePlugin import IFDRational
+    rng = np.random.default_rng(0)
+    paths = []
+    base = rng.integers(60, 200, (height // 8, width // 8, 3), dtype=np.uint8)
+    for i in range(count):
+        img = Image.fromarray(np.roll(base, i * 7, axis=1)).resize((width, height), Image.BILINEAR)
+        exif = Image.Exif()
+        exif[0x010F], exif[0x0110] = 'Canon', 'Canon EOS R6'
+        exif.get_ifd(0x8769)[0x9003] = f'2026:06:14 09:{i % 60:02d}:00'
+        gps = exif.get_ifd(0x8825)
+        gps[1], gps[2] = 'N', (IFDRational(37), IFDRational(58), IFDRational(i))
+        gps[3], gps[4] = 'E', (IFDRational(23), IFDRational(43), IFDRational(5))
+        path = Path(out_dir) / f'photo_{i}.jpg'
+        img.save(path, quality=90, exif=exif)
+        paths.append(str(path))
+    return paths
+
+
+def _rchar():
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _old(path):
+    from blobstore import put_file
+    from imaging import ImageSource, exif_metadata
+    from tiles import pil_open
+    stored = put_file(path)
+    src = ImageSource(stored)
+    src.content_hash()
+    src.size
+    with pil_open(stored) as img:
+        exif_metadata(img)
+    return src
+
+
+def _stream(path):
+    from utils import store_image
+    with open(path, 'rb') as f:
+        return store_image(f, Path(path).name)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the streaming image store')
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_photos(tmp, args.images, args.width, args.height)
+        mb = statistics.mean(os.path.getsize(p) for p in paths) / 1e6
+        print(f'{args.images} JPEGs of {args.width}x{args.height} ({mb:.1f} MB each)')
+        print(f"{'mode':<8}{'ms/img':>8}{'read MB':>9}")
+        os.chdir(tmp)
+        # pay the app modules' import time here, not inside the first timed mode
+        importlib.import_module('utils')
+        for mode, fn in (('old', _old), ('stream', _stream)):
+            # separate store per mode so nothing is deduplicated against the other run
+            import blobstore
+            blobstore._store = blobstore.LocalBlobStore(Path(tmp) / f'blobs_{mode}')
+            times, reads = [], []
+            for p in paths:
+                r0, t0 = _rchar(), time.perf_counter()
+                fn(p)
+                times.append(time.perf_counter() - t0)
+                reads.append((_rchar() - r0) / 1e6)
+            print(f'{mode:<8}{statistics.mean(times) * 1000:>8.1f}{statistics.mean(reads):>9.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Content-addressed storage for artifact images, QR codes and reconstructions.
+
+Files are stored under the SHA-256 of their bytes, sharded two levels deep:
+
+    data/blobs/ab/cd/abcd...ef.jpg
+
+The same photo imported from two tablets is stored once, and no directory grows
+past a few thousand entries even with 100k+ artifacts. Writes go to a temp file
+next to the target and are renamed into place, so a crash never leaves a
+partial file under a valid name; a blob that already exists is not rewritten.
+
+`put_bytes` / `put_file` / `put_stream` return the local path that is stored in the
+`artifacts` table, so readers (ImageSource, st.image) keep working on plain
+paths. Backends are registered by name with `register_backend` and picked with
+SITESCAN_BLOB_BACKEND (default 'local', rooted at SITESCAN_BLOB_DIR, default
+`data/blobs`). A remote backend (S3/MinIO) has to implement the same methods and
+return a local read-through copy from them.
+
+Records saved before the store existed are moved into it with:
+
+    python blobstore.py migrate            # moves files, updates paths
+    python blobstore.py migrate --keep     # copies, leaves the old files
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from cache import file_hash
+
+BLOB_DIR = Path(os.environ.get('SITESCAN_BLOB_DIR', 'data/blobs'))
+
+# bytes read per step by put_stream
+STREAM_CHUNK = 1024 * 1024
+
+
+class LocalBlobStore:
+    def __init__(self, root=BLOB_DIR):
+        self.root = Path(root)
+        self._dirs = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, digest, ext=''):
+        return self.root / digest[:2] / digest[2:4] / f'{digest}{ext.lower()}'
+
+    def contains(self, path):
+        """True if `path` already lives in this store."""
+        try:
+            Path(path).resolve().relative_to(self.root.resolve())
+            return True
+        except (ValueError, OSError):
+            return False
+
+    def _target_dir(self, target):
+        # one mkdir per shard per process, not one per save
+        parent = target.parent
+        if parent not in self._dirs:
+            parent.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                self._dirs.add(parent)
+        return parent
+
+    def _commit(self, tmp_path, target):
+        try:
+            if target.exists():
+                os.unlink(tmp_path)
+            else:
+                os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return str(target)
+
+    def put_bytes(self, data, ext=''):
+        """Store `data`; returns its path."""
+        target = self.path_for(hashlib.sha256(data).hexdigest(), ext)
+        if target.exists():
+            return str(target)
+        fd, tmp_path = tempfile.mkstemp(dir=self._target_dir(target), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self._commit(tmp_path, target)
+
+    def put_file(self, src, ext=None, move=False, digest=None):
+        """
+        Store the file at `src` (moved if `move`, else copied); returns its path.
+        Pass `digest` if the caller already hashed the file.
+        """
+        ext = Path(src).suffix if ext is None else ext
+        target = self.path_for(digest or file_hash(src), ext)
+        if target.exists():
+            if move:
+                os.unlink(src)
+            return str(target)
+        if move:
+            try:
+                # same filesystem: the rename itself is the atomic write
+                self._target_dir(target)
+                os.replace(src, target)
+                return str(target)
+            except OSError:
+                pass
+        fd, tmp_path = tempfile.mkstemp(dir=self._target_dir(target), prefix='.tmp-')
+        os.close(fd)
+        shutil.copyfile(src, tmp_path)
+        path = self._commit(tmp_path, target)
+        if move:
+            os.unlink(src)
+        return path
+
+    def put_stream(self, fileobj, ext='', feed=None, verify=None, chunk_size=STREAM_CHUNK):
+        """
+        Store everything read from `fileobj` in one pass, hashing as it is written;
+        returns (path, digest). Each chunk is also passed to `feed`. `verify(tmp_path)`
+        runs before the file is committed: it may raise to reject the file (nothing is
+        stored) or return the extension to store it under instead of `ext`.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        # staged at the root, which shares the filesystem with every shard
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        h = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    if feed is not None:
+                        feed(chunk)
+                    h.update(chunk)
+                    f.write(chunk)
+            if verify is not None:
+                ext = verify(tmp_path) or ext
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        digest = h.hexdigest()
+        target = self.path_for(digest, ext)
+        self._target_dir(target)
+        return self._commit(tmp_path, target), digest
+
+
+_BACKENDS = {'local': LocalBlobStore}
+_store = None
+
+
+def register_backend(name, factory):
+    """Make a backend available as SITESCAN_BLOB_BACKEND=name; `factory()` returns the store."""
+    _BACKENDS[name] = factory
+
+
+def get_store():
+    """Process-wide store for SITESCAN_BLOB_BACKEND."""
+    global _store
+    if _store is None:
+        name = os.environ.get('SITESCAN_BLOB_BACKEND', 'local')
+        if name not in _BACKENDS:
+            raise ValueError(f'unknown blob backend {name!r} (registered: {", ".join(_BACKENDS)})')
+        _store = _BACKENDS[name]()
+    return _store
+
+
+def put_bytes(data, ext=''):
+    return get_store().put_bytes(data, ext)
+
+
+def put_file(src, ext=None, move=False, digest=None):
+    return get_store().put_file(src, ext=ext, move=move, digest=digest)
+
+
+def put_stream(fileobj, ext='', feed=None, verify=None):
+    return get_store().put_stream(fileobj, ext, feed=feed, verify=verify)
+
+
+def migrate_artifact_files(conn, keep=False, chunk_size=500, log=print):
+    """
+    Move files referenced by the artifacts table into the store and update the paths.
+    Rows already in the store are skipped, so an interrupted run can simply be repeated.
+    Old files are removed after the new paths are committed, unless `keep` is set or
+    another row still points at them. Returns counts of files moved, files that duplicated
+    one already in the store (`deduplicated`, not included in `moved`) and missing files.
+    """
+    from db import iter_artifact_files, update_artifact_paths_batch, referenced_paths, FILE_COLUMNS
+    store = get_store()
+    stats = {'moved': 0, 'deduplicated': 0, 'missing': 0}
+    start = time.time()
+    for rows in iter_artifact_files(conn, chunk_size=chunk_size):
+        updates = {}
+        old_paths = []
+        for aid, *paths in rows:
+            for col, path in zip(FILE_COLUMNS, paths):
+                if not path or store.contains(path):
+                    continue
+                if not os.path.exists(path):
+                    stats['missing'] += 1
+                    continue
+                digest = file_hash(path)
+                duplicate = store.path_for(digest, Path(path).suffix).exists()
+                new_path = store.put_file(path, digest=digest)
+                updates.setdefault(aid, {})[col] = new_path
+                old_paths.append(path)
+                stats['deduplicated' if duplicate else 'moved'] += 1
+        if updates:
+            update_artifact_paths_batch(conn, updates)
+        if not keep and old_paths:
+            still_used = referenced_paths(conn, old_paths)
+            for path in set(old_paths) - still_used:
+                if os.path.exists(path):
+                    os.unlink(path)
+        elapsed = time.time() - start
+        log(f"{stats['moved']} files moved, {stats['deduplicated']} duplicates, {stats['missing']} missing "
+            f"in {elapsed:.1f}s")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SiteScan content-addressed blob store')
+    sub = parser.add_subparsers(dest='command', required=True)
+    mig = sub.add_parser('migrate', help='move existing artifact files into the store')
+    mig.add_argument('--keep', action='store_true', help='copy instead of move (old files stay)')
+    mig.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    from db import get_conn
+    if args.command == 'migrate':
+        migrate_artifact_files(get_conn(), keep=args.keep, chunk_size=args.chunk_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
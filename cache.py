@@ -0,0 +1,181 @@
+"""
+On-disk result cache for the image processing stages.
+
+Results of `run_ocr`, `recognize_images` and `reconstruct_stub` are stored under a
+key made of the SHA-256 of the image bytes plus the stage name, its parameters and
+the model/engine version, so re-uploads, merged tablet DBs and "Regenerate
+reconstruction" on an unchanged photo cost a lookup instead of a recompute.
+
+The cache is a single SQLite file (default `data/cache/results.db`, WAL mode so
+ingest processes and the app share it) bounded by total value size; least
+recently used entries are evicted first. Each process keeps a running total
+(summed once when it opens the file, then its own writes) and evicts down to
+EVICT_TO of the bound when that total crosses it, so other processes' writes can
+push the file over the bound until the next eviction. A hit records its access
+time only when the stored one is more than TOUCH_SECONDS old.
+
+Environment:
+  - SITESCAN_CACHE_DIR     cache directory (default `data/cache`)
+  - SITESCAN_CACHE_MAX_MB  size bound in MB (default 512, 0 disables the cache)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_DIR = Path(os.environ.get('SITESCAN_CACHE_DIR', 'data/cache'))
+CACHE_MAX_BYTES = int(float(os.environ.get('SITESCAN_CACHE_MAX_MB', '512')) * 1024 * 1024)
+# LRU order only needs to be right to within this many seconds
+TOUCH_SECONDS = 300
+# an eviction frees this much headroom, so it does not run again on the next put
+EVICT_TO = 0.9
+
+CREATE_CACHE_SQL = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    stage TEXT,
+    value BLOB,
+    size INTEGER,
+    last_access REAL
+);
+-- covers the size sum and the eviction scan, so neither reads the values
+CREATE INDEX IF NOT EXISTS idx_results_lru ON results(last_access, size);
+'''
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(content_hash, stage, version, params=None):
+    raw = json.dumps([content_hash, stage, version, params or {}], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.enabled = max_bytes > 0
+        self.max_bytes = max_bytes
+        self.path = Path(cache_dir) / 'results.db'
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._bytes = 0
+
+    def _get_conn(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.executescript(CREATE_CACHE_SQL)
+            self._bytes = self._total(conn)
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """Return the cached bytes for `key`, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                row = conn.execute('SELECT value, last_access FROM results WHERE key=?', (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                now = time.time()
+                if now - (row[1] or 0) > TOUCH_SECONDS:
+                    conn.execute('UPDATE results SET last_access=? WHERE key=?', (now, key))
+                self.hits += 1
+                return row[0]
+            except sqlite3.Error:
+                self.misses += 1
+                return None
+
+    def put(self, key, stage, value):
+        if not self.enabled or value is None:
+            return
+        value = bytes(value)
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                conn.execute('INSERT OR REPLACE INTO results (key, stage, value, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                             (key, stage, value, len(value), time.time()))
+                # a replaced entry is counted twice until the next eviction recounts
+                self._bytes += len(value)
+                if self._bytes > self.max_bytes:
+                    self._evict(conn)
+            except sqlite3.Error:
+                pass
+
+    @staticmethod
+    def _total(conn):
+        return conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def _evict(self, conn):
+        # recount: other processes write to the same file
+        total = self._total(conn)
+        target = self.max_bytes * EVICT_TO
+        victims = []
+        if total > self.max_bytes:
+            for rowid, size in conn.execute('SELECT rowid, size FROM results ORDER BY last_access'):
+                if total <= target:
+                    break
+                victims.append((rowid,))
+                total -= size
+            conn.executemany('DELETE FROM results WHERE rowid=?', victims)
+        self.evictions += len(victims)
+        self._bytes = total
+
+    def get_json(self, key):
+        raw = self.get(key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(bytes(raw).decode('utf-8'))
+        except ValueError:
+            return None
+
+    def put_json(self, key, stage, value):
+        self.put(key, stage, json.dumps(value).encode('utf-8'))
+
+    def stats(self):
+        out = {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+               'entries': 0, 'bytes': 0, 'max_bytes': self.max_bytes}
+        if self.enabled:
+            with self._lock:
+                try:
+                    out['entries'], out['bytes'] = self._get_conn().execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+                except sqlite3.Error:
+                    pass
+        return out
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._get_conn().execute('DELETE FROM results')
+            self._bytes = 0
+
+
+_cache = None
+
+
+def get_cache():
+    """Process-wide cache instance."""
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
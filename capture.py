@@ -0,0 +1,78 @@
+"""
+Capture pipeline behind the "Create artifact record" button.
+
+Only the fields shown right after an upload are produced before the record is
+saved. The upload is streamed into the blob store first (utils.store_image),
+which rejects anything that is not a readable image before any other work
+starts and adds the photo's EXIF capture time, GPS position and camera to the
+metadata. Then OCR and thumbnails run concurrently on a shared thread pool and
+share one decoded image (imaging.ImageSource); Tesseract (ocr_pool.py) and PIL
+release the GIL, so the stages overlap. The QR code is not stored; the detail
+view renders it on demand (qrcodes.py). The perceptual hash used to spot
+near-duplicates (dedupe.py) comes from the thumbnails' draft decode. Labels and the reconstruction are
+filled in afterwards by 'recognize' and 'reconstruct' jobs (see jobs.py), which
+the detail view picks up on refresh. Saving an upload takes about as long as its
+slowest fast stage (usually OCR) instead of the sum of every stage.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import insert_artifact, create_job
+
+# jobs queued for every new record; recognition first, it is what users look at
+BACKGROUND_JOBS = (('recognize', 10), ('reconstruct', 5))
+
+# shared across Streamlit sessions and reruns
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='capture')
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    return fn(*args, **kwargs), time.perf_counter() - t0
+
+
+def create_artifact(conn, upload, metadata):
+    """
+    Save an uploaded image as a new artifact and queue its slow stages.
+
+    Returns (record, timings) where timings maps stage -> seconds, including
+    'total' for the time until the record was committed. Raises
+    imaging.InvalidImage if the upload is not a readable image.
+    """
+    from dedupe import image_phash, to_db
+    from ocr import ocr_image
+    from utils import generate_id, timestamp, store_image, make_thumbnails
+    t0 = time.perf_counter()
+    upload.seek(0)
+    (src, exif), save_s = _timed(store_image, upload, upload.name)
+    if exif:
+        metadata = dict(metadata, exif=exif)
+    aid = generate_id()
+    # one decoded image for both stages; whichever needs it first decodes it
+    ocr = _pool.submit(_timed, ocr_image, src)
+    thumbs = _pool.submit(_timed, make_thumbnails, src, aid)
+    ocr_result, ocr_s = ocr.result()
+    (thumb_path, thumb_md_path), thumbs_s = thumbs.result()
+    # reuses the draft the thumbnails just decoded
+    phash, phash_s = _timed(image_phash, src)
+    record = {
+        'id': aid,
+        'filename': upload.name,
+        'image_path': src.path,
+        'qr_path': None,
+        'ocr_text': ocr_result['text'],
+        'ocr_words': ocr_result['words'],
+        'labels': [],
+        'reconstruction_path': None,
+        'thumb_path': thumb_path,
+        'thumb_md_path': thumb_md_path,
+        'phash': to_db(phash),
+        'metadata': metadata,
+        'created_at': timestamp(),
+    }
+    insert_artifact(conn, record)
+    for job_type, priority in BACKGROUND_JOBS:
+        create_job(conn, aid, job_type, priority=priority)
+    timings = {'save': save_s, 'ocr': ocr_s, 'thumbnails': thumbs_s, 'phash': phash_s,
+               'total': time.perf_counter() - t0}
+    return record, timings
@@ -1,5 +1,8 @@
 import sqlite3
 import json
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
 
 DB_PATH = Path("data/sitescan.db")
@@ -43,80 +46,685 @@ CREATE TABLE IF NOT EXISTS jobs (
 );
 '''
 
+# source files already ingested by the bulk ingest CLI (see ingest.py); written in
+# the same transaction as the artifact so a crashed run can resume exactly
+CREATE_INGEST_LOG_SQL = '''
+CREATE TABLE IF NOT EXISTS ingest_log (
+    source_path TEXT PRIMARY KEY,
+    artifact_id TEXT,
+    ingested_at TEXT
+);
+'''
 
-def get_conn():
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+# Search schema: site/spot/fragile promoted out of the metadata JSON into indexed
+# columns, tags in a join table and an FTS5 index over the free-text fields. The
+# tag table and FTS index are maintained by triggers so every write path stays in sync.
+SEARCH_SCHEMA_SQL = '''
+CREATE INDEX IF NOT EXISTS idx_artifacts_site ON artifacts(site);
+CREATE INDEX IF NOT EXISTS idx_artifacts_spot ON artifacts(spot);
+CREATE INDEX IF NOT EXISTS idx_artifacts_fragile ON artifacts(fragile);
+
+CREATE TABLE IF NOT EXISTS artifact_tags (
+    artifact_id TEXT,
+    tag TEXT,
+    PRIMARY KEY (artifact_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_artifact_tags_tag ON artifact_tags(tag, artifact_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS artifacts_fts USING fts5(filename, ocr_text, notes, labels);
+
+CREATE TRIGGER IF NOT EXISTS artifacts_ai AFTER INSERT ON artifacts BEGIN
+    INSERT INTO artifacts_fts (rowid, filename, ocr_text, notes, labels) VALUES (
+        new.rowid, new.filename, new.ocr_text,
+        CASE WHEN json_valid(new.metadata) THEN json_extract(new.metadata, '$.notes') END,
+        CASE WHEN json_valid(new.labels) THEN (SELECT group_concat(json_extract(value, '$.label'), ' ') FROM json_each(new.labels)) END);
+    INSERT OR IGNORE INTO artifact_tags (artifact_id, tag)
+        SELECT new.id, value FROM json_each(CASE WHEN json_valid(new.metadata) THEN new.metadata ELSE '{}' END, '$.tags');
+END;
+
+-- only when a searched column really changes: hashes, thumbnails, duplicate groups
+-- and upserts that rewrite a row unchanged leave the index and tags alone
+CREATE TRIGGER IF NOT EXISTS artifacts_au AFTER UPDATE OF filename, ocr_text, labels, metadata ON artifacts
+WHEN old.filename IS NOT new.filename OR old.ocr_text IS NOT new.ocr_text
+    OR old.labels IS NOT new.labels OR old.metadata IS NOT new.metadata BEGIN
+    DELETE FROM artifacts_fts WHERE rowid = old.rowid;
+    INSERT INTO artifacts_fts (rowid, filename, ocr_text, notes, labels) VALUES (
+        new.rowid, new.filename, new.ocr_text,
+        CASE WHEN json_valid(new.metadata) THEN json_extract(new.metadata, '$.notes') END,
+        CASE WHEN json_valid(new.labels) THEN (SELECT group_concat(json_extract(value, '$.label'), ' ') FROM json_each(new.labels)) END);
+    DELETE FROM artifact_tags WHERE artifact_id = old.id;
+    INSERT OR IGNORE INTO artifact_tags (artifact_id, tag)
+        SELECT new.id, value FROM json_each(CASE WHEN json_valid(new.metadata) THEN new.metadata ELSE '{}' END, '$.tags');
+END;
+
+CREATE TRIGGER IF NOT EXISTS artifacts_ad AFTER DELETE ON artifacts BEGIN
+    DELETE FROM artifacts_fts WHERE rowid = old.rowid;
+    DELETE FROM artifact_tags WHERE artifact_id = old.id;
+END;
+'''
+
+# upsert rather than INSERT OR REPLACE: REPLACE deletes the old row without firing
+# delete triggers, which would leave stale FTS/tag rows behind
+INSERT_ARTIFACT_SQL = '''INSERT INTO artifacts
+    (id, filename, image_path, qr_path, ocr_text, labels, reconstruction_path, metadata, created_at,
+     thumb_path, thumb_md_path, ocr_words, phash, site, spot, fragile)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        filename=excluded.filename, image_path=excluded.image_path, qr_path=excluded.qr_path,
+        ocr_text=excluded.ocr_text, labels=excluded.labels, reconstruction_path=excluded.reconstruction_path,
+        metadata=excluded.metadata, created_at=excluded.created_at,
+        thumb_path=excluded.thumb_path, thumb_md_path=excluded.thumb_md_path, ocr_words=excluded.ocr_words,
+        phash=COALESCE(excluded.phash, artifacts.phash), site=excluded.site, spot=excluded.spot, fragile=excluded.fragile
+    '''
+
+ARTIFACT_COLUMNS = ['id', 'filename', 'image_path', 'qr_path', 'ocr_text', 'labels', 'reconstruction_path', 'metadata', 'created_at',
+                    'thumb_path', 'thumb_md_path', 'ocr_words', 'phash']
+
+# columns returned by list_artifacts/search_artifacts for gallery rows
+LIST_COLUMNS = 'id, filename, image_path, created_at, thumb_path'
+
+
+
+def timestamp():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def _add_columns(conn, table, columns):
+    existing = {r[1] for r in conn.execute(f'PRAGMA table_info({table})')}
+    for name, decl in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
+
+
+def _migrate_search_schema(conn):
+    _add_columns(conn, 'artifacts', [('site', 'TEXT'), ('spot', 'TEXT'), ('fragile', 'INTEGER DEFAULT 0')])
+    # backfill promoted columns for rows written before the migration
+    conn.execute('''UPDATE artifacts SET
+        site = json_extract(metadata, '$.site'),
+        spot = json_extract(metadata, '$.spot'),
+        fragile = CASE WHEN json_extract(metadata, '$.fragile') THEN 1 ELSE 0 END
+        WHERE json_valid(metadata)''')
+    conn.executescript(SEARCH_SCHEMA_SQL)
+    conn.execute('''INSERT INTO artifacts_fts (rowid, filename, ocr_text, notes, labels)
+        SELECT rowid, filename, ocr_text,
+            CASE WHEN json_valid(metadata) THEN json_extract(metadata, '$.notes') END,
+            CASE WHEN json_valid(labels) THEN (SELECT group_concat(json_extract(value, '$.label'), ' ') FROM json_each(labels)) END
+        FROM artifacts''')
+    conn.execute('''INSERT OR IGNORE INTO artifact_tags (artifact_id, tag)
+        SELECT a.id, t.value FROM artifacts a, json_each(a.metadata, '$.tags') t WHERE json_valid(a.metadata)''')
+
+
+def _migrate_thumbnails(conn):
+    _add_columns(conn, 'artifacts', [('thumb_path', 'TEXT'), ('thumb_md_path', 'TEXT')])
+
+
+def _migrate_ocr_words(conn):
+    # per-word OCR confidences and boxes, JSON list (see ocr.ocr_image)
+    _add_columns(conn, 'artifacts', [('ocr_words', 'TEXT')])
+
+
+def _migrate_listing_index(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_created ON artifacts(created_at, id)')
+
+
+def _migrate_change_versions(conn):
+    _add_columns(conn, 'changes', [('version', 'INTEGER')])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_changes_artifact_version ON changes(artifact_id, version)')
+    # number the existing full-payload rows per artifact in insertion order
+    conn.execute('''UPDATE changes SET version = (
+        SELECT COUNT(*) FROM changes c2 WHERE c2.artifact_id = changes.artifact_id AND c2.id <= changes.id)
+        WHERE version IS NULL''')
+
+
+def _migrate_job_leasing(conn):
+    _add_columns(conn, 'jobs', [('priority', 'INTEGER DEFAULT 0'), ('attempts', 'INTEGER DEFAULT 0'),
+                                ('max_attempts', 'INTEGER DEFAULT 3'), ('run_after', 'REAL'),
+                                ('lease_owner', 'TEXT'), ('lease_expires', 'REAL')])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, job_type, priority DESC, id)')
+
+
+def _migrate_duplicates(conn):
+    # perceptual hash (signed 64-bit, see dedupe.py) and the duplicate cluster it was put in
+    _add_columns(conn, 'artifacts', [('phash', 'INTEGER'), ('dup_group', 'TEXT')])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_phash ON artifacts(phash)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_dup_group ON artifacts(dup_group)')
+
+
+# schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migrate_search_schema,
+    _migrate_thumbnails,
+    _migrate_listing_index,
+    _migrate_change_versions,
+    _migrate_job_leasing,
+    _migrate_ocr_words,
+    _migrate_duplicates,
+]
+
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        step(conn)
+        conn.execute(f'PRAGMA user_version = {i}')
+        conn.commit()
+
+
+def init_schema(conn):
     conn.execute(CREATE_SQL)
     conn.execute(CREATE_CHANGES_SQL)
     conn.execute(CREATE_JOBS_SQL)
+    conn.execute(CREATE_INGEST_LOG_SQL)
     conn.commit()
-    return conn
+    migrate(conn)
 
 
-def insert_artifact(conn, record):
-    sql = '''INSERT OR REPLACE INTO artifacts
-    (id, filename, image_path, qr_path, ocr_text, labels, reconstruction_path, metadata, created_at)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    '''
-    conn.execute(sql, (
-        record.get('id'),
-        record.get('filename'),
-        record.get('image_path'),
-        record.get('qr_path'),
-        record.get('ocr_text'),
-        json.dumps(record.get('labels', [])),
-        record.get('reconstruction_path'),
-        json.dumps(record.get('metadata', {})),
-        record.get('created_at')
-    ))
+class ConnectionManager:
+    """
+    Process-wide access to one SQLite file.
+
+    Schema creation and migrations run once per process, on first use. Each thread
+    gets its own connection (the UI script thread, the job worker, ingest), opened
+    with WAL journaling so readers never block on the writer, a busy timeout instead
+    of immediate "database is locked" errors, and synchronous=NORMAL, which is
+    durable across application crashes in WAL mode.
+    """
+
+    def __init__(self, path=None, wal=True, busy_timeout_ms=5000):
+        self.path = Path(path or DB_PATH)
+        self.wal = wal
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=self.busy_timeout_ms / 1000)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        if self.wal:
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _ensure_initialized(self, conn):
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            # journal_mode is persistent in the file, so this only has to happen once
+            conn.execute(f"PRAGMA journal_mode = {'WAL' if self.wal else 'DELETE'}")
+            init_schema(conn)
+            self._initialized = True
+
+    def connection(self):
+        """This thread's connection, reopened if a caller closed it."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.total_changes
+            except sqlite3.ProgrammingError:
+                conn = None
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        self._ensure_initialized(conn)
+        return conn
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ConnectionManager(DB_PATH)
+    return _manager
+
+
+def get_conn():
+    """Connection for the calling thread from the process-wide manager."""
+    return get_manager().connection()
+
+
+def _parse_json(value, default):
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return default
+    return default if value is None else value
+
+
+def _normalize(record):
+    """Record dict with every artifact column and labels/metadata decoded."""
+    out = {k: record.get(k) for k in ARTIFACT_COLUMNS}
+    out['labels'] = _parse_json(record.get('labels'), [])
+    out['ocr_words'] = _parse_json(record.get('ocr_words'), [])
+    out['metadata'] = _parse_json(record.get('metadata'), {})
+    if not isinstance(out['metadata'], dict):
+        out['metadata'] = {}
+    return out
+
+
+def _artifact_params(record):
+    md = record['metadata']
+    return (
+        record['id'],
+        record['filename'],
+        record['image_path'],
+        record['qr_path'],
+        record['ocr_text'],
+        json.dumps(record['labels']),
+        record['reconstruction_path'],
+        json.dumps(md),
+        record['created_at'],
+        record['thumb_path'],
+        record['thumb_md_path'],
+        json.dumps(record['ocr_words']),
+        record['phash'],
+        md.get('site'),
+        md.get('spot'),
+        1 if md.get('fragile') else 0
+    )
+
+
+# Change log: each artifact's history is a sequence of versions. Every
+# SNAPSHOT_EVERY-th version (and the first) stores the full record as a
+# 'snapshot'; the rest store a field-level 'diff' of the form
+# {"set": {field: value}, "unset": [field]}, where metadata keys appear as
+# "metadata.<key>". Rows from before diffs existed have change_type 'upsert'
+# and a full payload, and are treated as snapshots.
+SNAPSHOT_EVERY = 25
+
+
+def _flatten(record):
+    flat = {k: v for k, v in record.items() if k != 'metadata'}
+    for k, v in (record.get('metadata') or {}).items():
+        flat['metadata.' + k] = v
+    return flat
+
+
+def diff_records(old, new):
+    """Field-level diff between two normalized records, or None if they are equal."""
+    a, b = _flatten(old), _flatten(new)
+    changed = {k: v for k, v in b.items() if k not in a or a[k] != v}
+    removed = [k for k in a if k not in b]
+    if not changed and not removed:
+        return None
+    return {'set': changed, 'unset': removed}
+
+
+def apply_diff(record, diff):
+    record = dict(record)
+    record['metadata'] = dict(record.get('metadata') or {})
+    for k, v in diff.get('set', {}).items():
+        if k.startswith('metadata.'):
+            record['metadata'][k[len('metadata.'):]] = v
+        else:
+            record[k] = v
+    for k in diff.get('unset', []):
+        if k.startswith('metadata.'):
+            record['metadata'].pop(k[len('metadata.'):], None)
+        else:
+            record.pop(k, None)
+    return record
+
+
+def _chunks(seq, size=500):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _load_current(conn, ids):
+    out = {}
+    for chunk in _chunks(ids):
+        marks = ','.join('?' * len(chunk))
+        for row in conn.execute(f"SELECT {', '.join(ARTIFACT_COLUMNS)} FROM artifacts WHERE id IN ({marks})", chunk):
+            out[row[0]] = _normalize(dict(zip(ARTIFACT_COLUMNS, row)))
+    return out
+
+
+def _last_versions(conn, ids):
+    out = {}
+    for chunk in _chunks(ids):
+        marks = ','.join('?' * len(chunk))
+        out.update(conn.execute(f'SELECT artifact_id, MAX(version) FROM changes WHERE artifact_id IN ({marks}) GROUP BY artifact_id',
+                                chunk).fetchall())
+    return out
+
+
+def _log_changes(conn, records, current, versions, now):
+    """
+    Append change-log rows for normalized `records` written over `current` (id ->
+    record before the write). Updates `current` and `versions` in place; returns
+    the records that actually changed.
+    """
+    change_rows = []
+    changed = []
+    for r in records:
+        aid = r['id']
+        old = current.get(aid)
+        payload = diff_records(old, r) if old is not None else r
+        if payload is None:
+            continue
+        version = (versions.get(aid) or 0) + 1
+        if old is None or (version - 1) % SNAPSHOT_EVERY == 0:
+            change_type, payload = 'snapshot', r
+        else:
+            change_type = 'diff'
+        change_rows.append((aid, change_type, json.dumps(payload), now, version))
+        changed.append(r)
+        current[aid] = r
+        versions[aid] = version
+    conn.executemany('INSERT INTO changes (artifact_id, change_type, payload, changed_at, version) VALUES (?, ?, ?, ?, ?)',
+                     change_rows)
+    return changed
+
+
+def _update_columns(conn, updates):
+    """
+    Set some columns of many artifacts in one transaction, with the same change-log
+    entries as insert_artifacts_batch so artifact_at_version replays them. `updates`
+    maps id -> {column: value} (values as in a normalized record, e.g. labels as a
+    list); unknown ids are skipped. The write lock is taken before the rows are read,
+    so no concurrent edit can slip in between.
+    """
+    ids = list(updates)
     conn.commit()
-    # record a change
+    conn.execute('BEGIN IMMEDIATE')
     try:
-        payload = json.dumps(record)
-        conn.execute('INSERT INTO changes (artifact_id, change_type, payload, changed_at) VALUES (?, ?, ?, ?)',
-                     (record.get('id'), 'upsert', payload, record.get('created_at') or timestamp()))
+        current = _load_current(conn, ids)
+        versions = _last_versions(conn, ids)
+        records = [dict(current[aid], **cols) for aid, cols in updates.items() if aid in current]
+        changed = _log_changes(conn, records, dict(current), versions, timestamp())
+        conn.executemany(INSERT_ARTIFACT_SQL, [_artifact_params(r) for r in changed])
         conn.commit()
     except Exception:
-        pass
+        conn.rollback()
+        raise
+    return len(updates)
+
+
+def insert_artifacts_batch(conn, records, sources=None):
+    """
+    Insert or update many artifact records in a single transaction, together with
+    their change-log entries (see SNAPSHOT_EVERY). Unchanged records write nothing
+    to the log.
+
+    `sources` optionally maps artifact id -> source file path; those are written to
+    `ingest_log` in the same transaction so bulk ingest can resume after a crash.
+
+    As in _update_columns, the write lock is taken before the current rows and
+    versions are read, so two writers cannot log the same version number.
+    """
+    records = [_normalize(r) for r in records]
+    ids = list({r['id'] for r in records})
+    now = timestamp()
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = _load_current(conn, ids)
+        versions = _last_versions(conn, ids)
+        conn.executemany(INSERT_ARTIFACT_SQL, [_artifact_params(r) for r in records])
+        _log_changes(conn, records, current, versions, now)
+        if sources:
+            conn.executemany('INSERT OR REPLACE INTO ingest_log (source_path, artifact_id, ingested_at) VALUES (?, ?, ?)',
+                             [(src, aid, now) for aid, src in sources.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(records)
+
+
+def insert_artifact(conn, record):
+    return insert_artifacts_batch(conn, [record])
+
+
+def artifact_at_version(conn, artifact_id, version=None):
+    """
+    Rebuild an artifact as of `version` (default: latest) from the nearest
+    snapshot at or before it plus the diffs after it. Returns None if there is no history.
+    """
+    cap = version if version is not None else 2 ** 62
+    row = conn.execute('''SELECT version FROM changes WHERE artifact_id=? AND change_type IN ('snapshot', 'upsert')
+        AND COALESCE(version, 0) <= ? ORDER BY COALESCE(version, 0) DESC, id DESC LIMIT 1''', (artifact_id, cap)).fetchone()
+    if row is None:
+        return None
+    base = row[0] or 0
+    record = None
+    for change_type, payload, _ in conn.execute('''SELECT change_type, payload, version FROM changes
+            WHERE artifact_id=? AND COALESCE(version, 0) >= ? AND COALESCE(version, 0) <= ?
+            ORDER BY COALESCE(version, 0), id''', (artifact_id, base, cap)):
+        data = json.loads(payload)
+        if change_type in ('snapshot', 'upsert'):
+            record = _normalize(data)
+        elif record is not None:
+            record = apply_diff(record, data)
+    return record
+
+
+def get_ingested_sources(conn):
+    cur = conn.cursor()
+    cur.execute('SELECT source_path FROM ingest_log')
+    return {r[0] for r in cur.fetchall()}
+
+
+def iter_artifact_images(conn, chunk_size=500, missing_thumbs=False):
+    """
+    Yield lists of (id, image_path) for all artifacts, `chunk_size` at a time.
+    With `missing_thumbs`, only artifacts without a thumbnail are returned.
+    """
+    last_id = ''
+    extra = ' AND thumb_path IS NULL' if missing_thumbs else ''
+    while True:
+        cur = conn.execute('SELECT id, image_path FROM artifacts WHERE id > ?' + extra + ' ORDER BY id LIMIT ?',
+                           (last_id, chunk_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+def update_labels_batch(conn, labels_by_id):
+    """Set `labels` for many artifacts in one transaction. `labels_by_id` maps id -> label list."""
+    return _update_columns(conn, {aid: {'labels': labels} for aid, labels in labels_by_id.items()})
+
+
+def update_thumbnails_batch(conn, thumbs_by_id):
+    """Set thumbnail paths for many artifacts in one transaction. Maps id -> (small, medium)."""
+    return _update_columns(conn, {aid: {'thumb_path': sm, 'thumb_md_path': md} for aid, (sm, md) in thumbs_by_id.items()})
+
+
+def update_reconstructions_batch(conn, paths_by_id):
+    """Set `reconstruction_path` for many artifacts in one transaction. Maps id -> path."""
+    return _update_columns(conn, {aid: {'reconstruction_path': path} for aid, path in paths_by_id.items()})
+
+
+def iter_artifact_files(conn, chunk_size=500):
+    """Yield lists of (id, image_path, qr_path, reconstruction_path), `chunk_size` at a time."""
+    last_id = ''
+    while True:
+        rows = conn.execute('SELECT id, image_path, qr_path, reconstruction_path FROM artifacts WHERE id > ? '
+                            'ORDER BY id LIMIT ?', (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+FILE_COLUMNS = ('image_path', 'qr_path', 'reconstruction_path')
+
+
+def update_artifact_paths_batch(conn, paths_by_id):
+    """Set file path columns for many artifacts in one transaction. Maps id -> {column: path}."""
+    return _update_columns(conn, {aid: {c: p for c, p in paths.items() if c in FILE_COLUMNS}
+                                  for aid, paths in paths_by_id.items()})
+
+
+def referenced_paths(conn, paths):
+    """The subset of `paths` that some artifact file column still points at (one query)."""
+    arg = json.dumps(list(paths))
+    rows = conn.execute(' UNION '.join(f'SELECT {c} FROM artifacts WHERE {c} IN (SELECT value FROM json_each(?))'
+                                       for c in FILE_COLUMNS), (arg,) * len(FILE_COLUMNS)).fetchall()
+    return {r[0] for r in rows}
+
+
+def iter_artifact_phashes(conn, after_rowid=0, chunk_size=5000):
+    """Yield lists of (rowid, id, phash) for artifacts with a hash, in rowid order."""
+    while True:
+        rows = conn.execute('SELECT rowid, id, phash FROM artifacts WHERE rowid > ? AND phash IS NOT NULL '
+                            'ORDER BY rowid LIMIT ?', (after_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        yield rows
+        after_rowid = rows[-1][0]
+
+
+def count_phashes(conn):
+    """Number of artifacts with a perceptual hash (scans idx_artifacts_phash)."""
+    return conn.execute('SELECT COUNT(phash) FROM artifacts').fetchone()[0]
+
+
+def iter_missing_phashes(conn, chunk_size=500):
+    """Yield lists of (id, image_path) for artifacts without a perceptual hash."""
+    last_id = ''
+    while True:
+        rows = conn.execute('SELECT id, image_path FROM artifacts WHERE id > ? AND phash IS NULL ORDER BY id LIMIT ?',
+                            (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+def update_phash_batch(conn, hashes_by_id):
+    """Set `phash` for many artifacts in one transaction. Maps id -> signed 64-bit hash."""
+    return _update_columns(conn, {aid: {'phash': h} for aid, h in hashes_by_id.items()})
+
+
+def set_duplicate_groups(conn, groups):
+    """Replace all duplicate clusters in one transaction. `groups` maps id -> group id (its oldest member)."""
+    with conn:
+        conn.execute('UPDATE artifacts SET dup_group=NULL WHERE dup_group IS NOT NULL')
+        conn.executemany('UPDATE artifacts SET dup_group=? WHERE id=?', [(g, aid) for aid, g in groups.items()])
+    return len(groups)
+
+
+def get_duplicate_group(conn, artifact_id):
+    """Gallery rows (LIST_COLUMNS) of the other artifacts in this one's duplicate cluster, oldest first."""
+    return conn.execute(f'''SELECT {LIST_COLUMNS} FROM artifacts WHERE dup_group =
+        (SELECT dup_group FROM artifacts WHERE id = ?) AND id != ? ORDER BY created_at, id''',
+                        (artifact_id, artifact_id)).fetchall()
+
+
+def get_artifact_rows(conn, ids):
+    """Gallery rows (LIST_COLUMNS) for `ids`, in the given order; missing ids are skipped."""
+    rows = conn.execute(f'SELECT {LIST_COLUMNS} FROM artifacts WHERE id IN (SELECT value FROM json_each(?))',
+                        (json.dumps(list(ids)),)).fetchall()
+    by_id = {r[0]: r for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def get_created_at(conn, ids):
+    """Map id -> created_at (one query via json_each)."""
+    return dict(conn.execute('SELECT id, created_at FROM artifacts WHERE id IN (SELECT value FROM json_each(?))',
+                             (json.dumps(list(ids)),)).fetchall())
+
+
+def get_label_fields(conn, ids):
+    """Map id -> (filename, site, spot) for label sheets (one query via json_each)."""
+    rows = conn.execute('SELECT id, filename, site, spot FROM artifacts WHERE id IN (SELECT value FROM json_each(?))',
+                        (json.dumps(list(ids)),)).fetchall()
+    return {r[0]: (r[1] or '', r[2] or '', r[3] or '') for r in rows}
 
 
 def get_artifact(conn, id_):
     cur = conn.cursor()
-    cur.execute('SELECT * FROM artifacts WHERE id=?', (id_,))
+    cur.execute(f"SELECT {', '.join(ARTIFACT_COLUMNS)} FROM artifacts WHERE id=?", (id_,))
     row = cur.fetchone()
     if not row:
         return None
-    keys = ['id','filename','image_path','qr_path','ocr_text','labels','reconstruction_path','metadata','created_at']
-    obj = dict(zip(keys, row))
-    obj['labels'] = json.loads(obj['labels']) if obj['labels'] else []
-    obj['metadata'] = json.loads(obj['metadata']) if obj['metadata'] else {}
-    return obj
+    return _normalize(dict(zip(ARTIFACT_COLUMNS, row)))
+
+
+def _keyset(after=None, before=None):
+    """
+    WHERE fragment, params and sort direction for keyset pagination on (created_at, id).
+    `after` pages towards older rows, `before` towards newer ones; both are
+    (created_at, id) cursors taken from a previously returned row (see page_cursor).
+    """
+    if after:
+        return ' AND (created_at, id) < (?, ?) ', list(after), 'DESC'
+    if before:
+        return ' AND (created_at, id) > (?, ?) ', list(before), 'ASC'
+    return '', [], 'DESC'
+
 
+def page_cursor(row):
+    """Cursor for a list_artifacts/search_artifacts row."""
+    return (row[3], row[0])
 
-def list_artifacts(conn, limit=100):
+
+def list_artifacts(conn, limit=100, after=None, before=None):
+    where, params, order = _keyset(after, before)
     cur = conn.cursor()
-    cur.execute('SELECT id, filename, image_path, created_at FROM artifacts ORDER BY created_at DESC LIMIT ?', (limit,))
-    return cur.fetchall()
+    cur.execute(f'SELECT {LIST_COLUMNS} FROM artifacts WHERE 1=1 {where} ORDER BY created_at {order}, id {order} LIMIT ?',
+                params + [limit])
+    rows = cur.fetchall()
+    # always hand back newest-first regardless of paging direction
+    return rows[::-1] if order == 'ASC' else rows
+
+
+def estimate_artifact_count(conn):
+    """
+    Approximate number of artifacts without scanning: max(rowid) is a single
+    b-tree seek. Overestimates only by the number of deleted rows. It grows with
+    every insert, so dedupe also uses it to spot new rows.
+    """
+    row = conn.execute('SELECT MAX(rowid) FROM artifacts').fetchone()
+    return row[0] or 0
+
 
+def _fts_query(text):
+    # quote every token so user input cannot inject FTS syntax; prefix-match the terms
+    tokens = [t.replace('"', '""') for t in text.split()]
+    return ' '.join(f'"{t}"*' for t in tokens if t)
 
-def search_artifacts(conn, query=None, site=None, spot=None, limit=200):
+
+def search_artifacts(conn, query=None, site=None, spot=None, tag=None, fragile=None, limit=200, after=None, before=None):
     cur = conn.cursor()
-    sql = 'SELECT id, filename, image_path, created_at FROM artifacts WHERE 1=1 '
+    sql = f'SELECT {LIST_COLUMNS} FROM artifacts WHERE 1=1 '
     params = []
-    if query:
-        sql += ' AND (id LIKE ? OR filename LIKE ? OR metadata LIKE ?) '
-        q = f"%{query}%"
-        params.extend([q, q, q])
+    if query and query.strip():
+        q = query.strip()
+        # id prefix as a range on the primary key, so a short id from a label finds the record
+        sql += ''' AND ((id >= ? AND id < ?) OR site = ?
+            OR id IN (SELECT artifact_id FROM artifact_tags WHERE tag = ?)
+            OR rowid IN (SELECT rowid FROM artifacts_fts WHERE artifacts_fts MATCH ?)) '''
+        params.extend([q, q[:-1] + chr(ord(q[-1]) + 1), q, q, _fts_query(q)])
     if site:
-        sql += ' AND metadata LIKE ? '
-        params.append(f"%\"site\": \"{site}\"%")
+        sql += ' AND site = ? '
+        params.append(site)
     if spot:
-        sql += ' AND metadata LIKE ? '
-        params.append(f"%\"spot\": \"{spot}\"%")
-    sql += ' ORDER BY created_at DESC LIMIT ? '
-    params.append(limit)
+        sql += ' AND spot = ? '
+        params.append(spot)
+    if tag:
+        sql += ' AND id IN (SELECT artifact_id FROM artifact_tags WHERE tag = ?) '
+        params.append(tag)
+    if fragile is not None:
+        sql += ' AND fragile = ? '
+        params.append(1 if fragile else 0)
+    where, kparams, order = _keyset(after, before)
+    sql += where + f' ORDER BY created_at {order}, id {order} LIMIT ? '
+    params.extend(kparams + [limit])
     cur.execute(sql, params)
-    return cur.fetchall()
+    rows = cur.fetchall()
+    return rows[::-1] if order == 'ASC' else rows
 
 
 def list_changes(conn, artifact_id=None, limit=200):
@@ -128,11 +736,14 @@ def list_changes(conn, artifact_id=None, limit=200):
     return cur.fetchall()
 
 
-def create_job(conn, artifact_id, job_type, params=None):
+def create_job(conn, artifact_id, job_type, params=None, priority=0, max_attempts=3):
+    """Queue a job. Higher `priority` runs first; failures are retried up to `max_attempts` times."""
     now = timestamp()
     cur = conn.cursor()
-    cur.execute('INSERT INTO jobs (artifact_id, job_type, params, status, result, progress, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                (artifact_id, job_type, json.dumps(params or {}), 'pending', None, 0, now, now))
+    cur.execute('''INSERT INTO jobs (artifact_id, job_type, params, status, result, progress, created_at, updated_at,
+                   priority, attempts, max_attempts, run_after) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (artifact_id, job_type, json.dumps(params or {}), 'pending', None, 0, now, now,
+                 priority, 0, max_attempts, time.time()))
     conn.commit()
     return cur.lastrowid
 
@@ -162,39 +773,239 @@ def update_job(conn, job_id, status=None, result=None, progress=None):
 
 def get_pending_jobs(conn, limit=10):
     cur = conn.cursor()
-    cur.execute('SELECT id, artifact_id, job_type, params FROM jobs WHERE status IN ("pending","running") ORDER BY created_at ASC LIMIT ?', (limit,))
+    cur.execute("SELECT id, artifact_id, job_type, params FROM jobs WHERE status IN ('pending','running') ORDER BY priority DESC, id ASC LIMIT ?", (limit,))
     return cur.fetchall()
 
 
+# Job leasing: a worker claims a job by writing its owner id and a lease expiry
+# (epoch seconds) in the same IMMEDIATE transaction that selects it, so two
+# workers can never claim the same job. Running jobs whose lease expired (the
+# worker died) become claimable again.
+JOB_CLAIM_COLUMNS = 'id, artifact_id, job_type, params, attempts, max_attempts'
+
+
+def claim_job(conn, owner, job_types, lease_seconds=60):
+    """
+    Atomically claim the highest-priority runnable job of one of `job_types`.
+    Running jobs whose lease expired are reclaimed while they have attempts left,
+    and marked 'failed' once they have none. Returns a dict (id, artifact_id, job_type, params, attempts, max_attempts) or None.
+    """
+    job_types = list(job_types)
+    if not job_types:
+        return None
+    now = time.time()
+    marks = ','.join('?' * len(job_types))
+    conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # a lease that ran out on the last attempt means the worker died running it
+        # (OOM, crash in a native library): fail it rather than retry it forever
+        conn.execute(f'''UPDATE jobs SET status='failed', result='lease expired on the last attempt (worker died?)',
+            lease_owner=NULL, lease_expires=NULL, updated_at=?
+            WHERE job_type IN ({marks}) AND status = 'running' AND COALESCE(lease_expires, 0) < ?
+                AND COALESCE(attempts, 0) >= COALESCE(max_attempts, 1)''', [timestamp()] + job_types + [now])
+        row = conn.execute(f'''SELECT {JOB_CLAIM_COLUMNS} FROM jobs
+            WHERE job_type IN ({marks}) AND (
+                (status = 'pending' AND COALESCE(run_after, 0) <= ?) OR
+                (status = 'running' AND COALESCE(lease_expires, 0) < ?))
+            ORDER BY priority DESC, id ASC LIMIT 1''', job_types + [now, now]).fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        conn.execute('''UPDATE jobs SET status='running', lease_owner=?, lease_expires=?, attempts=attempts+1,
+            updated_at=? WHERE id=?''', (owner, now + lease_seconds, timestamp(), row[0]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    job = dict(zip(JOB_CLAIM_COLUMNS.split(', '), row))
+    job['attempts'] += 1
+    job['params'] = _parse_json(job['params'], {})
+    return job
+
+
+def heartbeat_job(conn, job_id, owner, lease_seconds=60, progress=None):
+    """Extend the lease on a running job. Returns False if `owner` no longer holds it."""
+    params = [time.time() + lease_seconds, timestamp()]
+    extra = ''
+    if progress is not None:
+        extra = ', progress=?'
+        params.append(progress)
+    cur = conn.execute(f"UPDATE jobs SET lease_expires=?, updated_at=?{extra} WHERE id=? AND lease_owner=? AND status='running'",
+                       params + [job_id, owner])
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def complete_job(conn, job_id, owner, result=None):
+    cur = conn.execute('''UPDATE jobs SET status='succeeded', result=?, progress=100, lease_owner=NULL, lease_expires=NULL,
+        updated_at=? WHERE id=? AND lease_owner=?''', (result, timestamp(), job_id, owner))
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def release_job(conn, job_id, owner, delay_seconds, reason=None):
+    """Put a claimed job back to 'pending' after `delay_seconds` without counting the attempt."""
+    cur = conn.execute('''UPDATE jobs SET status='pending', attempts=MAX(attempts-1, 0), run_after=?, result=?,
+        lease_owner=NULL, lease_expires=NULL, updated_at=? WHERE id=? AND lease_owner=?''',
+                       (time.time() + delay_seconds, reason, timestamp(), job_id, owner))
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def fail_job(conn, job_id, owner, error, backoff_seconds=30):
+    """
+    Record a failed attempt. The job goes back to 'pending' with exponential backoff
+    (backoff_seconds * 2**(attempts-1)) until max_attempts is reached, then 'failed'.
+    Returns the new status, or None if `owner` no longer held the lease.
+    """
+    row = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE id=? AND lease_owner=?', (job_id, owner)).fetchone()
+    if row is None:
+        return None
+    attempts, max_attempts = row[0] or 0, row[1] or 1
+    if attempts < max_attempts:
+        status, run_after = 'pending', time.time() + backoff_seconds * 2 ** max(attempts - 1, 0)
+    else:
+        status, run_after = 'failed', None
+    conn.execute('''UPDATE jobs SET status=?, result=?, run_after=?, lease_owner=NULL, lease_expires=NULL, updated_at=?
+        WHERE id=?''', (status, str(error), run_after, timestamp(), job_id))
+    conn.commit()
+    return status
+
+
 def get_job(conn, job_id):
     cur = conn.cursor()
     cur.execute('SELECT id, artifact_id, job_type, params, status, result, progress, created_at, updated_at FROM jobs WHERE id=?', (job_id,))
     return cur.fetchone()
 
 
-def merge_db_file(conn, other_db_path):
-    # Merge another sqlite DB file into this DB by copying artifacts not present
+# columns every SiteScan database has had since the first version
+MERGE_COLUMNS = ['id', 'filename', 'image_path', 'qr_path', 'ocr_text', 'labels', 'reconstruction_path', 'metadata', 'created_at']
+
+MERGE_POLICIES = ('keep_local', 'keep_remote', 'keep_newest')
+
+
+# remote column -> value stored locally; invalid JSON is replaced like the app always did
+_MERGE_REMOTE_EXPR = {
+    'labels': "CASE WHEN json_valid(o.labels) THEN o.labels ELSE '[]' END",
+    'metadata': "CASE WHEN json_valid(o.metadata) THEN o.metadata ELSE '{}' END",
+}
+
+
+# columns computed from others (column -> its sources): when a merge replaces a
+# source, the local value describes another image, so it is cleared and rebuilt
+# (ingest.py --backfill-thumbnails, dedupe.py cluster, a new OCR run)
+_MERGE_DERIVED = {
+    'thumb_path': ('image_path',),
+    'thumb_md_path': ('image_path',),
+    'phash': ('image_path',),
+    'dup_group': ('image_path',),
+    'ocr_words': ('image_path', 'ocr_text'),
+}
+
+
+def _merge_select_sql():
+    values = [_MERGE_REMOTE_EXPR.get(c, f'o.{c}') for c in MERGE_COLUMNS]
+    values += ["CASE WHEN json_valid(o.metadata) THEN json_extract(o.metadata, '$.site') END",
+               "CASE WHEN json_valid(o.metadata) THEN json_extract(o.metadata, '$.spot') END",
+               "CASE WHEN json_valid(o.metadata) AND json_extract(o.metadata, '$.fragile') THEN 1 ELSE 0 END"]
+    return 'SELECT ' + ', '.join(values) + ' FROM other.artifacts o'
+
+
+def merge_db_file(conn, other_db_path, policy='keep_local', chunk_size=5000):
+    """
+    Merge another SiteScan DB file into this one without loading it into memory.
+
+    The file is ATTACHed and merged with set-based INSERT ... SELECT / UPDATE
+    statements, `chunk_size` remote rows per transaction. Artifacts missing locally
+    are always inserted. For ids present on both sides `policy` decides:
+      - 'keep_local': leave the local row alone (the historic behaviour)
+      - 'keep_remote': overwrite with the remote row
+      - 'keep_newest': take whichever side was updated last (latest change-log
+        entry, falling back to created_at)
+    Every inserted/updated artifact gets a snapshot in `changes`. Thumbnails, hash,
+    duplicate group and word boxes of an updated row are cleared when its image (or
+    OCR text) changes, like those of an inserted row (see _MERGE_DERIVED).
+
+    Returns a report dict with inserted/updated/skipped counts and elapsed seconds,
+    or None if the file could not be merged.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f'unknown merge policy: {policy}')
+    start = time.time()
+    report = {'inserted': 0, 'updated': 0, 'skipped': 0, 'elapsed': 0.0, 'policy': policy}
+    conn.commit()
     try:
-        other = sqlite3.connect(str(other_db_path))
-        cur = other.cursor()
-        cur.execute('SELECT id, filename, image_path, qr_path, ocr_text, labels, reconstruction_path, metadata, created_at FROM artifacts')
-        rows = cur.fetchall()
-        for row in rows:
-            aid = row[0]
-            if not get_artifact(conn, aid):
-                record = dict(zip(['id','filename','image_path','qr_path','ocr_text','labels','reconstruction_path','metadata','created_at'], row))
-                # ensure JSON fields are strings
-                try:
-                    json.loads(record.get('labels') or '[]')
-                except Exception:
-                    record['labels'] = '[]'
-                try:
-                    json.loads(record.get('metadata') or '{}')
-                except Exception:
-                    record['metadata'] = '{}'
-                insert_artifact(conn, record)
-        other.close()
-        return True
-    except Exception:
-        return False
+        conn.execute('ATTACH DATABASE ? AS other', (str(other_db_path),))
+    except sqlite3.Error:
+        return None
+    try:
+        tables = {r[0] for r in conn.execute("SELECT name FROM other.sqlite_master WHERE type='table'")}
+        if 'artifacts' not in tables:
+            return None
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS merge_ids (id TEXT PRIMARY KEY, action TEXT)')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS merge_remote_updated (artifact_id TEXT PRIMARY KEY, updated TEXT)')
+        conn.execute('DELETE FROM temp.merge_remote_updated')
+        if policy == 'keep_newest' and 'changes' in tables:
+            # one pass over the remote change log instead of a lookup per artifact
+            conn.execute('''INSERT INTO temp.merge_remote_updated
+                SELECT artifact_id, MAX(changed_at) FROM other.changes GROUP BY artifact_id''')
+        conn.commit()
 
+        local_cols = ', '.join(f'a.{c}' for c in MERGE_COLUMNS[1:])
+        remote_cols = ', '.join(_MERGE_REMOTE_EXPR.get(c, f'o.{c}') for c in MERGE_COLUMNS[1:])
+        differs = f'({local_cols}) IS NOT ({remote_cols})'
+        if policy == 'keep_local':
+            take_remote = '0'
+        elif policy == 'keep_remote':
+            take_remote = differs
+        else:
+            take_remote = differs + ''' AND
+                COALESCE((SELECT updated FROM temp.merge_remote_updated r WHERE r.artifact_id = o.id), o.created_at) >
+                COALESCE((SELECT MAX(changed_at) FROM main.changes c WHERE c.artifact_id = a.id), a.created_at)'''
+
+        lo, hi = conn.execute('SELECT MIN(rowid), MAX(rowid) FROM other.artifacts').fetchone()
+        if lo is None:
+            return report
+        insert_cols = ', '.join(MERGE_COLUMNS + ['site', 'spot', 'fragile'])
+        # SET expressions see the row as it was before the update
+        clear_derived = ''.join(
+            f''', {col} = CASE WHEN ({', '.join(src)}) IS
+                (SELECT {', '.join('o.' + c for c in src)} FROM other.artifacts o WHERE o.id = artifacts.id)
+                THEN {col} END'''
+            for col, src in _MERGE_DERIVED.items())
+        now = timestamp()
+        for chunk_lo in range(lo - 1, hi, chunk_size):
+            bounds = (chunk_lo, chunk_lo + chunk_size)
+            with conn:
+                conn.execute('DELETE FROM temp.merge_ids')
+                total = conn.execute('SELECT COUNT(*) FROM other.artifacts WHERE rowid > ? AND rowid <= ?', bounds).fetchone()[0]
+                conn.execute(f'''INSERT INTO temp.merge_ids (id, action)
+                    SELECT o.id, CASE WHEN a.id IS NULL THEN 'insert' ELSE 'update' END
+                    FROM other.artifacts o LEFT JOIN main.artifacts a ON a.id = o.id
+                    WHERE o.rowid > ? AND o.rowid <= ? AND o.id IS NOT NULL
+                    AND (a.id IS NULL OR ({take_remote}))''', bounds)
+                inserted = conn.execute(f'''INSERT INTO main.artifacts ({insert_cols})
+                    {_merge_select_sql()} JOIN temp.merge_ids m ON m.id = o.id AND m.action = 'insert'
+                    ''').rowcount
+                updated = conn.execute(f'''UPDATE main.artifacts SET ({insert_cols}) = (
+                    {_merge_select_sql()} WHERE o.id = artifacts.id){clear_derived}
+                    WHERE id IN (SELECT id FROM temp.merge_ids WHERE action = 'update')''').rowcount
+                conn.execute('''INSERT INTO main.changes (artifact_id, change_type, payload, changed_at, version)
+                    SELECT a.id, 'snapshot', json_object(
+                        'id', a.id, 'filename', a.filename, 'image_path', a.image_path, 'qr_path', a.qr_path,
+                        'ocr_text', a.ocr_text, 'labels', json(a.labels), 'reconstruction_path', a.reconstruction_path,
+                        'metadata', json(a.metadata), 'created_at', a.created_at,
+                        'thumb_path', a.thumb_path, 'thumb_md_path', a.thumb_md_path, 'ocr_words', json(a.ocr_words)),
+                        ?, COALESCE((SELECT MAX(version) FROM main.changes c WHERE c.artifact_id = a.id), 0) + 1
+                    FROM main.artifacts a JOIN temp.merge_ids m ON m.id = a.id''', (now,))
+                report['inserted'] += inserted
+                report['updated'] += updated
+                report['skipped'] += total - inserted - updated
+        return report
+    except sqlite3.Error:
+        conn.rollback()
+        return None
+    finally:
+        report['elapsed'] = time.time() - start
+        conn.execute('DETACH DATABASE other')
@@ -0,0 +1,372 @@
+"""
+Near-duplicate detection with perceptual hashes.
+
+Every artifact image gets a 64-bit pHash (`image_phash`): the sign of the
+low-frequency 8x8 block of the DCT of a 32x32 grayscale copy, compared with its
+median. Re-encoded, resized, slightly cropped or re-exposed copies of a photo
+land a few bits apart; different finds are about 32 bits apart. Two images are
+near-duplicates when their hashes differ in at most DUPLICATE_DISTANCE bits
+(SITESCAN_DUP_DISTANCE, default 10). The hash is computed from the same small
+draft decode the thumbnails use, so it adds almost nothing to a capture.
+
+Hashes live in the `phash` column. `find_duplicates` answers "which artifacts
+look like this one" through `HashIndex`, a multi-index hash table: the hash is
+cut into 4 chunks of 16 bits, and any hash within 4 * s + 3 bits of the query
+matches at least one chunk within s bits (pigeonhole). So a lookup probes
+4 x (1 + 16 + 120) buckets for s = 2 and checks the few candidates it finds,
+instead of comparing against every row. The buckets are for collections of
+100k hashes and up (one dig season of photos across sites is already past that):
+a lookup takes 0.06 ms at 100k and 0.2 ms at 1M hashes, where a NumPy scan of
+every hash takes 0.1-0.2 ms and 1.7 ms and grows with every capture
+(benchmarks/bench_dedupe.py). Below SCAN_ROWS hashes the buckets hold about one
+row each and cost more than they save, so a smaller index just scans. The
+process keeps one index, loaded from the database and topped up with new rows
+before each lookup.
+
+`cluster_duplicates` (the 'dedupe' job, or the CLI below) hashes artifacts that
+have no hash yet and groups all near-duplicates with union-find. Each member's
+`dup_group` is set to the id of the group's oldest artifact.
+
+    python dedupe.py backfill          # hash artifacts saved before hashes existed
+    python dedupe.py cluster           # backfill, then rebuild the duplicate groups
+    python dedupe.py find path/to/photo.jpg
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+
+DUPLICATE_DISTANCE = int(os.environ.get('SITESCAN_DUP_DISTANCE', '10'))
+
+HASH_SIZE = 8
+HASH_SAMPLE = 32
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+BUCKETS = 1 << CHUNK_BITS
+# lookups compare rows added since the last rebuild one by one, up to this many
+TAIL_ROWS = 1024
+# below this many rows a lookup scans every hash with NumPy instead of probing buckets
+# (about where a bucket starts to hold one row; see benchmarks/bench_dedupe.py)
+SCAN_ROWS = 1 << 16
+# how often a lookup also checks for older rows that were hashed or deleted
+RECOUNT_SECONDS = 60
+# longest side of the draft the hash is computed from (the medium thumbnail size)
+DRAFT_SIDE = 640
+
+_dct_matrix = None
+
+
+def _dct():
+    global _dct_matrix
+    if _dct_matrix is None:
+        import numpy as np
+        n = HASH_SAMPLE
+        k = np.arange(n)[:, None]
+        m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+        m[0] /= np.sqrt(2.0)
+        _dct_matrix = m
+    return _dct_matrix
+
+
+def phash_pixels(img):
+    """64-bit pHash (unsigned int) of a PIL image."""
+    import numpy as np
+    from PIL import Image
+    small = img.convert('L').resize((HASH_SAMPLE, HASH_SAMPLE), Image.BILINEAR, reducing_gap=2.0)
+    d = _dct()
+    coeffs = (d @ np.asarray(small, dtype=np.float64) @ d.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = (coeffs > np.median(coeffs)).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_phash(image):
+    """pHash of a path or ImageSource, from an oriented draft decode; None if it cannot be decoded."""
+    from imaging import as_source
+    try:
+        src = as_source(image)
+        return phash_pixels(src.oriented(src.draft((DRAFT_SIDE, DRAFT_SIDE))))
+    except Exception:
+        return None
+
+
+def to_db(h):
+    """Unsigned 64-bit hash -> SQLite INTEGER (signed)."""
+    return None if h is None else (h - (1 << 64) if h >= 1 << 63 else h)
+
+
+def from_db(v):
+    return None if v is None else v & 0xFFFFFFFFFFFFFFFF
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+_probe_masks = {}
+
+
+def _masks(radius):
+    """All CHUNK_BITS-bit masks with at most `radius` bits set, as an int64 array."""
+    if radius not in _probe_masks:
+        import numpy as np
+        masks = [0]
+        for r in range(1, radius + 1):
+            masks.extend(sum(1 << b for b in bits) for bits in itertools.combinations(range(CHUNK_BITS), r))
+        _probe_masks[radius] = np.array(masks, dtype=np.int64)
+    return _probe_masks[radius]
+
+
+def _popcount(x):
+    import numpy as np
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    # NumPy < 2
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _ranges(lo, counts):
+    """Concatenation of arange(lo[k], lo[k] + counts[k]) for every k."""
+    import numpy as np
+    ends = np.cumsum(counts)
+    return np.repeat(lo - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+class HashIndex:
+    """
+    Multi-index hashing over 64-bit hashes. For each of the CHUNKS slices the rows
+    are kept sorted by that slice, with the start of every one of its BUCKETS
+    buckets, so all probes of a lookup are a couple of array gathers. Rows added since the last
+    `compact` sit in a short tail that is compared one by one.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.hashes = []
+        # (rows covered, packed hashes, per-chunk keys, orders, bucket starts); swapped as
+        # one tuple so a lookup on another thread never sees half of a rebuild
+        self._base = (0, None, None, None, None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, artifact_id, h):
+        self.ids.append(artifact_id)
+        self.hashes.append(h)
+
+    def compact(self, force=False):
+        """Index the tail once it outgrows TAIL_ROWS (or an eighth of the index)."""
+        import numpy as np
+        built = self._base[0]
+        n = len(self.hashes)
+        if n == built or not force and n - built <= max(TAIL_ROWS, built // 8):
+            return
+        packed = np.array(self.hashes[:n], dtype=np.uint64)
+        shifts = np.arange(CHUNKS, dtype=np.uint64)[:, None] * np.uint64(CHUNK_BITS)
+        keys = ((packed[None, :] >> shifts) & np.uint64(BUCKETS - 1)).astype(np.int64)
+        # all chunks in one array: chunk c's buckets are c * BUCKETS ..., its rows c * n ...
+        flat = (keys + np.arange(CHUNKS)[:, None] * BUCKETS).ravel()
+        starts = np.zeros(CHUNKS * BUCKETS + 1, dtype=np.int64)
+        np.cumsum(np.bincount(flat, minlength=CHUNKS * BUCKETS), out=starts[1:])
+        orders = np.argsort(flat, kind='stable') % n
+        self._base = (n, packed, keys, orders, starts)
+
+    def _probe(self, keys, radius, starts, orders):
+        """Rows sharing a bucket within radius // CHUNKS bits of `keys` (shape CHUNKS x k), per key."""
+        import numpy as np
+        masks = _masks(radius // CHUNKS)
+        offsets = np.arange(CHUNKS)[:, None, None] * BUCKETS
+        probe = ((keys[:, :, None] ^ masks) + offsets).ravel()
+        lo = starts[probe]
+        counts = starts[probe + 1] - lo
+        return orders[_ranges(lo, counts)], counts
+
+    def search(self, h, radius=None):
+        """[(distance, artifact_id)] within `radius` bits of `h`, nearest first."""
+        radius = DUPLICATE_DISTANCE if radius is None else radius
+        built, packed, _, orders, starts = self._base
+        found = []
+        if built:
+            import numpy as np
+            if built < SCAN_ROWS:
+                # buckets hold under one row on average: one pass over every hash is cheaper
+                dist = _popcount(packed ^ np.uint64(h))
+                cand = np.nonzero(dist <= radius)[0]
+                dist = dist[cand]
+            else:
+                keys = np.array([[(h >> (c * CHUNK_BITS)) & (BUCKETS - 1)] for c in range(CHUNKS)], dtype=np.int64)
+                cand = self._probe(keys, radius, starts, orders)[0]
+                # a row can turn up in several chunks; only the few hits are deduplicated
+                cand = np.unique(cand[_popcount(packed[cand] ^ np.uint64(h)) <= radius])
+                dist = _popcount(packed[cand] ^ np.uint64(h))
+            found = list(zip(dist.tolist(), cand.tolist()))
+        hashes = self.hashes
+        for i in range(built, len(hashes)):
+            d = (hashes[i] ^ h).bit_count()
+            if d <= radius:
+                found.append((d, i))
+        ids = self.ids
+        return sorted((d, ids[i]) for d, i in found)
+
+    def pairs(self, radius=None, block=4096):
+        """Arrays (i, j) of positions, i < j, whose hashes are within `radius` bits."""
+        import numpy as np
+        radius = DUPLICATE_DISTANCE if radius is None else radius
+        self.compact(force=True)
+        n, packed, keys, orders, starts = self._base
+        found = [np.zeros(0, dtype=np.int64)]
+        # `block` rows at a time probe all their neighbouring buckets in one go
+        per_row = CHUNKS * len(_masks(radius // CHUNKS))
+        for first in range(0, n, block):
+            rows = np.arange(first, min(first + block, n))
+            j, counts = self._probe(keys[:, rows], radius, starts, orders)
+            # probes are laid out chunk-major, then row, then mask
+            i = np.repeat(np.tile(np.repeat(rows, per_row // CHUNKS), CHUNKS), counts)
+            keep = i < j
+            i, j = i[keep], j[keep]
+            keep = _popcount(packed[i] ^ packed[j]) <= radius
+            found.append(i[keep] * n + j[keep])
+        pairs = np.unique(np.concatenate(found))
+        return pairs // max(n, 1), pairs % max(n, 1)
+
+
+class _DbIndex:
+    """HashIndex over the `phash` column, kept current with cheap incremental loads."""
+
+    def __init__(self):
+        self.index = HashIndex()
+        self.max_rowid = 0
+        self.counted_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        from db import iter_artifact_phashes
+        for rows in iter_artifact_phashes(conn, after_rowid=self.max_rowid):
+            for rowid, aid, h in rows:
+                self.index.add(aid, from_db(h))
+            self.max_rowid = rows[-1][0]
+
+    def refresh(self, conn, full=False):
+        """
+        Pick up new rows (one indexed MAX(rowid) per call). Every RECOUNT_SECONDS, or
+        when `full`, also count the hashes to catch older rows that were hashed later
+        or deleted, and rebuild if they do not match.
+        """
+        from db import estimate_artifact_count, count_phashes
+        with self._lock:
+            max_rowid = estimate_artifact_count(conn)  # MAX(rowid)
+            if max_rowid > self.max_rowid:
+                self._load(conn)
+                # rows without a hash yet do not need to be looked at again
+                self.max_rowid = max(self.max_rowid, max_rowid)
+            if full or time.monotonic() - self.counted_at > RECOUNT_SECONDS:
+                if count_phashes(conn) != len(self.index):
+                    self.index, self.max_rowid = HashIndex(), 0
+                    self._load(conn)
+                    self.max_rowid = max(self.max_rowid, max_rowid)
+                self.counted_at = time.monotonic()
+            self.index.compact()
+            return self.index
+
+
+_db_index = None
+_db_index_lock = threading.Lock()
+
+
+def get_index(conn, full=False):
+    """The process-wide index, brought up to date with the database."""
+    global _db_index
+    with _db_index_lock:
+        if _db_index is None:
+            _db_index = _DbIndex()
+    return _db_index.refresh(conn, full)
+
+
+def find_duplicates(conn, h, exclude=None, radius=None):
+    """[(distance, artifact_id)] of stored artifacts within `radius` bits of hash `h` (unsigned)."""
+    if h is None:
+        return []
+    return [(d, aid) for d, aid in get_index(conn).search(h, radius) if aid != exclude]
+
+
+def backfill_phashes(conn, chunk_size=256, workers=None, log=print):
+    """Hash every artifact that has no `phash` yet; returns how many were hashed."""
+    from concurrent.futures import ThreadPoolExecutor
+    from db import iter_missing_phashes, update_phash_batch
+    done = unreadable = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # unreadable images keep a NULL hash; paging by id moves past them
+        for rows in iter_missing_phashes(conn, chunk_size=chunk_size):
+            hashes = dict(zip([aid for aid, _ in rows], pool.map(lambda r: image_phash(r[1]) if r[1] else None, rows)))
+            update_phash_batch(conn, {aid: to_db(h) for aid, h in hashes.items() if h is not None})
+            ok = sum(h is not None for h in hashes.values())
+            done += ok
+            unreadable += len(rows) - ok
+            log(f'{done} hashed, {unreadable} unreadable')
+    return done
+
+
+def cluster_duplicates(conn, radius=None, backfill=True, log=print):
+    """
+    Group all near-duplicates (transitively, with union-find) and store the groups
+    in `dup_group`. Returns {'groups': n, 'duplicates': artifacts in groups, 'hashed': n}.
+    """
+    from db import get_created_at, set_duplicate_groups
+    hashed = backfill_phashes(conn, log=log) if backfill else 0
+    index = get_index(conn, full=True)
+    parent = list(range(len(index)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(*(a.tolist() for a in index.pairs(radius))):
+        ri, rj = root(i), root(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    members = {}
+    for i in range(len(index)):
+        members.setdefault(root(i), []).append(index.ids[i])
+    clusters = [ids for ids in members.values() if len(ids) > 1]
+    created = get_created_at(conn, [aid for ids in clusters for aid in ids])
+    groups = {}
+    for ids in clusters:
+        oldest = min(ids, key=lambda aid: (created.get(aid) or '', aid))
+        groups.update((aid, oldest) for aid in ids)
+    set_duplicate_groups(conn, groups)
+    stats = {'groups': len(clusters), 'duplicates': len(groups), 'hashed': hashed}
+    log(f"{stats['groups']} duplicate groups covering {stats['duplicates']} artifacts")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SiteScan near-duplicate detection')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('backfill', help='hash artifacts that have no perceptual hash yet')
+    cl = sub.add_parser('cluster', help='backfill, then rebuild the duplicate groups')
+    cl.add_argument('--distance', type=int, default=None, help=f'max differing bits (default {DUPLICATE_DISTANCE})')
+    fd = sub.add_parser('find', help='list stored artifacts that look like an image file')
+    fd.add_argument('image')
+    fd.add_argument('--distance', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from db import get_conn
+    conn = get_conn()
+    if args.command == 'backfill':
+        backfill_phashes(conn)
+    elif args.command == 'cluster':
+        cluster_duplicates(conn, radius=args.distance)
+    else:
+        h = image_phash(args.image)
+        if h is None:
+            parser.error(f'cannot read {args.image}')
+        for d, aid in find_duplicates(conn, h, radius=args.distance):
+            print(f'{aid}\t{d} bits')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
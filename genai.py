@@ -0,0 +1,322 @@
+"""
+Async GenAI provider client (Replicate, Hugging Face Inference API).
+
+One `AsyncGenAIClient` holds a pooled keep-alive HTTP session and a semaphore
+capping how many provider requests are in flight across all jobs. Predictions
+are polled with exponential backoff instead of a fixed sleep, and results are
+streamed to disk. The job worker (jobs.py) runs many reconstructions on one
+event loop; `utils.generate_reconstruction_genai` / `_huggingface` are thin
+synchronous wrappers around the same code.
+
+Endpoints default to the public APIs and can be pointed elsewhere (e.g. a local
+stub server in tests) with REPLICATE_API_URL / HF_API_URL or constructor args.
+
+Before upload, images go through `prepare_upload`: decoded at reduced scale,
+downsampled to the provider's maximum input size and re-encoded (JPEG, or PNG
+when there is transparency) with the matching MIME type. The Replicate JSON body
+is streamed with the base64 produced chunk by chunk, so a 20 MB scan never
+exists as a full-size base64 string. Per-request byte and memory figures are
+kept in `AsyncGenAIClient.upload_metrics`.
+
+Every request passes the provider's token bucket and circuit breaker (see
+providers.py), and finished reconstructions are stored in the result cache
+(cache.py) keyed on image hash, provider, prompt and model version, so an
+identical request is never sent (and billed) twice.
+
+Environment:
+  - GENAI_TOKEN, GENAI_MODEL_VERSION  as before
+  - GENAI_MAX_CONCURRENCY             max in-flight provider requests (default 8)
+  - GENAI_MAX_INPUT_SIDE              longest image edge sent to providers (default 1024)
+"""
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiohttp
+
+from blobstore import put_bytes, put_file
+from cache import get_cache, file_hash, make_key
+from providers import get_breaker, get_limiter, normalize_provider
+from tiles import max_decode_bytes, open_raster, pil_open
+
+REPLICATE_API_URL = os.environ.get('REPLICATE_API_URL', 'https://api.replicate.com/v1')
+HF_API_URL = os.environ.get('HF_API_URL', 'https://api-inference.huggingface.co')
+DEFAULT_PROMPT = 'AI-based reconstruction of an archaeological artifact; realistic, natural textures, fill missing parts'
+DEFAULT_HF_PROMPT = 'AI reconstruction of an archaeological artifact, fill missing parts, photorealistic'
+MAX_INPUT_SIDE = int(os.environ.get('GENAI_MAX_INPUT_SIDE', '1024'))
+
+# formats providers accept as-is; anything else (TIFF, BMP, ...) is always re-encoded
+_PASSTHROUGH_MIME = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+
+
+def prepare_upload(image_path, max_side=MAX_INPUT_SIDE, quality=90):
+    """
+    Return (data, mime, metrics) for sending `image_path` to a provider.
+
+    Small JPEG/PNG/WebP files are sent unchanged. Everything else is decoded (JPEG
+    via draft mode, so only about the target resolution is ever materialised),
+    shrunk to `max_side` and re-encoded. Scans too large for SITESCAN_MAX_DECODE_MB
+    even in draft are shrunk band by band through tiles.py.
+    """
+    from PIL import Image
+    start = time.perf_counter()
+    source_bytes = os.path.getsize(image_path)
+    with pil_open(image_path) as img:
+        fmt = img.format
+        w, h = img.size
+        if fmt in _PASSTHROUGH_MIME and max(w, h) <= max_side:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            mime, decoded_bytes = _PASSTHROUGH_MIME[fmt], 0
+        else:
+            img.draft('RGB', (max_side, max_side))
+            if img.width * img.height * len(img.getbands()) > max_decode_bytes():
+                raster = open_raster(image_path)
+                try:
+                    img, has_alpha = raster.overview(max_side).convert('RGB'), False
+                finally:
+                    raster.close()
+            else:
+                has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+                img = img.convert('RGBA' if has_alpha else 'RGB')
+            decoded_bytes = img.width * img.height * len(img.getbands())
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            buf = io.BytesIO()
+            if has_alpha:
+                img.save(buf, 'PNG', optimize=True)
+                mime = 'image/png'
+            else:
+                img.save(buf, 'JPEG', quality=quality, optimize=True)
+                mime = 'image/jpeg'
+            data = buf.getvalue()
+            w, h = img.size
+    metrics = {
+        'source_bytes': source_bytes,
+        'decoded_bytes': decoded_bytes,
+        'upload_bytes': len(data),
+        'width': w,
+        'height': h,
+        'mime': mime,
+        'prepare_ms': (time.perf_counter() - start) * 1000,
+    }
+    return data, mime, metrics
+
+
+def _b64_chunks(data, chunk_size=3 * 64 * 1024):
+    # chunk size is a multiple of 3 so the pieces concatenate to valid base64
+    view = memoryview(data)
+    for i in range(0, len(data), chunk_size):
+        yield base64.b64encode(view[i:i + chunk_size])
+
+
+async def _json_datauri_body(head, data, mime, tail, counter):
+    """Stream `head` + data URI + `tail` (JSON fragments) without building the full string."""
+    for part in (head, f'data:{mime};base64,'.encode('ascii')):
+        counter[0] += len(part)
+        yield part
+    for chunk in _b64_chunks(data):
+        counter[0] += len(chunk)
+        yield chunk
+    counter[0] += len(tail)
+    yield tail
+
+
+def _is_provider_failure(exc):
+    """Errors that say the provider is unhealthy (as opposed to a bad request)."""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+@asynccontextmanager
+async def provider_call(provider):
+    """Rate-limit and circuit-break one request to `provider`."""
+    breaker = get_breaker(provider)
+    breaker.check()
+    await get_limiter(provider).acquire_async()
+    try:
+        yield
+    except BaseException as e:
+        # every exit settles a half-open trial, or the breaker would wait for it forever
+        if isinstance(e, Exception) and _is_provider_failure(e):
+            breaker.record_failure()
+        elif isinstance(e, aiohttp.ClientResponseError):
+            # the provider answered (e.g. a 4xx for a bad request), so it is up
+            breaker.record_success()
+        else:
+            # cancelled, or failed locally before an answer arrived
+            breaker.release_trial()
+        raise
+    breaker.record_success()
+
+
+class AsyncGenAIClient:
+    def __init__(self, token=None, max_concurrency=None, replicate_url=None, hf_url=None,
+                 poll_initial=1.0, poll_max=15.0, timeout=180):
+        self.token = token or os.environ.get('GENAI_TOKEN')
+        self.max_concurrency = max_concurrency or int(os.environ.get('GENAI_MAX_CONCURRENCY', '8'))
+        self.replicate_url = (replicate_url or REPLICATE_API_URL).rstrip('/')
+        self.hf_url = (hf_url or HF_API_URL).rstrip('/')
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.timeout = timeout
+        self._session = None
+        self._sem = None
+        # one entry per provider upload: bytes read, decoded, encoded and sent
+        self.upload_metrics = deque(maxlen=200)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency * 2, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120))
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _download(self, provider, url, out_path, headers=None):
+        out_path = Path(out_path)
+        tmp = out_path.with_suffix(out_path.suffix + '.part')
+        async with provider_call(provider), self._sem:
+            async with self._session.get(url, headers=headers) as r:
+                r.raise_for_status()
+                with open(tmp, 'wb') as f:
+                    async for chunk in r.content.iter_chunked(64 * 1024):
+                        f.write(chunk)
+        os.replace(tmp, out_path)
+        return str(out_path)
+
+    async def _prepare(self, image_path, provider):
+        loop = asyncio.get_running_loop()
+        data, mime, metrics = await loop.run_in_executor(None, prepare_upload, image_path)
+        metrics['provider'] = provider
+        metrics['image_path'] = str(image_path)
+        return data, mime, metrics
+
+    async def replicate_predict(self, image_path, out_path, model_version, prompt=None):
+        """Run a Replicate prediction and download the first output image. Returns the path or None."""
+        headers = {'Authorization': f'Token {self.token}', 'Content-Type': 'application/json'}
+        data, mime, metrics = await self._prepare(image_path, 'replicate')
+        # {"version": ..., "input": {"prompt": ..., "image": "<data uri>"}}, image streamed last
+        head = (json.dumps({'version': model_version, 'input': {'prompt': prompt or DEFAULT_PROMPT}})[:-2]
+                + ', "image": "').encode('utf-8')
+        sent = [0]
+        async with provider_call('replicate'), self._sem:
+            body = _json_datauri_body(head, data, mime, b'"}}', sent)
+            async with self._session.post(f'{self.replicate_url}/predictions', data=body, headers=headers) as r:
+                r.raise_for_status()
+                data = await r.json()
+        metrics['body_bytes'] = sent[0]
+        self.upload_metrics.append(metrics)
+        pred_id = data.get('id')
+        if not pred_id:
+            return None
+        poll_url = f'{self.replicate_url}/predictions/{pred_id}'
+        status = data.get('status')
+        delay = self.poll_initial
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        # the semaphore is not held while sleeping, so waiting predictions do not block others
+        while status not in ('succeeded', 'failed', 'canceled') and loop.time() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max)
+            async with provider_call('replicate'), self._sem:
+                async with self._session.get(poll_url, headers=headers) as r:
+                    r.raise_for_status()
+                    data = await r.json()
+            status = data.get('status')
+        if status != 'succeeded':
+            return None
+        output = data.get('output')
+        if isinstance(output, str):
+            output = [output]
+        if not output:
+            return None
+        return await self._download('replicate', output[0], out_path)
+
+    async def huggingface_predict(self, image_path, out_path, model, prompt=None):
+        """Call the HF inference endpoint; saves a returned image or a `generated_image` URL."""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        data, mime, metrics = await self._prepare(image_path, 'huggingface')
+        ext = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp'}[mime]
+        async with provider_call('huggingface'), self._sem:
+            form = aiohttp.FormData()
+            form.add_field('inputs', prompt or DEFAULT_HF_PROMPT)
+            form.add_field('image', io.BytesIO(data), filename=Path(image_path).stem + ext, content_type=mime)
+            metrics['body_bytes'] = len(data)
+            self.upload_metrics.append(metrics)
+            async with self._session.post(f'{self.hf_url}/models/{model}', data=form, headers=headers) as r:
+                r.raise_for_status()
+                if 'image' in r.headers.get('content-type', ''):
+                    out_path = Path(out_path)
+                    tmp = out_path.with_suffix(out_path.suffix + '.part')
+                    with open(tmp, 'wb') as out:
+                        async for chunk in r.content.iter_chunked(64 * 1024):
+                            out.write(chunk)
+                    os.replace(tmp, out_path)
+                    return str(out_path)
+                j = await r.json(content_type=None)
+        if isinstance(j, dict) and 'generated_image' in j:
+            return await self._download('huggingface', j['generated_image'], out_path)
+        return None
+
+    async def reconstruct(self, image_path, artifact_id, method, model=None, prompt=None):
+        """
+        Reconstruct with the given provider ('replicate' or 'huggingface'/'hf').
+        The download is staged as data/reconstructions/{artifact_id}_ai.png (or
+        _ai_hf.png) and then moved into the blob store. Returns the blob path, or None
+        if the provider is not configured or returned nothing.
+        """
+        model = model or os.environ.get('GENAI_MODEL_VERSION')
+        if not self.token or not model:
+            return None
+        provider = normalize_provider(method)
+        if provider not in ('replicate', 'huggingface'):
+            return None
+        await self.open()
+        Path('data/reconstructions').mkdir(parents=True, exist_ok=True)
+        suffix = '_ai.png' if provider == 'replicate' else '_ai_hf.png'
+        out_path = Path('data/reconstructions') / f'{artifact_id}{suffix}'
+
+        loop = asyncio.get_running_loop()
+        key = make_key(await loop.run_in_executor(None, file_hash, image_path), 'genai', model,
+                       {'provider': provider, 'prompt': prompt, 'max_side': MAX_INPUT_SIDE})
+        cached = await loop.run_in_executor(None, get_cache().get, key)
+        if cached is not None:
+            return await loop.run_in_executor(None, put_bytes, cached, '.png')
+
+        if provider == 'replicate':
+            result = await self.replicate_predict(image_path, out_path, model, prompt)
+        else:
+            result = await self.huggingface_predict(image_path, out_path, model, prompt)
+        if result:
+            data = await loop.run_in_executor(None, Path(result).read_bytes)
+            await loop.run_in_executor(None, get_cache().put, key, 'genai', data)
+            result = await loop.run_in_executor(None, lambda: put_file(result, '.png', move=True))
+        return result
+
+
+def run_sync(image_path, artifact_id, method, model=None, prompt=None, timeout=180):
+    """Blocking one-off reconstruction (own event loop and session); None on any error."""
+    async def _go():
+        async with AsyncGenAIClient(timeout=timeout) as client:
+            return await client.reconstruct(image_path, artifact_id, method, model=model, prompt=prompt)
+    try:
+        return asyncio.run(_go())
+    except Exception:
+        return None
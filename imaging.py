@@ -0,0 +1,402 @@
+"""
+Decode-once image access shared by the processing stages.
+
+`run_ocr`, `make_thumbnails`, `recognize_images` and `reconstruct_stub` accept
+either a path or an `ImageSource`. A source decodes its file at most once at full
+resolution and caches what the stages derive from it (grayscale, RGB,
+reduced-size drafts, the recognition input array, the content hash used for
+result-cache keys). Stages that only need a small image (thumbnails,
+recognition) use JPEG draft decoding instead of a full decode unless the full
+image is already in memory.
+
+Sources are thread-safe, so the capture flow can run OCR and thumbnails on the
+same source concurrently. When pickled (e.g. returned from an ingest worker
+process), only the hash and the recognition array travel along; the decoded
+images stay behind.
+
+Memory is bounded twice:
+  - SITESCAN_MAX_DECODE_MB (default 768): a file whose full raster would be
+    larger is never decoded whole. `draft` builds its small copies through
+    tiles.py instead, and `image`/`gray` raise ImageTooLarge (OCR switches to
+    its tiled path, see ocr.py).
+  - SITESCAN_MEMORY_LIMIT_MB (default 2048): decodes in this process reserve
+    their size up front and wait, up to SITESCAN_MEMORY_WAIT seconds, while
+    other sources hold the budget. Reservations are returned by `release` or
+    when the source is garbage collected.
+
+New files come in through `ImageProbe` (see utils.store_image). It watches the
+bytes as they are streamed into the blob store. It rejects anything that is not
+an image by its first bytes, then reads the header and EXIF from the buffered
+start of the file. The resulting source starts with its hash, header and
+orientation already known.
+"""
+import io
+import math
+import os
+import threading
+import time
+import weakref
+
+from tiles import ImageTooLarge, max_decode_bytes, open_raster, pil_open
+
+MEMORY_LIMIT_MB = int(os.environ.get('SITESCAN_MEMORY_LIMIT_MB', '2048'))
+MEMORY_WAIT = float(os.environ.get('SITESCAN_MEMORY_WAIT', '60'))
+
+# EXIF orientation -> PIL transpose method (same table as ImageOps.exif_transpose)
+_ORIENTATION_OPS = {2: 'FLIP_LEFT_RIGHT', 3: 'ROTATE_180', 4: 'FLIP_TOP_BOTTOM', 5: 'TRANSPOSE',
+                    6: 'ROTATE_270', 7: 'TRANSVERSE', 8: 'ROTATE_90'}
+
+
+# leading bytes of a stream kept in memory to parse the header and EXIF from
+PROBE_HEAD_BYTES = 512 * 1024
+
+# formats accepted for new artifacts: signature at offset 0 -> (PIL format, stored extension)
+_SIGNATURES = ((b'\xff\xd8\xff', 'JPEG', '.jpg'), (b'\x89PNG\r\n\x1a\n', 'PNG', '.png'),
+               (b'II*\x00', 'TIFF', '.tif'), (b'MM\x00*', 'TIFF', '.tif'), (b'BM', 'BMP', '.bmp'))
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class _Budget:
+    """Bytes of decoded rasters the process may hold at once."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def reserve(self, nbytes, timeout):
+        with self._cond:
+            # a lone decode is always let through; the per-image ceiling bounds it
+            if not self._cond.wait_for(lambda: self.used == 0 or self.used + nbytes <= self.limit, timeout):
+                raise ImageTooLarge(f'memory budget of {self.limit // 2 ** 20} MB in use (SITESCAN_MEMORY_LIMIT_MB)')
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used = max(0, self.used - nbytes)
+            self._cond.notify_all()
+
+
+_budget = _Budget(MEMORY_LIMIT_MB * 1024 * 1024)
+
+
+def _return_held(held):
+    _budget.release(held[0])
+    held[0] = 0
+
+
+def _bytes_per_pixel(mode):
+    if mode in ('I', 'F', 'RGBA', 'RGBX', 'CMYK'):
+        return 4
+    if mode.startswith('I;16'):
+        return 2
+    return 3 if mode in ('RGB', 'YCbCr', 'LAB', 'HSV') else 1
+
+
+class ImageSource:
+    def __init__(self, path, content_hash=None, probe=None):
+        """`content_hash` and a finished `probe` (ImageProbe) spare re-reading the file for them."""
+        self.path = str(path)
+        self.decodes = 0
+        self.decode_seconds = 0.0
+        self._lock = threading.RLock()
+        self._hash = content_hash
+        self._orientation = probe.orientation if probe else None
+        self._header = probe.header if probe else None
+        self._full = None
+        self._variants = {}
+        # bytes reserved from the process budget, returned on release() or collection
+        self._held = [0]
+        weakref.finalize(self, _return_held, self._held)
+
+    def __repr__(self):
+        return f'ImageSource({self.path!r})'
+
+    def __getstate__(self):
+        keep = {k: v for k, v in self._variants.items() if k[0] == 'recognition'}
+        return {'path': self.path, '_hash': self._hash, '_orientation': self._orientation, '_variants': keep}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+        self._hash = state['_hash']
+        self._orientation = state['_orientation']
+        self._variants = state['_variants']
+
+    def _open(self):
+        img = pil_open(self.path)
+        if self._orientation is None:
+            try:
+                self._orientation = img.getexif().get(0x0112, 1)
+            except Exception:
+                self._orientation = 1
+        if self._header is None:
+            dpi = img.info.get('dpi')
+            self._header = (img.size, img.mode, tuple(dpi) if dpi else None)
+        return img
+
+    def _decode(self, img):
+        nbytes = img.size[0] * img.size[1] * _bytes_per_pixel(img.mode)
+        _budget.reserve(nbytes, MEMORY_WAIT)
+        self._held[0] += nbytes
+        t0 = time.perf_counter()
+        img.load()
+        self.decode_seconds += time.perf_counter() - t0
+        self.decodes += 1
+        return img
+
+    def content_hash(self):
+        """SHA-256 of the file bytes (the result-cache key component)."""
+        with self._lock:
+            if self._hash is None:
+                from cache import file_hash
+                self._hash = file_hash(self.path)
+            return self._hash
+
+    @property
+    def orientation(self):
+        with self._lock:
+            if self._orientation is None:
+                self._open().close()
+            return self._orientation
+
+    def _read_header(self):
+        with self._lock:
+            if self._header is None:
+                self._open().close()
+            return self._header
+
+    @property
+    def size(self):
+        """(width, height) from the file header, without decoding."""
+        return self._read_header()[0]
+
+    @property
+    def dpi(self):
+        return self._read_header()[2]
+
+    def too_large(self):
+        """True if the full raster would exceed SITESCAN_MAX_DECODE_MB (see tiles.py)."""
+        (w, h), mode, _ = self._read_header()
+        return w * h * _bytes_per_pixel(mode) > max_decode_bytes()
+
+    def raster(self):
+        """A tiles.Raster over the file, for stages that walk large images tile by tile."""
+        return open_raster(self.path)
+
+    def image(self):
+        """The full-resolution image in its stored mode. Shared: do not modify in place."""
+        with self._lock:
+            if self._full is None:
+                if self.too_large():
+                    w, h = self.size
+                    raise ImageTooLarge(f'{self.path}: {w}x{h} is over SITESCAN_MAX_DECODE_MB '
+                                        f'({max_decode_bytes() // 2 ** 20} MB) to decode whole')
+                self._full = self._decode(self._open())
+            return self._full
+
+    def _variant(self, key, make):
+        with self._lock:
+            if key not in self._variants:
+                self._variants[key] = make()
+            return self._variants[key]
+
+    def gray(self):
+        return self._variant(('L',), lambda: self.image().convert('L'))
+
+    def rgb(self):
+        img = self.image()
+        return img if img.mode == 'RGB' else self._variant(('RGB',), lambda: img.convert('RGB'))
+
+    def draft(self, size):
+        """
+        An RGB image at least `size` (w, h) large (or the full image if smaller), as
+        cheaply as possible: a cached larger variant, the decoded full image, a
+        reduced-scale JPEG decode, or (over the decode ceiling) a tiles.py overview.
+        Shared: do not modify in place.
+        """
+        with self._lock:
+            for key, img in self._variants.items():
+                if key[0] == 'draft' and key[1][0] >= size[0] and key[1][1] >= size[1]:
+                    return img
+            if self._full is not None:
+                return self.rgb()
+            if self.too_large():
+                return self._overview_draft(size)
+            img = self._open()
+            full_size = img.size
+            img.draft('RGB', size)
+            img = self._decode(img)
+            if img.size == full_size:
+                # not a JPEG, or too small to reduce: this was a full decode, keep it as such
+                self._full = img
+                return self.rgb()
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            # key by the requested size: any later request up to it can reuse this
+            self._variants[('draft', tuple(size))] = img
+            return img
+
+    def _overview_draft(self, size):
+        w, h = self.size
+        f = min(1.0, max(size[0] / float(w), size[1] / float(h)))
+        raster = self.raster()
+        try:
+            t0 = time.perf_counter()
+            img = raster.overview(int(math.ceil(max(w, h) * f)))
+            self.decode_seconds += time.perf_counter() - t0
+            self.decodes += 1
+        finally:
+            raster.close()
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        self._variants[('draft', tuple(size))] = img
+        return img
+
+    def oriented(self, img):
+        """Apply this file's EXIF orientation to `img` (a copy is always returned)."""
+        op = _ORIENTATION_OPS.get(self.orientation)
+        if op is None:
+            return img.copy()
+        from PIL import Image
+        return img.transpose(getattr(Image.Transpose, op))
+
+    def recognition_array(self, size):
+        """The float32 (h, w, 3) model input for `size`, resized from a draft decode."""
+        import numpy as np
+
+        def make():
+            return np.asarray(self.draft(size).resize(size), dtype=np.uint8)
+        return self._variant(('recognition', tuple(size)), make).astype(np.float32)
+
+    def release(self):
+        """Drop decoded images (keeps the hash and the small recognition arrays)."""
+        with self._lock:
+            self._full = None
+            self._variants = {k: v for k, v in self._variants.items() if k[0] == 'recognition'}
+            _return_held(self._held)
+
+
+def _rational(value):
+    try:
+        return float(value[0]) / float(value[1]) if isinstance(value, tuple) else float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _gps_degrees(dms, ref):
+    parts = [_rational(v) for v in (dms or ())]
+    if len(parts) != 3 or None in parts:
+        return None
+    deg = parts[0] + parts[1] / 60.0 + parts[2] / 3600.0
+    return round(-deg if str(ref).upper() in ('S', 'W') else deg, 7)
+
+
+def _exif_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return str(value).strip('\x00 ') if value is not None else ''
+
+
+def exif_metadata(img):
+    """
+    Capture time, GPS position and camera from a PIL image's EXIF, as a dict with
+    only the fields that are present: captured_at (ISO 8601, with the offset when
+    recorded), gps {lat, lon[, alt]}, camera ("Make Model").
+    """
+    out = {}
+    try:
+        exif = img.getexif()
+    except Exception:
+        return out
+    # Exif IFD: DateTimeOriginal / OffsetTimeOriginal, falling back to IFD0 DateTime
+    sub = exif.get_ifd(0x8769)
+    taken = _exif_text(sub.get(0x9003) or exif.get(0x0132))
+    if len(taken) >= 19 and taken[4] == ':' and not taken.startswith('0000'):
+        out['captured_at'] = taken[:10].replace(':', '-') + 'T' + taken[11:19] + _exif_text(sub.get(0x9011))
+    gps = exif.get_ifd(0x8825)
+    lat, lon = _gps_degrees(gps.get(2), gps.get(1)), _gps_degrees(gps.get(4), gps.get(3))
+    if lat is not None and lon is not None and (lat, lon) != (0.0, 0.0):
+        out['gps'] = {'lat': lat, 'lon': lon}
+        alt = _rational(gps.get(6)) if 6 in gps else None
+        if alt is not None:
+            # GPSAltitudeRef 1 = below sea level
+            out['gps']['alt'] = round(-alt if gps.get(5) in (1, b'\x01') else alt, 1)
+    make, model = _exif_text(exif.get(0x010F)), _exif_text(exif.get(0x0110))
+    camera = model if make and model.lower().startswith(make.split()[0].lower()) else f'{make} {model}'.strip()
+    if camera:
+        out['camera'] = camera
+    return out
+
+
+class ImageProbe:
+    """
+    Validates a file while it is streamed somewhere else: `feed` every chunk in
+    order, then `finish(path)` with the written file. The signature is checked on
+    the first chunk and the header and EXIF are parsed from the first
+    PROBE_HEAD_BYTES, so a bad file is rejected (InvalidImage) before it is stored
+    or decoded. After `finish`: format, ext, header ((w, h), mode, dpi),
+    orientation and exif (see exif_metadata).
+    """
+
+    def __init__(self, name=''):
+        self.name = name
+        self.format = None
+        self.ext = None
+        self.header = None
+        self.orientation = 1
+        self.exif = {}
+        self.nbytes = 0
+        self._head = bytearray()
+
+    def _reject(self, why):
+        raise InvalidImage(f'{self.name or "upload"}: {why}')
+
+    def feed(self, chunk):
+        if len(self._head) < PROBE_HEAD_BYTES:
+            self._head += chunk[:PROBE_HEAD_BYTES - len(self._head)]
+        self.nbytes += len(chunk)
+        if self.format is None and len(self._head) >= 8:
+            for magic, fmt, ext in _SIGNATURES:
+                if self._head.startswith(magic):
+                    self.format, self.ext = fmt, ext
+                    break
+            else:
+                self._reject('not a JPEG, PNG, TIFF or BMP image')
+
+    def finish(self, path=None):
+        """Parse the header; `path` is read only if it lies beyond the buffered head."""
+        if self.format is None:
+            self._reject('empty or truncated file' if self.nbytes < 8 else 'not an image')
+        try:
+            img = pil_open(io.BytesIO(bytes(self._head)))
+        except Exception:
+            # e.g. a TIFF whose first IFD is written after the pixel data
+            if path is None or self.nbytes <= len(self._head):
+                self._reject('unreadable image header')
+            try:
+                img = pil_open(path)
+            except Exception:
+                self._reject('unreadable image header')
+        with img:
+            if img.format != self.format:
+                self._reject(f'{img.format} data with a {self.format} signature')
+            w, h = img.size
+            if w < 1 or h < 1:
+                self._reject(f'invalid size {w}x{h}')
+            dpi = img.info.get('dpi')
+            self.header = (img.size, img.mode, tuple(dpi) if dpi else None)
+            try:
+                self.orientation = img.getexif().get(0x0112, 1)
+            except Exception:
+                self.orientation = 1
+            self.exif = exif_metadata(img)
+        self._head = bytearray()
+        return self
+
+
+def as_source(image):
+    """Wrap a path in an ImageSource; sources are returned unchanged."""
+    return image if isinstance(image, ImageSource) else ImageSource(image)
@@ -0,0 +1,288 @@
+"""
+Headless bulk ingest for SiteScan.
+
+Runs the same pipeline as the "Create artifact record" button in `app.py`
+(save image -> OCR -> recognition -> reconstruction -> insert) over a
+directory of photos or a CSV manifest, using a process pool.
+
+Examples:
+
+    python ingest.py /media/sdcard/DCIM --site "Trench A" --tags pottery,day3
+    python ingest.py manifest.csv --workers 6 --batch-size 100
+
+A manifest is a CSV with a `path` column (relative to the manifest file or absolute)
+and optional `site`, `spot`, `fragile`, `tags` and `notes` columns. Tags inside a
+cell are comma separated.
+
+Every committed image is recorded in the `ingest_log` table, so re-running the
+same command after a crash skips what is already in the database.
+
+Recognition runs in the parent process with batched MobileNetV2 inference
+(`utils.recognize_images`) just before each batch is committed, so the model is
+loaded once instead of once per worker (or not at all when SITESCAN_MODEL_SERVER
+points at a running `model_server.py`). The same batched path re-labels the
+existing `artifacts` table:
+
+    python ingest.py --relabel
+
+Thumbnails for records created before thumbnails existed:
+
+    python ingest.py --backfill-thumbnails
+"""
+import argparse
+import csv
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from db import get_conn, insert_artifacts_batch, get_ingested_sources, iter_artifact_images, update_labels_batch, update_thumbnails_batch
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.tif', '.tiff'}
+
+
+def _parse_tags(value):
+    return [t.strip() for t in (value or '').split(',') if t.strip()]
+
+
+def _parse_bool(value):
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def items_from_directory(directory, site='', spot='', fragile=False, tags=None, notes=''):
+    directory = Path(directory)
+    for p in sorted(directory.rglob('*')):
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTS:
+            yield {
+                'source_path': str(p.resolve()),
+                'metadata': {'site': site, 'spot': spot, 'fragile': fragile, 'tags': list(tags or []), 'notes': notes},
+            }
+
+
+def items_from_manifest(manifest_path):
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            raw = (row.get('path') or '').strip()
+            if not raw:
+                continue
+            p = Path(raw)
+            if not p.is_absolute():
+                p = manifest_path.parent / p
+            yield {
+                'source_path': str(p.resolve()),
+                'metadata': {
+                    'site': (row.get('site') or '').strip(),
+                    'spot': (row.get('spot') or '').strip(),
+                    'fragile': _parse_bool(row.get('fragile')),
+                    'tags': _parse_tags(row.get('tags')),
+                    'notes': (row.get('notes') or '').strip(),
+                },
+            }
+
+
+def process_item(item, reconstruction=True, recognition=True):
+    """
+    Run the per-image capture stages for one source image. Executed in a worker process.
+
+    All stages share one decoded image. Recognition itself is left to the parent, which
+    batches it across images; the worker only prepares the model input, which travels
+    back with the record under '_image' (see imaging.ImageSource pickling).
+    """
+    # imported here so the parent process does not pay for OCR/TF imports
+    import os
+    from dedupe import image_phash, to_db
+    from ocr import ocr_image
+    from utils import generate_id, timestamp, store_image, make_thumbnails, reconstruct_stub, \
+        RECOGNITION_SIZE
+    src = item['source_path']
+    # one read of the source: copy, hash, header check and EXIF; bad files fail here
+    with open(src, 'rb') as f:
+        image, exif = store_image(f, Path(src).name)
+    aid = generate_id()
+    # OCR needs the full-resolution decode, so it goes first and the rest derive from it
+    ocr_result = ocr_image(image)
+    thumb_path, thumb_md_path = make_thumbnails(image, aid)
+    phash = image_phash(image)
+    if recognition and not os.environ.get('SITESCAN_MODEL_SERVER'):
+        try:
+            image.recognition_array(RECOGNITION_SIZE)
+        except Exception:
+            pass
+    recon_path = reconstruct_stub(image, aid) if reconstruction else None
+    image.release()
+    return {
+        'id': aid,
+        'filename': Path(src).name,
+        'image_path': image.path,
+        'qr_path': None,
+        'ocr_text': ocr_result['text'],
+        'ocr_words': ocr_result['words'],
+        'labels': [],
+        'reconstruction_path': recon_path,
+        'thumb_path': thumb_path,
+        'thumb_md_path': thumb_md_path,
+        'phash': to_db(phash),
+        'metadata': dict(item['metadata'], exif=exif) if exif else item['metadata'],
+        'created_at': timestamp(),
+        '_image': image,
+    }
+
+
+def run_ingest(items, conn, workers=None, batch_size=50, queue_size=None,
+               recognition=True, reconstruction=True, log=print):
+    """
+    Ingest `items` (dicts from items_from_directory/items_from_manifest) into `conn`.
+
+    At most `queue_size` images are in flight at once; finished records are committed
+    in transactions of `batch_size`. Returns a dict of counters.
+    """
+    items = list(items)
+    done = get_ingested_sources(conn)
+    todo = [it for it in items if it['source_path'] not in done]
+    stats = {'total': len(todo), 'ingested': 0, 'failed': 0, 'skipped': len(items) - len(todo), 'elapsed': 0.0}
+    if stats['skipped']:
+        log(f"Resuming: {stats['skipped']} sources already ingested")
+    if not todo:
+        log('Nothing to ingest (all sources already in ingest_log)')
+        return stats
+
+    queue_size = queue_size or (workers or 4) * 4
+    pending_records = {}
+    start = time.time()
+
+    def flush():
+        if not pending_records:
+            return
+        records = [r for r, _ in pending_records.values()]
+        images = [r.pop('_image') for r in records]
+        if recognition:
+            from utils import recognize_images
+            for record, labels in zip(records, recognize_images(images)):
+                if labels is not None:
+                    record['labels'] = labels
+        sources = {aid: src for aid, (_, src) in pending_records.items()}
+        insert_artifacts_batch(conn, records, sources=sources)
+        stats['ingested'] += len(records)
+        pending_records.clear()
+        elapsed = time.time() - start
+        log(f"{stats['ingested']}/{stats['total']} ingested, {stats['failed']} failed "
+            f"({stats['ingested'] / elapsed if elapsed else 0:.2f} images/sec)")
+
+    it = iter(todo)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        exhausted = False
+        while in_flight or not exhausted:
+            # keep the queue bounded so a huge card does not create thousands of futures
+            while not exhausted and len(in_flight) < queue_size:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    exhausted = True
+                    break
+                fut = pool.submit(process_item, item, reconstruction, recognition)
+                in_flight[fut] = item
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                item = in_flight.pop(fut)
+                try:
+                    record = fut.result()
+                except Exception as e:
+                    stats['failed'] += 1
+                    log(f"failed: {item['source_path']}: {e}")
+                    continue
+                pending_records[record['id']] = (record, item['source_path'])
+            if len(pending_records) >= batch_size:
+                flush()
+        flush()
+
+    stats['elapsed'] = time.time() - start
+    rate = stats['ingested'] / stats['elapsed'] if stats['elapsed'] else 0
+    log(f"Done: {stats['ingested']} ingested, {stats['failed']} failed in {stats['elapsed']:.1f}s ({rate:.2f} images/sec)")
+    return stats
+
+
+def relabel_artifacts(conn, chunk_size=256, log=print):
+    """
+    Re-run recognition over every artifact in the table using batched inference.
+    Rows without an answer (unreadable image, no model) keep their labels.
+    """
+    from utils import recognize_images
+    done = skipped = 0
+    start = time.time()
+    for rows in iter_artifact_images(conn, chunk_size=chunk_size):
+        labels = recognize_images([path for _, path in rows])
+        update_labels_batch(conn, {aid: lab for (aid, _), lab in zip(rows, labels) if lab is not None})
+        done += len(rows)
+        skipped += labels.count(None)
+        elapsed = time.time() - start
+        log(f"{done - skipped} relabeled, {skipped} skipped ({done / elapsed if elapsed else 0:.2f} images/sec)")
+    return done - skipped
+
+
+def backfill_thumbnails(conn, chunk_size=256, workers=None, log=print):
+    """Generate thumbnails for artifacts created before thumbnails existed."""
+    from utils import make_thumbnails
+    done = 0
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # re-query each round: rows drop out of the "missing" set once written
+            rows = next(iter_artifact_images(conn, chunk_size=chunk_size, missing_thumbs=True), None)
+            if not rows:
+                break
+            thumbs = dict(zip([aid for aid, _ in rows],
+                              pool.map(lambda r: make_thumbnails(r[1], r[0]) if r[1] else (None, None), rows)))
+            # undecodable images get an empty marker so they are not retried forever
+            update_thumbnails_batch(conn, {aid: (sm or '', md or '') for aid, (sm, md) in thumbs.items()})
+            done += len(rows)
+            elapsed = time.time() - start
+            log(f"{done} thumbnailed ({done / elapsed if elapsed else 0:.2f} images/sec)")
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk ingest artifact photos into SiteScan')
+    parser.add_argument('source', nargs='?', help='directory of images or CSV manifest')
+    parser.add_argument('--site', default='', help='site name (directory mode)')
+    parser.add_argument('--spot', default='', help='digging spot / context (directory mode)')
+    parser.add_argument('--tags', default='', help='comma separated tags (directory mode)')
+    parser.add_argument('--fragile', action='store_true', help='mark all as fragile (directory mode)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=50, help='records per SQLite transaction')
+    parser.add_argument('--queue-size', type=int, default=None, help='max images in flight (default: 4x workers)')
+    parser.add_argument('--no-recognition', action='store_true', help='skip MobileNetV2 recognition')
+    parser.add_argument('--no-reconstruction', action='store_true', help='skip local reconstruction')
+    parser.add_argument('--relabel', action='store_true', help='re-run recognition over the existing artifacts table')
+    parser.add_argument('--backfill-thumbnails', action='store_true', help='create thumbnails for existing artifacts')
+    args = parser.parse_args(argv)
+
+    if args.backfill_thumbnails:
+        backfill_thumbnails(get_conn())
+        return 0
+    if args.relabel:
+        relabel_artifacts(get_conn())
+        return 0
+    if not args.source:
+        parser.error('source is required unless --relabel or --backfill-thumbnails is given')
+
+    src = Path(args.source)
+    if src.is_dir():
+        items = items_from_directory(src, site=args.site, spot=args.spot, fragile=args.fragile,
+                                     tags=_parse_tags(args.tags))
+    elif src.is_file() and src.suffix.lower() == '.csv':
+        items = items_from_manifest(src)
+    else:
+        parser.error(f'{src} is not a directory or .csv manifest')
+        return 2
+
+    stats = run_ingest(items, get_conn(), workers=args.workers, batch_size=args.batch_size,
+                       queue_size=args.queue_size, recognition=not args.no_recognition, reconstruction=not args.no_reconstruction)
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Job engine for the `jobs` table.
+
+Workers claim jobs atomically with a lease (see db.claim_job), keep the lease
+alive with a heartbeat while the handler runs, and either complete the job or
+record a failed attempt, which is retried with exponential backoff. Concurrency
+is configured per job type (e.g. how many GenAI reconstructions may be in flight).
+
+Run a standalone worker next to (or instead of) the one inside Streamlit:
+
+    python jobs.py --concurrency genai_reconstruct=4
+
+Set SITESCAN_INPROCESS_WORKER=0 for the Streamlit app when a standalone worker
+drains the queue.
+
+Handlers may be plain functions (run on a thread pool) or coroutines, which run
+on the worker's event loop; GenAI reconstructions are async so dozens can wait on
+a provider at once without holding a thread each (see genai.py).
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_conn, get_artifact, update_labels_batch, update_reconstructions_batch, claim_job, heartbeat_job, complete_job, fail_job, release_job
+from providers import ProviderUnavailable, get_breaker
+
+DEFAULT_CONCURRENCY = {'genai_reconstruct': 16, 'recognize': 2, 'reconstruct': 2, 'dedupe': 1}
+DEFAULT_LEASE_SECONDS = 60
+
+# job_type -> handler(conn, job, progress) returning a result string; may be async
+HANDLERS = {}
+# job_type -> callable returning True while jobs of that type should not be claimed
+PAUSE_CHECKS = {}
+
+
+def register_handler(job_type, paused=None):
+    def deco(fn):
+        HANDLERS[job_type] = fn
+        if paused is not None:
+            PAUSE_CHECKS[job_type] = paused
+        return fn
+    return deco
+
+
+def _genai_provider_down():
+    # the queue pauses while the configured provider's circuit breaker is open
+    provider = os.environ.get('GENAI_PROVIDER')
+    return bool(provider) and get_breaker(provider).is_open()
+
+
+class LeaseLost(Exception):
+    """Raised inside a handler when another worker took over its job."""
+
+
+# 'recognize' and 'reconstruct' fill in the slow fields of records saved by
+# capture.create_artifact. They update only their own column, so they can run
+# concurrently with each other and with edits in the detail view.
+@register_handler('recognize')
+def handle_recognize(conn, job, progress):
+    from utils import recognize_images
+    rec = get_artifact(conn, job['artifact_id'])
+    if not rec:
+        raise ValueError('artifact missing')
+    progress(10)
+    labels = recognize_images([rec['image_path']])[0]
+    if labels is None:
+        # fail (and retry) rather than overwrite the labels with an empty list
+        raise RuntimeError('no labels: image unreadable, or neither the model server nor TensorFlow is available')
+    update_labels_batch(conn, {rec['id']: labels})
+    return json.dumps(labels)
+
+
+@register_handler('reconstruct')
+def handle_reconstruct(conn, job, progress):
+    from utils import reconstruct_stub
+    rec = get_artifact(conn, job['artifact_id'])
+    if not rec:
+        raise ValueError('artifact missing')
+    progress(10)
+    path = reconstruct_stub(rec['image_path'], rec['id'])
+    update_reconstructions_batch(conn, {rec['id']: path})
+    return path
+
+
+# table-wide: hashes artifacts that have none and rebuilds the duplicate groups
+# (dedupe.cluster_duplicates); queued from the gallery with no artifact_id
+@register_handler('dedupe')
+def handle_dedupe(conn, job, progress):
+    from dedupe import cluster_duplicates
+    progress(5)
+    # every progress line also renews the lease during a long backfill
+    stats = cluster_duplicates(conn, radius=job['params'].get('distance'), log=lambda msg: progress(50))
+    return json.dumps(stats)
+
+
+@register_handler('genai_reconstruct', paused=_genai_provider_down)
+async def handle_genai_reconstruct(conn, job, progress):
+    from utils import get_replicate_latest_version, reconstruct_stub
+    rec = get_artifact(conn, job['artifact_id'])
+    if not rec:
+        raise ValueError('artifact missing')
+    import asyncio
+    method = job['params'].get('method') or os.environ.get('GENAI_PROVIDER')
+    loop = asyncio.get_running_loop()
+    progress(10)
+    if method in ('replicate', 'huggingface', 'hf'):
+        # resolve a model version if none is configured; per job, so a newer version
+        # is picked up once the cached lookup expires (GENAI_MODEL_VERSION_TTL)
+        model = None
+        if method == 'replicate' and not os.environ.get('GENAI_MODEL_VERSION'):
+            model = await loop.run_in_executor(None, get_replicate_latest_version, 'stability-ai/stable-diffusion')
+        result_path = await _get_genai_client().reconstruct(rec['image_path'], rec['id'], method, model=model)
+    else:
+        result_path = await loop.run_in_executor(None, reconstruct_stub, rec['image_path'], rec['id'])
+    if not result_path:
+        raise RuntimeError('no result from provider')
+    # only the one column: the record read above is stale after the provider round trip
+    update_reconstructions_batch(conn, {rec['id']: result_path})
+    return result_path
+
+
+_genai_client = None
+
+
+def _get_genai_client():
+    # one pooled client per worker event loop
+    global _genai_client
+    if _genai_client is None:
+        from genai import AsyncGenAIClient
+        _genai_client = AsyncGenAIClient()
+    return _genai_client
+
+
+class JobWorker:
+    def __init__(self, concurrency=None, lease_seconds=DEFAULT_LEASE_SECONDS, poll_interval=1.0,
+                 backoff_seconds=30, owner=None, log=print):
+        self.concurrency = dict(concurrency or DEFAULT_CONCURRENCY)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.backoff_seconds = backoff_seconds
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.log = log
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._active = {}  # job id -> job_type
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def _free_types(self):
+        with self._lock:
+            running = {}
+            for jtype in self._active.values():
+                running[jtype] = running.get(jtype, 0) + 1
+        return [t for t, n in self.concurrency.items()
+                if t in HANDLERS and running.get(t, 0) < n and not PAUSE_CHECKS.get(t, lambda: False)()]
+
+    def _progress_fn(self, conn, job):
+        def progress(pct):
+            if not heartbeat_job(conn, job['id'], self.owner, self.lease_seconds, progress=pct):
+                raise LeaseLost(job['id'])
+        return progress
+
+    def _finish(self, conn, job, result=None, error=None):
+        try:
+            if isinstance(error, LeaseLost):
+                self.log(f"job {job['id']}: lease lost, abandoning")
+            elif isinstance(error, ProviderUnavailable):
+                # not the job's fault: requeue for when the breaker allows a trial, keep the attempt
+                release_job(conn, job['id'], self.owner, error.retry_after, str(error))
+            elif error is not None:
+                status = fail_job(conn, job['id'], self.owner, error, self.backoff_seconds)
+                self.log(f"job {job['id']} attempt {job['attempts']}/{job['max_attempts']} failed: {error} -> {status}")
+            else:
+                complete_job(conn, job['id'], self.owner, result)
+        finally:
+            with self._lock:
+                self._active.pop(job['id'], None)
+
+    def _run_job(self, job):
+        conn = get_conn()
+        try:
+            result = HANDLERS[job['job_type']](conn, job, self._progress_fn(conn, job))
+        except Exception as e:
+            self._finish(conn, job, error=e)
+        else:
+            self._finish(conn, job, result=result)
+
+    async def _run_async_job(self, job):
+        # runs on the worker's event loop thread, which has its own connection
+        conn = get_conn()
+        try:
+            result = await HANDLERS[job['job_type']](conn, job, self._progress_fn(conn, job))
+        except Exception as e:
+            self._finish(conn, job, error=e)
+        else:
+            self._finish(conn, job, result=result)
+
+    def _get_loop(self):
+        import asyncio
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return self._loop
+
+    def _heartbeat_loop(self):
+        conn = get_conn()
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            with self._lock:
+                ids = list(self._active)
+            for jid in ids:
+                heartbeat_job(conn, jid, self.owner, self.lease_seconds)
+
+    def run(self):
+        """Drain the queue until stop() is called."""
+        import asyncio
+        conn = get_conn()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        threads = sum(n for t, n in self.concurrency.items() if not asyncio.iscoroutinefunction(HANDLERS.get(t)))
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            while not self.stop_event.is_set():
+                claimed = False
+                for jtype in self._free_types():
+                    job = claim_job(conn, self.owner, [jtype], self.lease_seconds)
+                    if job is None:
+                        continue
+                    with self._lock:
+                        self._active[job['id']] = jtype
+                    if asyncio.iscoroutinefunction(HANDLERS[jtype]):
+                        asyncio.run_coroutine_threadsafe(self._run_async_job(job), self._get_loop())
+                    else:
+                        pool.submit(self._run_job, job)
+                    claimed = True
+                if not claimed:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        if self._loop is not None and _genai_client is not None:
+            asyncio.run_coroutine_threadsafe(_genai_client.close(), self._loop).result(timeout=10)
+
+    def notify(self):
+        """Skip the idle wait, e.g. right after queueing jobs from this process."""
+        self._wake.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake.set()
+
+
+_background_worker = None
+_background_lock = threading.Lock()
+
+
+def start_background_worker(**kwargs):
+    """Start one worker thread per process (idempotent across Streamlit reruns and sessions)."""
+    global _background_worker
+    if os.environ.get('SITESCAN_INPROCESS_WORKER', '1') == '0':
+        return None
+    with _background_lock:
+        if _background_worker is None:
+            _background_worker = JobWorker(**kwargs)
+            threading.Thread(target=_background_worker.run, daemon=True).start()
+    return _background_worker
+
+
+def _parse_concurrency(values):
+    out = dict(DEFAULT_CONCURRENCY)
+    for v in values or []:
+        jtype, _, n = v.partition('=')
+        out[jtype.strip()] = int(n)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a SiteScan job worker')
+    parser.add_argument('--concurrency', action='append', metavar='TYPE=N',
+                        help=f'max concurrent jobs per type (default: {json.dumps(DEFAULT_CONCURRENCY)})')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help='lease length in seconds')
+    parser.add_argument('--poll', type=float, default=1.0, help='idle poll interval in seconds')
+    parser.add_argument('--backoff', type=float, default=30, help='base retry backoff in seconds')
+    args = parser.parse_args(argv)
+    worker = JobWorker(concurrency=_parse_concurrency(args.concurrency), lease_seconds=args.lease,
+                       poll_interval=args.poll, backoff_seconds=args.backoff)
+    print(f'worker {worker.owner} running {worker.concurrency}')
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+Local recognition server.
+
+Loads MobileNetV2 once, runs a warm-up batch before accepting connections, and
+serves recognition requests from every Streamlit session and `ingest.py` over a
+loopback TCP socket or a Unix socket. Requests arriving within `--max-wait-ms`
+of each other are merged into shared batches, so single uploads from several
+sessions still go through the model together.
+
+    python model_server.py                          # 127.0.0.1:8765
+    python model_server.py --address /tmp/sitescan-model.sock
+    python model_server.py --stats                  # queue depth and batch latency
+
+Clients find the server through SITESCAN_MODEL_SERVER (`host:port` or a socket
+path). When it is unset or the server does not answer, `utils.recognize_images`
+falls back to loading the model in-process.
+
+multiprocessing connections exchange pickles, so whoever can talk to the server
+can run code in it (and the server in its clients). Both sides therefore only
+accept loopback addresses or Unix sockets, and authenticate with a key: either
+SITESCAN_MODEL_SERVER_KEY, or a random key the server writes to
+`data/model_server.key` (mode 0600) on first start and clients read from there.
+There is no built-in default key.
+
+Environment:
+  - SITESCAN_MODEL_SERVER           server address used by clients (unset = in-process model)
+  - SITESCAN_MODEL_SERVER_KEY       shared auth key (default: the key file)
+  - SITESCAN_MODEL_SERVER_KEY_FILE  key file (default `data/model_server.key`)
+"""
+import argparse
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+KEY_FILE = Path(os.environ.get('SITESCAN_MODEL_SERVER_KEY_FILE', 'data/model_server.key'))
+CLIENT_TIMEOUT = 120
+# after a failed connection, wait this long before trying the server again
+RETRY_INTERVAL = 30
+
+
+def parse_address(address):
+    """
+    'host:port' -> ('host', port); anything containing a '/' is a Unix socket path.
+    Raises ValueError for hosts that are not loopback.
+    """
+    if '/' in address:
+        return address
+    host, _, port = address.rpartition(':')
+    host = host.strip('[]') or '127.0.0.1'
+    try:
+        loopback = ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        loopback = False
+    if not loopback:
+        raise ValueError(f'model server address {address!r} is not a loopback address or socket path')
+    return (host, int(port))
+
+
+def authkey(create=False):
+    """
+    SITESCAN_MODEL_SERVER_KEY, else the contents of KEY_FILE. With `create` (the
+    server) a missing key file is generated. Returns None when there is no key.
+    """
+    key = os.environ.get('SITESCAN_MODEL_SERVER_KEY')
+    if key:
+        return key.encode('utf-8')
+    try:
+        if os.stat(KEY_FILE).st_mode & 0o077:
+            raise PermissionError(f'{KEY_FILE} is readable by other users; chmod 600 it')
+        return KEY_FILE.read_bytes().strip()
+    except FileNotFoundError:
+        if not create:
+            return None
+    KEY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    key = secrets.token_hex(32).encode('ascii')
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+_local = threading.local()
+_down_until = 0.0
+
+
+def _connection(address):
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'address', None) != address:
+        key = authkey()
+        if key is None:
+            raise ConnectionError(f'no model server key ({KEY_FILE} missing and SITESCAN_MODEL_SERVER_KEY unset)')
+        conn = Client(parse_address(address), authkey=key)
+        _local.conn, _local.address = conn, address
+    return conn
+
+
+def _drop_connection():
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def _call(message, address=None, timeout=CLIENT_TIMEOUT):
+    """Send one request; returns the reply, or None if there is no usable server."""
+    global _down_until
+    address = address or os.environ.get('SITESCAN_MODEL_SERVER')
+    if not address or time.monotonic() < _down_until:
+        return None
+    try:
+        conn = _connection(address)
+        conn.send(message)
+        if not conn.poll(timeout):
+            raise TimeoutError('model server did not answer')
+        reply = conn.recv()
+    except Exception:
+        _drop_connection()
+        _down_until = time.monotonic() + RETRY_INTERVAL
+        return None
+    if reply.get('error'):
+        return None
+    return reply
+
+
+def recognize_remote(image_paths, top=3, address=None):
+    """
+    Labels for `image_paths` from the model server: one list per path, None for
+    unreadable images. Returns None when no server is configured or reachable.
+    """
+    reply = _call({'op': 'recognize', 'paths': [os.path.abspath(p) for p in image_paths], 'top': top}, address)
+    return None if reply is None else reply['labels']
+
+
+def server_stats(address=None):
+    reply = _call({'op': 'stats'}, address, timeout=5)
+    return None if reply is None else reply['stats']
+
+
+class ModelServer:
+    def __init__(self, address=DEFAULT_ADDRESS, batch_size=None, max_wait_ms=10, workers=None, log=print):
+        import utils
+        self._utils = utils
+        self.address = address
+        self.batch_size = batch_size or utils.RECOGNITION_BATCH_SIZE
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self.log = log
+        self.model = None
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._queued_images = 0
+        self._latencies = deque(maxlen=200)
+        self._stats = {'requests': 0, 'images': 0, 'batches': 0, 'warmup_ms': None, 'started': time.time()}
+
+    def load(self):
+        """Load the model and run one full-size batch so the first real request is not slow."""
+        import numpy as np
+        t0 = time.perf_counter()
+        self.model = self._utils._load_tf_model()
+        if self.model is None:
+            raise RuntimeError('recognition model could not be loaded (is tensorflow installed?)')
+        dummy = [np.zeros(self._utils.RECOGNITION_SIZE + (3,), dtype=np.float32)]
+        self._utils.predict_labels(self.model, dummy, top=1, batch_size=self.batch_size)
+        self._stats['warmup_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+        self.log(f"model {self._utils.RECOGNITION_MODEL_VERSION} ready in {self._stats['warmup_ms']} ms")
+
+    def submit(self, paths, top=3):
+        """Queue a request; returns a Future with one label list (or None) per path."""
+        fut = Future()
+        with self._lock:
+            self._queued_images += len(paths)
+            self._stats['requests'] += 1
+        self._requests.put((paths, top, fut))
+        return fut
+
+    def _collect(self):
+        # block for the first request, then take whatever else arrives within max_wait
+        batch = [self._requests.get()]
+        count = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._collect()
+            paths = [p for item in batch for p in item[0]]
+            top = max(item[1] for item in batch)
+            t0 = time.perf_counter()
+            try:
+                arrays = self._utils.load_recognition_arrays(paths, self.workers)
+                labels = self._utils.predict_labels(self.model, arrays, top, self.batch_size)
+            except Exception as e:
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+                labels = None
+            elapsed = (time.perf_counter() - t0) * 1000
+            with self._lock:
+                self._queued_images -= len(paths)
+                if labels is not None:
+                    self._stats['images'] += len(paths)
+                    self._stats['batches'] += 1
+                    self._latencies.append((elapsed, len(paths)))
+            if labels is None:
+                continue
+            pos = 0
+            for item_paths, item_top, fut in batch:
+                part = labels[pos:pos + len(item_paths)]
+                pos += len(item_paths)
+                fut.set_result([None if lab is None else lab[:item_top] for lab in part])
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats, queue_depth=self._queued_images)
+            recent = list(self._latencies)
+        lat = sorted(ms for ms, _ in recent)
+        sizes = [n for _, n in recent]
+        out['uptime_s'] = round(time.time() - out.pop('started'), 1)
+        out['model_version'] = self._utils.RECOGNITION_MODEL_VERSION
+        if lat:
+            out['batch_ms'] = {'last': round(recent[-1][0], 1), 'avg': round(sum(lat) / len(lat), 1),
+                               'p95': round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1)}
+            out['avg_batch_images'] = round(sum(sizes) / len(sizes), 1)
+        return out
+
+    def _serve_client(self, conn):
+        with conn:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if msg.get('op') == 'recognize':
+                        reply = {'labels': self.submit(msg['paths'], msg.get('top', 3)).result()}
+                    elif msg.get('op') == 'stats':
+                        reply = {'stats': self.stats()}
+                    else:
+                        reply = {'error': f"unknown op {msg.get('op')!r}"}
+                except Exception as e:
+                    reply = {'error': str(e)}
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    def serve_forever(self):
+        if self.model is None:
+            self.load()
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        address = parse_address(self.address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        with Listener(address, backlog=64, authkey=authkey(create=True)) as listener:
+            if isinstance(address, str):
+                os.chmod(address, 0o600)
+            self.log(f'listening on {self.address} (batch {self.batch_size}, wait {self.max_wait * 1000:.0f} ms)')
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # failed handshake (wrong key, port scan); keep serving
+                    self.log(f'rejected connection: {e}')
+                    continue
+                threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve batched recognition to SiteScan processes')
+    parser.add_argument('--address', default=os.environ.get('SITESCAN_MODEL_SERVER', DEFAULT_ADDRESS),
+                        help='host:port or Unix socket path')
+    parser.add_argument('--batch-size', type=int, default=None, help='images per forward pass')
+    parser.add_argument('--max-wait-ms', type=float, default=10, help='how long to wait to fill a batch')
+    parser.add_argument('--workers', type=int, default=None, help='image decode threads')
+    parser.add_argument('--stats', action='store_true', help='print stats of a running server and exit')
+    args = parser.parse_args(argv)
+    if args.stats:
+        stats = server_stats(args.address)
+        if stats is None:
+            print(f'no server at {args.address}')
+            return 1
+        print(json.dumps(stats, indent=2))
+        return 0
+    try:
+        parse_address(args.address)
+    except ValueError as e:
+        parser.error(str(e))
+    server = ModelServer(args.address, batch_size=args.batch_size, max_wait_ms=args.max_wait_ms, workers=args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Tesseract OCR with preprocessing and text-region detection.
+
+`ocr_image` is what `utils.run_ocr`, the capture flow and bulk ingest use:
+
+1. The grayscale image is downscaled so text sits near `target_dpi`, taken from
+   the file's DPI tag. For photos without one, the longest side is capped at
+   `max_side` instead. Tesseract is much slower on 20+ MP photos and gains
+   nothing from the extra pixels.
+2. OpenCV finds candidate text regions on a small copy (morphological
+   gradient, Otsu threshold, horizontal closing, contours). Tesseract then reads
+   only those padded crops. If nothing plausible is found, or the candidates
+   cover most of the image, the whole image is read instead.
+3. Word-level results supply per-word confidences and boxes (in original-image
+   pixels). They are stored with the record as `ocr_words`.
+
+Recognition runs on a pool of long-lived Tesseract engines (ocr_pool.py).
+`ocr_images` OCRs many images on threads sized to that pool.
+
+Files over the decode ceiling (SITESCAN_MAX_DECODE_MB, see imaging.py) are
+read in overlapping tiles instead of whole (`_ocr_tiled`).
+
+Results are cached per image hash and settings (cache.py).
+
+Settings (keyword arguments override the environment):
+  - OCR_LANG        Tesseract language(s), e.g. 'eng+deu' (default 'eng')
+  - OCR_PSM         page segmentation mode (default 6 for regions, 3 for the whole image)
+  - OCR_OEM         engine mode (default 3, whatever the installed data supports)
+  - OCR_TARGET_DPI  resolution Tesseract sees (default 300)
+  - OCR_MAX_SIDE    longest side for images without a DPI tag (default 2500)
+  - OCR_REGIONS     1 to detect text regions, 0 to read the whole image (default 1)
+"""
+import os
+
+from cache import get_cache, make_key
+from imaging import as_source
+from ocr_pool import read_data, get_pool
+
+# bump when preprocessing or region detection changes output
+OCR_ENGINE_VERSION = 'regions-1'
+
+OCR_DEFAULTS = {
+    'lang': os.environ.get('OCR_LANG', 'eng'),
+    'psm': int(os.environ['OCR_PSM']) if os.environ.get('OCR_PSM') else None,
+    'oem': int(os.environ.get('OCR_OEM', '3')),
+    'target_dpi': int(os.environ.get('OCR_TARGET_DPI', '300')),
+    'max_side': int(os.environ.get('OCR_MAX_SIDE', '2500')),
+    'regions': os.environ.get('OCR_REGIONS', '1') != '0',
+}
+
+# region detection runs on a copy with this longest side
+DETECT_SIDE = 1024
+# more candidates than this usually means texture (soil, stone), not labels
+MAX_REGIONS = 24
+# read the whole image when regions cover more than this fraction of it
+MAX_REGION_COVERAGE = 0.6
+# tiled OCR (images over the decode ceiling): tile side and overlap in OCR pixels,
+# and the largest tile read from the file in one go
+TILE_SIDE = 2048
+TILE_OVERLAP = 160
+TILE_MAX_RASTER = 4096
+
+_tesseract_version = None
+
+
+def get_tesseract_version():
+    global _tesseract_version
+    if _tesseract_version is None:
+        try:
+            import pytesseract
+            _tesseract_version = str(pytesseract.get_tesseract_version())
+        except Exception:
+            try:
+                # tesserocr works without the tesseract binary on PATH; the pool
+                # sets the engines' thread limit before it is first loaded
+                get_pool()
+                import tesserocr
+                _tesseract_version = tesserocr.tesseract_version().split()[1]
+            except Exception:
+                _tesseract_version = 'unknown'
+    return _tesseract_version
+
+
+def empty_result():
+    return {'text': '', 'words': [], 'mean_conf': None, 'regions': 0, 'scale': 1.0}
+
+
+def _scale_for(size, dpi, target_dpi, max_side):
+    try:
+        dpi = float(dpi[0]) if dpi else None
+    except (TypeError, ValueError, IndexError):
+        dpi = None
+    # a DPI tag of 72/96 on a camera JPEG is meaningless; only trust scanner-like values
+    if dpi and dpi > target_dpi and dpi >= 150:
+        return target_dpi / dpi
+    return min(1.0, max_side / float(max(size))) if max_side else 1.0
+
+
+def _merge_boxes(boxes, gap):
+    """Merge boxes (x0, y0, x1, y1) that overlap once grown by `gap` pixels."""
+    boxes = sorted(boxes)
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for b in boxes:
+            for i, m in enumerate(out):
+                if b[0] <= m[2] + gap and m[0] <= b[2] + gap and b[1] <= m[3] + gap and m[1] <= b[3] + gap:
+                    out[i] = (min(m[0], b[0]), min(m[1], b[1]), max(m[2], b[2]), max(m[3], b[3]))
+                    merged = True
+                    break
+            else:
+                out.append(b)
+        boxes = out
+    return boxes
+
+
+def find_text_regions(gray):
+    """
+    Candidate text blocks in a grayscale PIL image as (x0, y0, x1, y1) boxes in its
+    pixel coordinates, top to bottom. An empty list means "read the whole image".
+    """
+    import cv2
+    import numpy as np
+    arr = np.asarray(gray)
+    h, w = arr.shape[:2]
+    f = min(1.0, DETECT_SIDE / float(max(h, w)))
+    small = cv2.resize(arr, (max(1, int(w * f)), max(1, int(h * f))), interpolation=cv2.INTER_AREA) if f < 1 else arr
+    grad = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, bw = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    # join characters into line blobs
+    lines = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    # RETR_LIST: text printed on a label sits inside the label's own outline
+    contours, _ = cv2.findContours(lines, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    def is_line(x, y, bw_w, bw_h):
+        # text lines are dense in edges; sparse blobs are shadows or texture
+        return bw_h >= 6 and bw_w >= 12 and bw_w >= bw_h * 1.2 and \
+            cv2.countNonZero(bw[y:y + bw_h, x:x + bw_w]) >= 0.25 * bw_w * bw_h
+
+    thin = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    boxes = []
+    for c in contours:
+        x, y, bw_w, bw_h = cv2.boundingRect(c)
+        if bw_h < 6 or bw_w < 12 or bw_w < bw_h * 1.2:
+            continue
+        if is_line(x, y, bw_w, bw_h):
+            boxes.append((x, y, x + bw_w, y + bw_h))
+            continue
+        # the closing can join a line to the outline of the label it is printed
+        # on; drop the thin strokes and look again at what is left
+        core = cv2.morphologyEx(lines[y:y + bw_h, x:x + bw_w], cv2.MORPH_OPEN, thin)
+        found, _ = cv2.findContours(core, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x, y))
+        for sx, sy, sw, sh in map(cv2.boundingRect, found):
+            if is_line(sx, sy, sw, sh):
+                boxes.append((sx, sy, sx + sw, sy + sh))
+    # lines of one label become one block
+    boxes = _merge_boxes(boxes, gap=8)
+    if not boxes or len(boxes) > MAX_REGIONS:
+        return []
+    area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in boxes)
+    if area > MAX_REGION_COVERAGE * small.shape[0] * small.shape[1]:
+        return []
+    pad = 6
+    out = []
+    for x0, y0, x1, y1 in boxes:
+        out.append((max(0, int((x0 - pad) / f)), max(0, int((y0 - pad) / f)),
+                    min(w, int((x1 + pad) / f)), min(h, int((y1 + pad) / f))))
+    return sorted(out, key=lambda b: (b[1], b[0]))
+
+
+def _read(img, opts, psm, offset, scale, keep=None):
+    """
+    Recognise one crop on a pooled engine; returns (lines, words) with words in original
+    pixels. `keep(box)` can drop words (and their text) by their original-pixel box.
+    """
+    data = read_data(img, opts['lang'], opts['oem'], psm, opts['target_dpi'])
+    lines = {}
+    words = []
+    for i, text in enumerate(data['text']):
+        text = (text or '').strip()
+        try:
+            conf = float(data['conf'][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        if not text or conf < 0:
+            continue
+        box = [int((offset[0] + data['left'][i]) / scale), int((offset[1] + data['top'][i]) / scale),
+               int(data['width'][i] / scale), int(data['height'][i] / scale)]
+        if keep is not None and not keep(box):
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        lines.setdefault(key, []).append(text)
+        words.append({'text': text, 'conf': round(conf, 1), 'box': box})
+    return [' '.join(lines[k]) for k in sorted(lines)], words
+
+
+def _ocr_whole(src, opts):
+    from PIL import Image, ImageOps
+    gray = src.gray()
+    scale = _scale_for(src.size, src.dpi, opts['target_dpi'], opts['max_side'])
+    if scale < 1.0:
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))), Image.LANCZOS)
+    gray = ImageOps.autocontrast(gray)
+    regions = find_text_regions(gray) if opts['regions'] else []
+    psm = opts['psm'] if opts['psm'] is not None else (6 if regions else 3)
+    lines, words = [], []
+    for box in regions or [(0, 0, gray.width, gray.height)]:
+        crop = gray if not regions else gray.crop(box)
+        part_lines, part_words = _read(crop, opts, psm, box[:2], scale)
+        lines.extend(part_lines)
+        words.extend(part_words)
+    return lines, words, len(regions), scale
+
+
+def _ocr_tiled(src, opts):
+    """
+    OCR an image over the decode ceiling tile by tile (tiles.py). Only the DPI tag
+    scales it down (OCR_MAX_SIDE would make a gigapixel scan unreadable), and with
+    region detection on, tiles without text regions are skipped. A word belongs to
+    the tile whose core contains its centre, so the overlap does not duplicate it.
+    """
+    import cv2
+    from PIL import Image, ImageOps
+    from tiles import iter_tiles
+    scale = _scale_for(src.size, src.dpi, opts['target_dpi'], None)
+    raster = src.raster()
+    try:
+        # raster pixels -> OCR pixels (a JPEG raster may already be reduced)
+        f = min(1.0, scale / raster.scale)
+        scale = raster.scale * f
+        tile = min(TILE_MAX_RASTER, int(TILE_SIDE / f))
+        psm = opts['psm'] if opts['psm'] is not None else (6 if opts['regions'] else 3)
+        lines, words, n_regions = [], [], 0
+        for x0, y0, core, arr in iter_tiles(raster, tile, int(TILE_OVERLAP / f)):
+            gray = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY) if arr.shape[2] == 3 else arr[..., 0]
+            if f < 1.0:
+                gray = cv2.resize(gray, (max(1, int(gray.shape[1] * f)), max(1, int(gray.shape[0] * f))),
+                                  interpolation=cv2.INTER_AREA)
+            gray = ImageOps.autocontrast(Image.fromarray(gray))
+            regions = find_text_regions(gray) if opts['regions'] else [(0, 0, gray.width, gray.height)]
+            n_regions += len(regions) if opts['regions'] else 0
+
+            def keep(box, core=core):
+                cx, cy = (box[0] + box[2] / 2.0) * raster.scale, (box[1] + box[3] / 2.0) * raster.scale
+                return core[0] <= cx < core[2] and core[1] <= cy < core[3]
+            for box in regions:
+                part_lines, part_words = _read(gray.crop(box), opts, psm,
+                                               (x0 * f + box[0], y0 * f + box[1]), scale, keep)
+                lines.extend(part_lines)
+                words.extend(part_words)
+    finally:
+        raster.close()
+    return lines, words, n_regions, scale
+
+
+def ocr_image(image, **settings):
+    """
+    OCR a path or ImageSource. Returns {'text', 'words': [{'text', 'conf', 'box'}],
+    'mean_conf', 'regions', 'scale'}. Images over the decode ceiling
+    (imaging.ImageSource.too_large) are read in tiles. Any failure returns an empty result.
+    """
+    opts = dict(OCR_DEFAULTS, **{k: v for k, v in settings.items() if v is not None})
+    try:
+        src = as_source(image)
+        tiled = src.too_large()
+        key = make_key(src.content_hash(), 'ocr', [get_tesseract_version(), OCR_ENGINE_VERSION],
+                       dict(opts, tiled=True) if tiled else opts)
+        cached = get_cache().get_json(key)
+        if cached is not None:
+            return cached
+        lines, words, n_regions, scale = (_ocr_tiled if tiled else _ocr_whole)(src, opts)
+        result = {
+            'text': '\n'.join(lines).strip(),
+            'words': words,
+            'mean_conf': round(sum(w['conf'] for w in words) / len(words), 1) if words else None,
+            'regions': n_regions,
+            'scale': round(scale, 4),
+        }
+        get_cache().put_json(key, 'ocr', result)
+        return result
+    except Exception:
+        return empty_result()
+
+
+def ocr_images(images, workers=None, **settings):
+    """ocr_image over many paths or sources, one thread per pooled engine; results in input order."""
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers or get_pool().size) as pool:
+        return list(pool.map(lambda image: ocr_image(image, **settings), images))
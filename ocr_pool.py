@@ -0,0 +1,236 @@
+"""
+Pool of long-lived Tesseract engines fed from memory.
+
+`pytesseract` starts a `tesseract` process for every call, writes the image to a
+temp file and reads the result back from another one. On the small label crops
+`ocr.ocr_image` produces, that start-up (mostly loading the traineddata) costs
+more than the recognition itself. `read_data` borrows an engine from a
+per-process pool instead:
+
+  - tesserocr, when installed: one `PyTessBaseAPI` per engine, initialised once
+    per language/OEM and reused. Images are handed over as PIL objects and the C
+    API releases the GIL, so threads recognise in parallel.
+  - otherwise the `tesseract` binary, with the image piped in on stdin and the
+    TSV read from stdout. Process start-up remains, the temp files do not.
+    requirements.txt installs tesserocr everywhere but Windows, so this is the
+    fallback, not the default.
+
+At most OCR_WORKERS recognitions run at once per process, and every engine is
+limited to one OpenMP thread. Capture threads, job workers and ingest processes
+can therefore all OCR at the same time without oversubscribing the CPU.
+
+Settings:
+  - OCR_BACKEND  'auto' (tesserocr if installed, else 'cli'), 'tesserocr', 'cli',
+                 or 'pytesseract' (the old per-call temp-file path)
+  - OCR_WORKERS  engines per process (default: CPU count)
+"""
+import importlib
+import io
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'auto')
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', '0')) or os.cpu_count() or 1
+
+# the keys of pytesseract's image_to_data(output_type=DICT) that ocr.py reads
+DATA_KEYS = ('block_num', 'par_num', 'line_num', 'left', 'top', 'width', 'height', 'conf', 'text')
+
+
+class _TesserocrEngine:
+    def __init__(self, lang, oem):
+        import tesserocr
+        self._t = tesserocr
+        self.api = tesserocr.PyTessBaseAPI(lang=lang, oem=oem)
+
+    def read(self, img, psm, dpi):
+        t = self._t
+        api = self.api
+        api.SetPageSegMode(psm)
+        api.SetImage(img)
+        api.SetSourceResolution(dpi)
+        api.Recognize()
+        data = {k: [] for k in DATA_KEYS}
+        block = par = line = 0
+        it = api.GetIterator()
+        words = t.iterate_level(it, t.RIL.WORD) if it is not None else ()
+        for w in words:
+            # numbering only has to group words into lines, like pytesseract's
+            block += w.IsAtBeginningOf(t.RIL.BLOCK)
+            par += w.IsAtBeginningOf(t.RIL.PARA)
+            line += w.IsAtBeginningOf(t.RIL.TEXTLINE)
+            box = w.BoundingBox(t.RIL.WORD)
+            if box is None:
+                continue
+            x0, y0, x1, y1 = box
+            for k, v in zip(DATA_KEYS, (block, par, line, x0, y0, x1 - x0, y1 - y0,
+                                        w.Confidence(t.RIL.WORD), w.GetUTF8Text(t.RIL.WORD))):
+                data[k].append(v)
+        api.Clear()
+        return data
+
+    def close(self):
+        self.api.End()
+
+
+class _CliEngine:
+    def __init__(self, lang, oem):
+        self.lang = lang
+        self.oem = oem
+        try:
+            import pytesseract
+            self.cmd = pytesseract.pytesseract.tesseract_cmd
+        except Exception:
+            self.cmd = 'tesseract'
+
+    def read(self, img, psm, dpi):
+        buf = io.BytesIO()
+        # PNM needs no compression and leptonica reads it from stdin
+        img.save(buf, 'PPM')
+        proc = subprocess.run(
+            [self.cmd, 'stdin', 'stdout', '-l', self.lang, '--oem', str(self.oem), '--psm', str(psm),
+             '--dpi', str(dpi), 'tsv'],
+            input=buf.getvalue(), capture_output=True)
+        if proc.returncode:
+            raise RuntimeError(proc.stderr.decode('utf-8', 'replace').strip())
+        return parse_tsv(proc.stdout.decode('utf-8', 'replace'))
+
+    def close(self):
+        pass
+
+
+class _PytesseractEngine(_CliEngine):
+    def read(self, img, psm, dpi):
+        import pytesseract
+        return pytesseract.image_to_data(img, lang=self.lang, config=f'--oem {self.oem} --psm {psm} --dpi {dpi}',
+                                         output_type=pytesseract.Output.DICT)
+
+
+ENGINES = {'tesserocr': _TesserocrEngine, 'cli': _CliEngine, 'pytesseract': _PytesseractEngine}
+
+
+def parse_tsv(tsv):
+    """Tesseract TSV output -> the image_to_data dict layout (only DATA_KEYS)."""
+    rows = tsv.splitlines()
+    if not rows:
+        return {k: [] for k in DATA_KEYS}
+    header = rows[0].split('\t')
+    data = {k: [] for k in DATA_KEYS}
+    for row in rows[1:]:
+        cells = row.split('\t')
+        if len(cells) < len(header):
+            # the text column is empty on non-word rows
+            cells += [''] * (len(header) - len(cells))
+        rec = dict(zip(header, cells))
+        for k in DATA_KEYS:
+            v = rec.get(k, '')
+            if k == 'text':
+                data[k].append(v)
+            elif k == 'conf':
+                data[k].append(float(v) if v else -1.0)
+            else:
+                data[k].append(int(v) if v else 0)
+    return data
+
+
+def resolve_backend(name=None):
+    name = name or OCR_BACKEND
+    if name != 'auto':
+        return name
+    try:
+        # a real import, not find_spec: a tesserocr built against another libtesseract fails here
+        importlib.import_module('tesserocr')
+        return 'tesserocr'
+    except Exception:
+        return 'cli'
+
+
+class EnginePool:
+    """Up to `size` engines of one backend, shared by all threads of a process."""
+
+    def __init__(self, backend=None, size=None):
+        # one OpenMP thread per engine; parallelism comes from the pool, not from
+        # Tesseract. OpenMP reads this when libtesseract loads, so it is set before
+        # resolve_backend imports tesserocr; cli engines inherit it.
+        os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+        self.backend = resolve_backend(backend)
+        self.size = size or OCR_WORKERS
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.engines = 0
+        self.calls = 0
+        self.busy_seconds = 0.0
+
+    def _take(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            # keep at most `size` engines alive: drop an idle one set up for other settings
+            if self.engines >= self.size:
+                for other in self._idle.values():
+                    if other:
+                        other.pop().close()
+                        self.engines -= 1
+                        break
+            self.engines += 1
+        try:
+            return ENGINES[self.backend](*key)
+        except Exception:
+            with self._lock:
+                self.engines -= 1
+            raise
+
+    @contextmanager
+    def engine(self, lang, oem):
+        key = (lang, oem)
+        with self._slots:
+            eng = self._take(key)
+            t0 = time.perf_counter()
+            try:
+                yield eng
+            finally:
+                with self._lock:
+                    self.calls += 1
+                    self.busy_seconds += time.perf_counter() - t0
+                    self._idle.setdefault(key, []).append(eng)
+
+    def read_data(self, img, lang, oem, psm, dpi):
+        with self.engine(lang, oem) as eng:
+            return eng.read(img, psm, dpi)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.backend, 'workers': self.size, 'engines': self.engines,
+                    'calls': self.calls, 'busy_ms': round(self.busy_seconds * 1000, 1)}
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for eng in idle:
+                    eng.close()
+            self._idle = {}
+            self.engines = 0
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool (a forked ingest worker gets its own)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = EnginePool()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def read_data(img, lang, oem, psm, dpi):
+    """Recognise a PIL image; returns the image_to_data dict layout (see DATA_KEYS)."""
+    return get_pool().read_data(img, lang, oem, psm, dpi)
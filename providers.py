@@ -0,0 +1,201 @@
+"""
+Guards around external GenAI providers: rate limiting, circuit breaking and
+TTL caching of metadata lookups.
+
+Each provider ('replicate', 'huggingface') has one token bucket and one circuit
+breaker per process. `genai.AsyncGenAIClient` takes a token before every HTTP
+request and reports successes/failures to the breaker. After
+`GENAI_BREAKER_FAILURES` consecutive failures (connection errors, timeouts,
+429/5xx) the breaker opens for `GENAI_BREAKER_RESET` seconds: requests fail fast
+with ProviderUnavailable and the job worker stops claiming GenAI jobs, then a
+single trial request decides whether to close it again.
+
+Environment:
+  - GENAI_RATE_PER_SEC     sustained requests per second per provider (default 2)
+  - GENAI_RATE_BURST       bucket size (default 10)
+  - GENAI_BREAKER_FAILURES consecutive failures before opening (default 5)
+  - GENAI_BREAKER_RESET    seconds to stay open (default 60)
+"""
+import functools
+import os
+import threading
+import time
+
+RATE_PER_SEC = float(os.environ.get('GENAI_RATE_PER_SEC', '2'))
+RATE_BURST = float(os.environ.get('GENAI_RATE_BURST', '10'))
+BREAKER_FAILURES = int(os.environ.get('GENAI_BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.environ.get('GENAI_BREAKER_RESET', '60'))
+
+
+class ProviderUnavailable(Exception):
+    """The provider's circuit breaker is open; retry after `retry_after` seconds."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f'{provider} unavailable, retry in {retry_after:.0f}s')
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate=RATE_PER_SEC, capacity=RATE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token; returns 0, or how long to wait before one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        import asyncio
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def is_open(self):
+        """True while requests should not be attempted (trial window not reached yet)."""
+        with self._lock:
+            return self.state == self.OPEN and self.retry_after() > 0
+
+    def check(self):
+        """Raise ProviderUnavailable unless a request may go out now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and self.retry_after() <= 0:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            raise ProviderUnavailable(self.name, max(self.retry_after(), 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """The trial request ended without saying anything about the provider; let another one go."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def status(self):
+        return {'state': self.state, 'failures': self.failures, 'retry_after': self.retry_after() if self.state != self.CLOSED else 0}
+
+
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            value, expires = hit
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+
+
+def ttl_cached(ttl):
+    """Cache a function's non-None results per positional/keyword arguments for `ttl` seconds."""
+    def deco(fn):
+        cache = TTLCache(ttl)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            value = cache.get(key)
+            if value is None:
+                value = fn(*args, **kwargs)
+                if value is not None:
+                    cache.set(key, value)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return deco
+
+
+def normalize_provider(name):
+    return 'huggingface' if name == 'hf' else name
+
+
+_limiters = {}
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    provider = normalize_provider(provider)
+    with _registry_lock:
+        if provider not in _limiters:
+            _limiters[provider] = TokenBucket()
+        return _limiters[provider]
+
+
+def get_breaker(provider):
+    provider = normalize_provider(provider)
+    with _registry_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def provider_status():
+    """Breaker state for every provider used so far in this process."""
+    with _registry_lock:
+        breakers = dict(_breakers)
+    return {name: b.status() for name, b in breakers.items()}
@@ -0,0 +1,271 @@
+"""
+QR codes for artifact records, rendered on demand.
+
+Codes are not stored per artifact any more: `qr_png` / `qr_svg` render one from
+the artifact id (and the app's base URL) when the detail view asks for it, and
+keep the most recent QR_CACHE_SIZE renderings in memory. Records saved before
+this still carry a `qr_path`; it is not used.
+
+For labelling, `label_sheet_pdf` / `label_sheet_pngs` lay out the codes of a
+whole site or search result on printable pages in one pass: each code's
+module matrix is scaled and pasted straight into a 1-bit page bitmap, and the
+PDF is written page by page, so memory stays at one page. The mask pattern is fixed (QR_MASK_PATTERN)
+instead of searched; every mask decodes, and the search is most of the
+encoding time.
+
+    python qrcodes.py sheet --site "Trench A" --out trench-a.pdf
+    python qrcodes.py sheet --query pottery --format png --out labels.png
+"""
+import argparse
+import functools
+import os
+import sys
+import zlib
+
+# renderings kept in memory (per format and size)
+QR_CACHE_SIZE = int(os.environ.get('SITESCAN_QR_CACHE_SIZE', '512'))
+QR_BORDER = 2
+QR_MASK_PATTERN = 0
+QR_COLOR = (0x2D, 0x5F, 0x4C)
+
+# label sheet defaults: A4, 3 x 8 labels of 70 x 37 mm, printed at 300 dpi
+PAGE_MM = (210, 297)
+SHEET_GRID = (3, 8)
+SHEET_DPI = 300
+SHEET_MARGIN_MM = 0
+
+
+def qr_data(artifact_id, base_url=None):
+    """The text encoded for an artifact: a link to its record, or the bare id."""
+    return f'{base_url}?id={artifact_id}' if base_url else f'{artifact_id}'
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_matrix(data):
+    """Module matrix (bool, True = dark) of `data`, including the quiet-zone border. Read-only."""
+    import numpy as np
+    import qrcode
+    qr = qrcode.QRCode(border=QR_BORDER, mask_pattern=QR_MASK_PATTERN)
+    qr.add_data(data)
+    qr.make(fit=True)
+    m = np.array(qr.get_matrix(), dtype=bool)
+    m.flags.writeable = False
+    return m
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_png(artifact_id, base_url=None, box_size=6):
+    """PNG bytes of the artifact's QR code, `box_size` px per module."""
+    import io
+    import numpy as np
+    from PIL import Image
+    m = qr_matrix(qr_data(artifact_id, base_url))
+    img = Image.fromarray(np.repeat(np.repeat(~m, box_size, 0), box_size, 1).astype(np.uint8)).convert('P')
+    img.putpalette(list(QR_COLOR) + [255, 255, 255])
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_svg(artifact_id, base_url=None, box_size=6):
+    """SVG text of the artifact's QR code: one path of horizontal runs, scalable for print."""
+    m = qr_matrix(qr_data(artifact_id, base_url))
+    n = len(m)
+    runs = []
+    for y, row in enumerate(m.tolist()):
+        x = 0
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+            x += 1
+    size = n * box_size
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {n} {n}" '
+            f'shape-rendering="crispEdges"><rect width="{n}" height="{n}" fill="#fff"/>'
+            f'<path fill="#{"%02X%02X%02X" % QR_COLOR}" d="{"".join(runs)}"/></svg>')
+
+
+def qr_cache_info():
+    return {'png': qr_png.cache_info(), 'svg': qr_svg.cache_info(), 'matrix': qr_matrix.cache_info()}
+
+
+@functools.lru_cache(maxsize=8)
+def _font(size):
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _mm(mm, dpi):
+    return int(round(mm * dpi / 25.4))
+
+
+def label_pages(labels, base_url=None, grid=SHEET_GRID, page_mm=PAGE_MM, dpi=SHEET_DPI, margin_mm=SHEET_MARGIN_MM):
+    """
+    Yield one 1-bit PIL image per `grid` (cols, rows) of labels. `labels` is an
+    iterable of (artifact_id, [text lines]); each label gets the code on the left
+    and the lines on its right, the first one larger.
+    """
+    from PIL import Image
+    cols, rows = grid
+    page_w, page_h = _mm(page_mm[0], dpi), _mm(page_mm[1], dpi)
+    margin = _mm(margin_mm, dpi)
+    cell_w, cell_h = (page_w - 2 * margin) // cols, (page_h - 2 * margin) // rows
+    pad = _mm(2, dpi)
+    qr_side = min(cell_h, cell_w // 2) - 2 * pad
+    line_h = max(8, min(qr_side // 5, (cell_w - qr_side - 3 * pad) // 9))
+    sizes = (line_h, max(8, line_h * 4 // 5))
+    per_page = cols * rows
+    page = None
+    for i, (artifact_id, lines) in enumerate(labels):
+        if i % per_page == 0:
+            if page is not None:
+                yield page
+            page = Image.new('1', (page_w, page_h), 1)
+        col, row = (i % per_page) % cols, (i % per_page) // cols
+        x0, y0 = margin + col * cell_w + pad, margin + row * cell_h + pad
+        m = qr_matrix(qr_data(artifact_id, base_url))
+        side = max(1, qr_side // len(m)) * len(m)
+        page.paste(Image.fromarray(~m).resize((side, side), Image.NEAREST), (x0, y0 + (cell_h - 2 * pad - side) // 2))
+        tx = x0 + side + pad
+        width = x0 - pad + cell_w - tx - pad
+        for n, line in enumerate(lines):
+            if line:
+                page.paste(_text_line(str(line), sizes[min(n, 1)], width), (tx, y0 + pad + n * int(line_h * 1.3)))
+    if page is not None:
+        yield page
+
+
+@functools.lru_cache(maxsize=1024)
+def _text_line(text, size, width):
+    """1-bit image of one label line, cut to `width` px; site and spot lines repeat, so they are cached."""
+    from PIL import Image, ImageDraw
+    font = _font(size)
+    if font.getlength(text) > width:
+        while text and font.getlength(text + '...') > width:
+            text = text[:-1]
+        text += '...'
+    left, top, right, bottom = font.getbbox(text)
+    img = Image.new('1', (max(1, right), max(1, bottom)), 1)
+    draw = ImageDraw.Draw(img)
+    # plain 1-bit glyphs: no anti-aliasing to threshold away afterwards
+    draw.fontmode = '1'
+    draw.text((0, 0), text, fill=0, font=font)
+    return img
+
+
+def label_sheet_pngs(labels, base_url=None, **layout):
+    """One 1-bit PNG (bytes) per page of labels; see label_pages for the arguments."""
+    import io
+    out = []
+    dpi = layout.get('dpi', SHEET_DPI)
+    for page in label_pages(labels, base_url=base_url, **layout):
+        buf = io.BytesIO()
+        page.save(buf, 'PNG', dpi=(dpi, dpi))
+        out.append(buf.getvalue())
+    return out
+
+
+def label_sheet_pdf(labels, base_url=None, out=None, **layout):
+    """
+    Write the labels as a PDF (1-bit Flate-compressed page images) to the file
+    object `out`, page by page, so memory stays at one page however many labels
+    there are; returns the page count. Without `out` the PDF bytes are returned.
+    """
+    import io
+    buf = out if out is not None else io.BytesIO()
+    dpi = layout.get('dpi', SHEET_DPI)
+    offsets = {}
+    pos = [0]
+
+    def write(data):
+        buf.write(data)
+        pos[0] += len(data)
+
+    def obj(num, body, stream=None):
+        offsets[num] = pos[0]
+        write(f'{num} 0 obj\n'.encode() + body)
+        if stream is not None:
+            write(b'\nstream\n' + stream + b'\nendstream')
+        write(b'\nendobj\n')
+
+    write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    page_ids = []
+    num = 3
+    for page in label_pages(labels, base_url=base_url, **layout):
+        w, h = page.size
+        # mode '1' raw bytes are PDF's DeviceGray 1 bit per pixel: packed rows, 1 = white
+        data = zlib.compress(page.tobytes(), 3)
+        wpt, hpt = w * 72.0 / dpi, h * 72.0 / dpi
+        content = f'q {wpt:.2f} 0 0 {hpt:.2f} 0 0 cm /Im0 Do Q'.encode()
+        obj(num, f'<< /Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace /DeviceGray '
+                 f'/BitsPerComponent 1 /Filter /FlateDecode /Length {len(data)} >>'.encode(), data)
+        obj(num + 1, f'<< /Length {len(content)} >>'.encode(), content)
+        obj(num + 2, f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {wpt:.2f} {hpt:.2f}] '
+                     f'/Resources << /XObject << /Im0 {num} 0 R >> >> /Contents {num + 1} 0 R >>'.encode())
+        page_ids.append(num + 2)
+        num += 3
+    obj(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    kids = ' '.join(f'{p} 0 R' for p in page_ids)
+    obj(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode())
+    xref = pos[0]
+    write(f'xref\n0 {num}\n0000000000 65535 f \n'.encode())
+    for n in range(1, num):
+        write(f'{offsets[n]:010d} 00000 n \n'.encode())
+    write(f'trailer\n<< /Size {num} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+    return buf.getvalue() if out is None else len(page_ids)
+
+
+def artifact_labels(conn, ids):
+    """(id, [short id, site / spot, filename]) for each id, in order, for label_pages."""
+    from db import get_label_fields
+    fields = get_label_fields(conn, ids)
+    out = []
+    for aid in ids:
+        filename, site, spot = fields.get(aid, ('', '', ''))
+        out.append((aid, [aid[:8], ' / '.join(p for p in (site, spot) if p), filename or '']))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SiteScan QR label sheets')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sheet = sub.add_parser('sheet', help='label sheet for a site or search result')
+    sheet.add_argument('--site', default=None)
+    sheet.add_argument('--spot', default=None)
+    sheet.add_argument('--tag', default=None)
+    sheet.add_argument('--query', default=None, help='same search as the gallery box')
+    sheet.add_argument('--limit', type=int, default=10000)
+    sheet.add_argument('--base-url', default=None, help='base URL encoded in the codes')
+    sheet.add_argument('--format', choices=('pdf', 'png'), default='pdf')
+    sheet.add_argument('--grid', default='x'.join(map(str, SHEET_GRID)), help='labels per page as COLSxROWS')
+    sheet.add_argument('--out', required=True, help='output file (PNG pages get -001, -002, ... suffixes)')
+    args = parser.parse_args(argv)
+
+    from db import get_conn, search_artifacts
+    conn = get_conn()
+    rows = search_artifacts(conn, query=args.query, site=args.site, spot=args.spot, tag=args.tag, limit=args.limit)
+    # gallery order is newest first; labels read better in capture order
+    labels = artifact_labels(conn, [r[0] for r in reversed(rows)])
+    grid = tuple(int(v) for v in args.grid.lower().split('x'))
+    if args.format == 'pdf':
+        with open(args.out, 'wb') as f:
+            pages = label_sheet_pdf(labels, base_url=args.base_url, out=f, grid=grid)
+        print(f'{len(labels)} labels on {pages} pages -> {args.out}')
+    else:
+        root, ext = os.path.splitext(args.out)
+        pngs = label_sheet_pngs(labels, base_url=args.base_url, grid=grid)
+        for n, data in enumerate(pngs, 1):
+            with open(f'{root}-{n:03d}{ext or ".png"}', 'wb') as f:
+                f.write(data)
+        print(f'{len(labels)} labels on {len(pngs)} pages -> {root}-001{ext or ".png"} ...')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Local reconstruction engine (NumPy/OpenCV) behind `utils.reconstruct_stub`.
+
+Works on a copy of the photo whose longest side is capped by the preset, never
+upscaled:
+
+1. Object mask: on a small analysis copy, pixels far (in Lab) from the border
+   colour are the artifact; the largest component is kept and its holes filled.
+2. Missing regions: the best vertical mirror axis of that mask is searched. If
+   the artifact is close enough to symmetric (or the difference is a piece on
+   one side of the axis), the mirrored mask minus the mask is what broke off.
+   Otherwise, for a mostly convex outline, small gaps between the convex hull
+   and the mask are used.
+3. Symmetry fill: missing pixels that have a mirror partner on the artifact are
+   copied from it and feathered into the surroundings.
+4. Inpainting: cracks (thin dark lines found with a black-hat filter) and any
+   missing pixels without a mirror partner are filled with cv2.inpaint. Large
+   images are inpainted in overlapping tiles, and tiles without masked pixels
+   are skipped.
+
+Presets (RECONSTRUCTION_PRESET, default 'balanced') trade resolution and
+inpainting method for speed; see PRESETS. Nothing here is generative. The
+output is an estimate built from the photo itself and is labelled as such in
+the UI.
+"""
+import os
+
+# bump when the algorithm or a preset changes output
+RECONSTRUCTION_VERSION = 'engine-1'
+
+PRESETS = {
+    # max_side: working resolution; analysis_side: mask/symmetry resolution;
+    # tile: inpainting tile size (0 = whole image at once)
+    'fast': {'max_side': 1024, 'analysis_side': 384, 'radius': 3, 'method': 'telea', 'tile': 0, 'cracks': False},
+    'balanced': {'max_side': 2048, 'analysis_side': 512, 'radius': 4, 'method': 'telea', 'tile': 1024, 'cracks': True},
+    'quality': {'max_side': 4096, 'analysis_side': 768, 'radius': 6, 'method': 'ns', 'tile': 1024, 'cracks': True},
+}
+DEFAULT_PRESET = os.environ.get('RECONSTRUCTION_PRESET', 'balanced')
+
+# mirror/original mask IoU needed before the mirror is trusted; a big break
+# lowers it, so below SYMMETRY_IOU the fill must also lie on one side of the axis
+SYMMETRY_IOU = 0.9
+SYMMETRY_MIN_IOU = 0.55
+SYMMETRY_ONE_SIDED = 0.9
+# area / hull area needed before the convex hull is trusted
+HULL_MIN_SOLIDITY = 0.85
+# hull gaps larger than this share of the artifact are left alone (inpainting smears them)
+HULL_MAX_FILL = 0.08
+# more "crack" than this share of the artifact is surface texture, not damage
+MAX_CRACK_SHARE = 0.05
+
+
+def get_preset(name=None):
+    name = name or DEFAULT_PRESET
+    if name not in PRESETS:
+        raise ValueError(f'unknown reconstruction preset {name!r} (expected one of {", ".join(PRESETS)})')
+    return name, PRESETS[name]
+
+
+def working_copy(img, max_side):
+    """RGB uint8 array of a PIL image with the longest side at most `max_side`."""
+    import cv2
+    import numpy as np
+    arr = np.asarray(img.convert('RGB') if img.mode != 'RGB' else img)
+    h, w = arr.shape[:2]
+    f = max_side / float(max(h, w))
+    if f >= 1:
+        return np.array(arr)
+    return cv2.resize(arr, (max(1, int(w * f)), max(1, int(h * f))), interpolation=cv2.INTER_AREA)
+
+
+def object_mask(small):
+    """uint8 0/255 mask of the artifact in an RGB array, or None if no single object stands out."""
+    import cv2
+    import numpy as np
+    lab = cv2.cvtColor(small, cv2.COLOR_RGB2LAB).astype(np.float32)
+    h, w = lab.shape[:2]
+    b = max(2, min(h, w) // 25)
+    border = np.concatenate([lab[:b].reshape(-1, 3), lab[-b:].reshape(-1, 3),
+                             lab[:, :b].reshape(-1, 3), lab[:, -b:].reshape(-1, 3)])
+    dist = np.linalg.norm(lab - np.median(border, axis=0), axis=2)
+    dist = cv2.normalize(dist, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    _, fg = cv2.threshold(cv2.GaussianBlur(dist, (5, 5), 0), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    fg = cv2.morphologyEx(cv2.morphologyEx(fg, cv2.MORPH_OPEN, k), cv2.MORPH_CLOSE, k)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(fg)
+    if n < 2:
+        return None
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    mask = np.where(labels == largest, 255, 0).astype(np.uint8)
+    # fill holes: everything not reachable from the border through background
+    flood = mask.copy()
+    cv2.floodFill(flood, np.zeros((h + 2, w + 2), np.uint8), (0, 0), 255)
+    mask |= cv2.bitwise_not(flood)
+    share = cv2.countNonZero(mask) / float(h * w)
+    if share < 0.02 or share > 0.95:
+        return None
+    return mask
+
+
+def _mirror_index(width, axis):
+    import numpy as np
+    return np.clip(np.round(2 * axis - np.arange(width)).astype(np.int64), 0, width - 1)
+
+
+def symmetry_axis(mask):
+    """(axis x, IoU) of the best vertical mirror axis of a mask, searched around its centre."""
+    import cv2
+    import numpy as np
+    x, _, w, _ = cv2.boundingRect(mask)
+    on = mask > 0
+    area = on.sum()
+    best = (x + w / 2.0, 0.0)
+    # half-pixel steps; a broken piece shifts the bbox centre by up to ~a fifth of the width
+    for axis in np.arange(x + 0.3 * w, x + 0.7 * w + 0.5, 0.5):
+        mirrored = on[:, _mirror_index(mask.shape[1], axis)]
+        inter = np.logical_and(on, mirrored).sum()
+        union = area + mirrored.sum() - inter
+        iou = inter / float(union) if union else 0.0
+        if iou > best[1]:
+            best = (float(axis), float(iou))
+    return best
+
+
+def missing_masks(mask):
+    """
+    (mirror_fill, other_fill, axis) masks for a uint8 object mask: pixels the mirror
+    can supply, and missing pixels that must be inpainted. axis is None if not symmetric.
+    """
+    import cv2
+    import numpy as np
+    empty = np.zeros_like(mask)
+    axis, iou = symmetry_axis(mask)
+    k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    if iou >= SYMMETRY_MIN_IOU:
+        mirrored = mask[:, _mirror_index(mask.shape[1], axis)]
+        fill = cv2.morphologyEx(cv2.bitwise_and(mirrored, cv2.bitwise_not(mask)), cv2.MORPH_OPEN, k)
+        cols = np.nonzero(fill)[1]
+        # an asymmetric outline differs from its mirror on both sides; a broken-off piece on one
+        one_sided = cols.size == 0 or max((cols > axis).mean(), (cols < axis).mean()) >= SYMMETRY_ONE_SIDED
+        if iou >= SYMMETRY_IOU or one_sided:
+            return fill, empty, axis
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    hull = cv2.convexHull(max(contours, key=cv2.contourArea))
+    hull_mask = np.zeros_like(mask)
+    cv2.fillConvexPoly(hull_mask, hull, 255)
+    if cv2.countNonZero(mask) < HULL_MIN_SOLIDITY * cv2.countNonZero(hull_mask):
+        return empty, empty, None
+    other = cv2.morphologyEx(cv2.bitwise_and(hull_mask, cv2.bitwise_not(mask)), cv2.MORPH_OPEN, k)
+    if cv2.countNonZero(other) > HULL_MAX_FILL * cv2.countNonZero(mask):
+        return empty, empty, None
+    return empty, other, None
+
+
+def crack_mask(work, region):
+    """Thin dark lines inside `region` (uint8 mask, or None for the whole image)."""
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(work, cv2.COLOR_RGB2GRAY)
+    size = max(5, (max(gray.shape) // 150) | 1)
+    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+    inside = blackhat[region > 0] if region is not None else blackhat.ravel()
+    if inside.size == 0:
+        return np.zeros_like(gray)
+    thresh = max(25.0, float(inside.mean() + 4 * inside.std()))
+    cracks = np.where(blackhat > thresh, 255, 0).astype(np.uint8)
+    if region is not None:
+        # keep away from the outline, where the background always looks "dark"
+        cracks &= cv2.erode(region, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+    area = cv2.countNonZero(region) if region is not None else gray.size
+    if cv2.countNonZero(cracks) > MAX_CRACK_SHARE * area:
+        return np.zeros_like(gray)
+    return cv2.dilate(cracks, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+
+
+def inpaint_tiled(work, mask, radius, method, tile):
+    """cv2.inpaint in overlapping tiles; only tiles with masked pixels are processed. Returns (image, tiles)."""
+    import cv2
+    flag = cv2.INPAINT_NS if method == 'ns' else cv2.INPAINT_TELEA
+    h, w = mask.shape
+    if not tile or max(h, w) <= tile:
+        return cv2.inpaint(work, mask, radius, flag), 1
+    # enough context for the largest hole a tile can see
+    overlap = max(4 * radius, tile // 8)
+    out = work.copy()
+    tiles = 0
+    for y in range(0, h, tile):
+        for x in range(0, w, tile):
+            if not mask[y:y + tile, x:x + tile].any():
+                continue
+            y0, x0 = max(0, y - overlap), max(0, x - overlap)
+            y1, x1 = min(h, y + tile + overlap), min(w, x + tile + overlap)
+            done = cv2.inpaint(work[y0:y1, x0:x1], mask[y0:y1, x0:x1], radius, flag)
+            out[y:y + tile, x:x + tile] = done[y - y0:y - y0 + min(tile, h - y), x - x0:x - x0 + min(tile, w - x)]
+            tiles += 1
+    return out, tiles
+
+
+def reconstruct(img, preset=None):
+    """
+    Reconstruct a PIL image. Returns (RGB uint8 array, info) where info reports the
+    preset, output size, symmetry axis and how many pixels were filled and inpainted.
+    """
+    import cv2
+    import numpy as np
+    name, p = get_preset(preset)
+    work = working_copy(img, p['max_side'])
+    h, w = work.shape[:2]
+    f = min(1.0, p['analysis_side'] / float(max(h, w)))
+    small = cv2.resize(work, (max(1, int(w * f)), max(1, int(h * f))), interpolation=cv2.INTER_AREA) if f < 1 else work
+    obj_small = object_mask(small)
+    info = {'preset': name, 'size': [w, h], 'object': obj_small is not None, 'axis': None,
+            'mirrored_px': 0, 'inpainted_px': 0, 'tiles': 0}
+
+    def up(m):
+        return cv2.resize(m, (w, h), interpolation=cv2.INTER_NEAREST) if f < 1 else m
+
+    out = work
+    hole = np.zeros((h, w), np.uint8)
+    obj = None
+    if obj_small is not None:
+        mirror_small, other_small, axis = missing_masks(obj_small)
+        obj = up(obj_small)
+        hole = up(other_small)
+        if axis is not None and mirror_small.any():
+            axis_full = (axis + 0.5) / f - 0.5
+            # grow past the break edge: its anti-aliased pixels are neither artifact nor background
+            grow = 2 * int(round(1 / f)) + 1
+            fill = cv2.dilate(up(mirror_small), cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (grow, grow)))
+            mirrored = work[:, _mirror_index(w, axis_full)]
+            # feathered blend so the copied half meets the surviving edge without a seam
+            alpha = cv2.GaussianBlur(fill.astype(np.float32) / 255.0, (0, 0), max(1.0, w / 400.0))[..., None]
+            alpha = np.maximum(alpha, (fill > 0)[..., None].astype(np.float32))
+            out = (work * (1 - alpha) + mirrored * alpha).astype(np.uint8)
+            info['axis'] = round(axis_full, 1)
+            info['mirrored_px'] = int(cv2.countNonZero(fill))
+    if p['cracks']:
+        hole |= crack_mask(out, obj)
+    if hole.any():
+        out, info['tiles'] = inpaint_tiled(out, hole, p['radius'], p['method'], p['tile'])
+        info['inpainted_px'] = int(cv2.countNonZero(hole))
+    return out, info
+
+
+def encode_png(arr):
+    """PNG bytes of an RGB array; fast zlib level, output files are working copies."""
+    import cv2
+    ok, buf = cv2.imencode('.png', cv2.cvtColor(arr, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_PNG_COMPRESSION, 3])
+    if not ok:
+        raise RuntimeError('PNG encode failed')
+    return buf.tobytes()
@@ -0,0 +1,118 @@
+import asyncio
+import io
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory with a fresh result cache, blob store and provider guards."""
+    import blobstore
+    import cache
+    import providers
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, '_cache', None)
+    monkeypatch.setattr(blobstore, '_store', None)
+    monkeypatch.setattr(providers, '_breakers', {})
+    monkeypatch.setattr(providers, '_limiters', {})
+    return tmp_path
+
+
+@pytest.fixture
+def conn(workdir):
+    """Connection to a fresh database in the work directory."""
+    from db import ConnectionManager
+    return ConnectionManager(workdir / 'test.db').connection()
+
+
+def make_record(aid='a1', **fields):
+    from db import timestamp
+    record = {'id': aid, 'filename': f'{aid}.jpg', 'image_path': f'data/images/{aid}.jpg', 'ocr_text': '',
+              'labels': [], 'metadata': {'site': 'Trench A'}, 'created_at': timestamp()}
+    record.update(fields)
+    return record
+
+
+@pytest.fixture
+def image(workdir):
+    from PIL import Image
+    path = workdir / 'find.jpg'
+    Image.new('RGB', (64, 48), (120, 90, 60)).save(path)
+    return str(path)
+
+
+def _png():
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 8), (200, 10, 10)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class StubProvider:
+    """Replicate and HF inference endpoints on 127.0.0.1, served from a background thread."""
+
+    def __init__(self):
+        self.png = _png()
+        self.predictions = []  # JSON bodies POSTed to /predictions
+        self.hf_inputs = []    # 'inputs' form fields POSTed to /models/...
+        self.model_status = 200  # status of GET /models/{owner}/{name}
+        self.url = None
+
+    def app(self):
+        from aiohttp import web
+
+        async def create(request):
+            self.predictions.append(await request.json())
+            return web.json_response({'id': 'p1', 'status': 'starting'})
+
+        async def poll(request):
+            return web.json_response({'id': 'p1', 'status': 'succeeded', 'output': [f'{self.url}/files/out.png']})
+
+        async def output(request):
+            return web.Response(body=self.png, content_type='image/png')
+
+        async def model_info(request):
+            if self.model_status != 200:
+                return web.Response(status=self.model_status)
+            return web.json_response({'versions': [{'id': 'v2'}, {'id': 'v1'}]})
+
+        async def model(request):
+            form = await request.post()
+            self.hf_inputs.append(form['inputs'])
+            return web.Response(body=self.png, content_type='image/png')
+
+        app = web.Application()
+        app.router.add_post('/predictions', create)
+        app.router.add_get('/predictions/{id}', poll)
+        app.router.add_get('/files/out.png', output)
+        app.router.add_get('/models/{model:.+}', model_info)
+        app.router.add_post('/models/{model:.+}', model)
+        return app
+
+
+@pytest.fixture
+def stub_provider(workdir, monkeypatch):
+    """A StubProvider that genai's clients (and utils' wrappers) talk to instead of the real APIs."""
+    from aiohttp import web
+    import genai
+    stub = StubProvider()
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    runner = web.AppRunner(stub.app())
+    asyncio.run_coroutine_threadsafe(runner.setup(), loop).result()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    asyncio.run_coroutine_threadsafe(site.start(), loop).result()
+    stub.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    monkeypatch.setattr(genai, 'REPLICATE_API_URL', stub.url)
+    monkeypatch.setattr(genai, 'HF_API_URL', stub.url)
+    monkeypatch.setenv('REPLICATE_API_URL', stub.url)
+    monkeypatch.setenv('GENAI_TOKEN', 'test-token')
+    monkeypatch.setenv('GENAI_MODEL_VERSION', 'stub/model')
+    yield stub
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,56 @@
+import hashlib
+import io
+from pathlib import Path
+
+import pytest
+
+import blobstore
+
+
+def test_put_bytes_is_content_addressed_and_stored_once(workdir):
+    first = blobstore.put_bytes(b'qr code', '.PNG')
+    digest = hashlib.sha256(b'qr code').hexdigest()
+    assert Path(first) == Path('data/blobs') / digest[:2] / digest[2:4] / f'{digest}.png'
+    assert blobstore.put_bytes(b'qr code', '.png') == first
+    assert blobstore.get_store().contains(first)
+    assert [p for p in Path('data/blobs').rglob('*') if p.is_file()] == [Path(first)]
+
+
+def test_put_file_moves_or_copies_into_one_blob(workdir):
+    (workdir / 'a.jpg').write_bytes(b'photo')
+    (workdir / 'b.jpg').write_bytes(b'photo')
+    kept = blobstore.put_file('a.jpg')
+    moved = blobstore.put_file('b.jpg', move=True)
+    assert kept == moved and Path(kept).read_bytes() == b'photo'
+    assert (workdir / 'a.jpg').exists() and not (workdir / 'b.jpg').exists()
+
+
+def test_rejected_stream_stores_nothing(workdir):
+    def verify(tmp_path):
+        raise ValueError('not an image')
+
+    with pytest.raises(ValueError):
+        blobstore.put_stream(io.BytesIO(b'x' * 100), '.jpg', verify=verify)
+    path, digest = blobstore.put_stream(io.BytesIO(b'y' * 100), '.bin', verify=lambda tmp: '.jpg')
+    assert path.endswith(f'{digest}.jpg')
+    assert [p for p in Path('data/blobs').rglob('*') if p.is_file()] == [Path(path)]
+
+
+def test_migration_counts_duplicates_apart_from_moved_files(conn, workdir):
+    from conftest import make_record
+    from db import get_artifact, insert_artifacts_batch
+    images = workdir / 'data' / 'images'
+    images.mkdir(parents=True)
+    for name, data in (('a1.jpg', b'sherd'), ('a2.jpg', b'sherd'), ('a3.jpg', b'bone')):
+        (images / name).write_bytes(data)
+    # a4's image and QR code were never copied to this machine
+    insert_artifacts_batch(conn, [make_record('a1'), make_record('a2'), make_record('a3'),
+                                  make_record('a4', qr_path='data/qrcodes/a4.png')])
+    stats = blobstore.migrate_artifact_files(conn, log=lambda msg: None)
+    assert stats == {'moved': 2, 'deduplicated': 1, 'missing': 2}
+    assert get_artifact(conn, 'a1')['image_path'] == get_artifact(conn, 'a2')['image_path']
+    assert Path(get_artifact(conn, 'a3')['image_path']).read_bytes() == b'bone'
+    assert not any(images.iterdir())
+    # already migrated rows are skipped on a second run
+    assert blobstore.migrate_artifact_files(conn, log=lambda msg: None) == {'moved': 0, 'deduplicated': 0,
+                                                                            'missing': 2}
@@ -0,0 +1,44 @@
+import cache
+
+
+def _cache(workdir, max_bytes):
+    return cache.ResultCache(workdir / 'cache', max_bytes=max_bytes)
+
+
+def test_eviction_drops_least_recently_used_below_the_bound(workdir, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    c = _cache(workdir, 1000)
+    for i in range(4):
+        now[0] += 1000
+        c.put(f'k{i}', 'ocr', b'x' * 300)
+    # k0 was evicted when k3 pushed the total to 1200; reading k1 makes k2 the oldest
+    assert c.get('k0') is None
+    now[0] += 1000
+    assert c.get('k1') is not None
+    c.put('k4', 'ocr', b'x' * 300)
+    assert c.get('k2') is None
+    assert c.get('k1') is not None and c.get('k4') is not None
+    stats = c.stats()
+    assert stats['bytes'] <= 1000 and stats['evictions'] == 2
+
+
+def test_hits_write_the_access_time_at_most_every_touch_interval(workdir, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    c = _cache(workdir, 1 << 20)
+    c.put('k', 'ocr', b'v')
+    last_access = lambda: c._get_conn().execute("SELECT last_access FROM results WHERE key='k'").fetchone()[0]
+    now[0] += cache.TOUCH_SECONDS / 2
+    assert c.get('k') == b'v'
+    assert last_access() == 1000.0
+    now[0] += cache.TOUCH_SECONDS
+    c.get('k')
+    assert last_access() == now[0]
+
+
+def test_cache_is_shared_in_wal_mode(workdir):
+    a, b = _cache(workdir, 1 << 20), _cache(workdir, 1 << 20)
+    a.put_json('k', 'recognition', [{'label': 'cup'}])
+    assert b.get_json('k') == [{'label': 'cup'}]
+    assert a._get_conn().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
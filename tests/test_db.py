@@ -0,0 +1,144 @@
+from db import claim_job, create_job, get_job
+
+
+def test_expired_lease_on_last_attempt_fails_the_job(conn):
+    jid = create_job(conn, 'a1', 'recognize', max_attempts=2)
+    # a negative lease expires at once, like a worker that died mid-job
+    for attempt in (1, 2):
+        job = claim_job(conn, 'w1', ['recognize'], lease_seconds=-1)
+        assert job['id'] == jid and job['attempts'] == attempt
+    assert claim_job(conn, 'w1', ['recognize'], lease_seconds=-1) is None
+    row = get_job(conn, jid)
+    assert row[4] == 'failed'
+    assert conn.execute('SELECT attempts FROM jobs WHERE id=?', (jid,)).fetchone()[0] == 2
+
+
+def test_column_updates_are_replayed_by_artifact_at_version(conn):
+    from conftest import make_record
+    from db import (artifact_at_version, get_artifact, insert_artifact, update_labels_batch,
+                    update_phash_batch, update_reconstructions_batch)
+    insert_artifact(conn, make_record('a1', labels=[{'label': 'vase', 'score': 0.5}]))
+    update_labels_batch(conn, {'a1': [{'label': 'cup', 'score': 0.8}]})
+    update_reconstructions_batch(conn, {'a1': 'data/blobs/r.png'})
+    update_phash_batch(conn, {'a1': -42})
+    rec = get_artifact(conn, 'a1')
+    rec['metadata']['notes'] = 'rim only'
+    insert_artifact(conn, rec)
+
+    assert artifact_at_version(conn, 'a1', 1)['labels'][0]['label'] == 'vase'
+    v2 = artifact_at_version(conn, 'a1', 2)
+    assert v2['labels'][0]['label'] == 'cup' and v2['reconstruction_path'] is None
+    assert artifact_at_version(conn, 'a1', 3)['reconstruction_path'] == 'data/blobs/r.png'
+    latest = artifact_at_version(conn, 'a1')
+    assert latest['phash'] == -42 and latest['metadata']['notes'] == 'rim only'
+    assert latest['labels'] == get_artifact(conn, 'a1')['labels']
+
+
+def test_unchanged_column_update_logs_nothing(conn):
+    from conftest import make_record
+    from db import insert_artifact, update_reconstructions_batch
+    insert_artifact(conn, make_record('a1', reconstruction_path='r.png'))
+    update_reconstructions_batch(conn, {'a1': 'r.png', 'missing': 'x.png'})
+    assert conn.execute('SELECT COUNT(*) FROM changes').fetchone()[0] == 1
+
+
+def test_search_matches_id_prefix(conn):
+    from conftest import make_record
+    from db import insert_artifact, search_artifacts
+    insert_artifact(conn, make_record('3f2a9c1e-0000-4000-8000-000000000001'))
+    insert_artifact(conn, make_record('3f2b0000-0000-4000-8000-000000000002'))
+    assert [r[0][:4] for r in search_artifacts(conn, '3f2a9c1e')] == ['3f2a']
+    assert len(search_artifacts(conn, '3f2')) == 2
+    assert search_artifacts(conn, '3f3') == []
+    plan = ' '.join(r[3] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM artifacts WHERE id >= '3f2' AND id < '3f3'"))
+    assert 'USING' in plan and 'INDEX' in plan
+
+
+def test_concurrent_writers_get_distinct_versions(workdir, monkeypatch):
+    import threading
+    import time
+    import db
+    from conftest import make_record
+    manager = db.ConnectionManager(workdir / 'test.db')
+    conn = manager.connection()
+    db.insert_artifact(conn, make_record('a1'))
+    errors = []
+
+    def other_writer():
+        # a second thread (its own connection), e.g. the job worker next to the UI
+        try:
+            db.update_labels_batch(manager.connection(), {'a1': [{'label': 'cup', 'score': 0.9}]})
+        except Exception as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=other_writer)
+    last_versions = db._last_versions
+
+    def racing_last_versions(c, ids):
+        out = last_versions(c, ids)
+        if c is conn and writer.ident is None:
+            writer.start()
+            time.sleep(0.3)  # give it the chance to write between our read and our write
+        return out
+
+    monkeypatch.setattr(db, '_last_versions', racing_last_versions)
+    rec = make_record('a1', ocr_text='rim fragment')
+    db.insert_artifacts_batch(conn, [rec])
+    writer.join()
+    assert not errors
+    versions = [v for v, in conn.execute("SELECT version FROM changes WHERE artifact_id='a1' ORDER BY id")]
+    assert versions == [1, 2, 3]
+
+
+def test_search_index_is_rewritten_only_when_searched_columns_change(conn):
+    from conftest import make_record
+    from db import insert_artifact, search_artifacts, update_phash_batch, update_thumbnails_batch
+    insert_artifact(conn, make_record('a1', ocr_text='amphora rim', metadata={'site': 'Trench A', 'tags': ['rim']}))
+    conn.execute('CREATE TEMP TABLE tag_deletes (artifact_id TEXT)')
+    conn.execute('''CREATE TEMP TRIGGER count_tag_deletes AFTER DELETE ON artifact_tags BEGIN
+        INSERT INTO tag_deletes VALUES (old.artifact_id); END''')
+    update_phash_batch(conn, {'a1': 42})
+    update_thumbnails_batch(conn, {'a1': ('data/thumbs/a1_sm.webp', 'data/thumbs/a1_md.webp')})
+    conn.execute("UPDATE artifacts SET dup_group = 'a1'")
+    assert conn.execute('SELECT COUNT(*) FROM tag_deletes').fetchone()[0] == 0
+    insert_artifact(conn, make_record('a1', ocr_text='amphora handle', metadata={'site': 'Trench A', 'tags': ['handle']}))
+    assert conn.execute('SELECT COUNT(*) FROM tag_deletes').fetchone()[0] == 1
+    assert [r[0] for r in search_artifacts(conn, query='handle')] == ['a1']
+    assert search_artifacts(conn, query='rim') == []
+
+
+def _page_through(fetch, limit):
+    from db import page_cursor
+    pages, after = [], None
+    while True:
+        rows = fetch(limit=limit, after=after)
+        if not rows:
+            return pages
+        pages.append([r[0] for r in rows])
+        after = page_cursor(rows[-1])
+
+
+def test_keyset_pages_cover_ties_once_in_order(conn):
+    from conftest import make_record
+    from db import insert_artifacts_batch, list_artifacts, page_cursor, search_artifacts
+    # three artifacts per timestamp, so page boundaries fall inside runs of ties
+    stamps = ['2024-06-01T10:00:00', '2024-06-01T11:00:00', '2024-06-02T09:30:00']
+    insert_artifacts_batch(conn, [make_record(f'a{i:02d}', created_at=stamps[i % 3],
+                                              metadata={'site': 'Trench A' if i % 2 else 'Trench B'})
+                                  for i in range(9)])
+    newest_first = [r[0] for r in conn.execute('SELECT id FROM artifacts ORDER BY created_at DESC, id DESC')]
+
+    for limit in (1, 2, 3, 4, 9, 10):
+        pages = _page_through(lambda **kw: list_artifacts(conn, **kw), limit)
+        assert [aid for page in pages for aid in page] == newest_first
+        assert all(len(page) == limit for page in pages[:-1])
+
+    # `before` from the first row of a page returns the page in front of it, newest first
+    page2 = list_artifacts(conn, limit=4, after=page_cursor(list_artifacts(conn, limit=4)[-1]))
+    assert [r[0] for r in list_artifacts(conn, limit=4, before=page_cursor(page2[0]))] == newest_first[:4]
+    assert list_artifacts(conn, limit=4, before=page_cursor(list_artifacts(conn, limit=1)[0])) == []
+
+    site_a = [aid for aid in newest_first if int(aid[1:]) % 2]
+    pages = _page_through(lambda **kw: search_artifacts(conn, site='Trench A', **kw), 2)
+    assert [aid for page in pages for aid in page] == site_a
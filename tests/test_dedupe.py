@@ -0,0 +1,43 @@
+import random
+
+import dedupe
+
+
+def _index(rows, seed=0):
+    rng = random.Random(seed)
+    hashes = [rng.getrandbits(64) for _ in range(rows)]
+    for i in range(0, rows, 50):  # plant near-copies
+        hashes[i + 1] = hashes[i] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+    index = dedupe.HashIndex()
+    for i, h in enumerate(hashes):
+        index.add(f'a{i}', h)
+    index.compact(force=True)
+    return index, hashes
+
+
+def _scan(hashes, h, radius):
+    return sorted(((x ^ h).bit_count(), f'a{i}') for i, x in enumerate(hashes) if (x ^ h).bit_count() <= radius)
+
+
+def test_search_matches_full_scan_on_both_paths(monkeypatch):
+    index, hashes = _index(2000)
+    queries = [hashes[i] ^ (1 << i % 64) for i in range(0, 2000, 97)]
+    scanned = [index.search(q, 10) for q in queries]
+    monkeypatch.setattr(dedupe, 'SCAN_ROWS', 0)  # force the bucket probes
+    probed = [index.search(q, 10) for q in queries]
+    expected = [_scan(hashes, q, 10) for q in queries]
+    assert scanned == expected
+    assert probed == expected
+    assert any(len(hits) > 1 for hits in expected)
+
+
+def test_find_duplicates_picks_up_rows_added_after_the_first_lookup(conn, monkeypatch):
+    from conftest import make_record
+    from db import insert_artifacts_batch
+    monkeypatch.setattr(dedupe, '_db_index', None)
+    h = 0x0123456789ABCDEF
+    insert_artifacts_batch(conn, [make_record('a1', phash=dedupe.to_db(h))])
+    assert dedupe.find_duplicates(conn, h) == [(0, 'a1')]
+    insert_artifacts_batch(conn, [make_record('a2', phash=dedupe.to_db(h ^ 0b101)),
+                                  make_record('a3', phash=dedupe.to_db(~h & (2 ** 64 - 1)))])
+    assert dedupe.find_duplicates(conn, h, exclude='a1') == [(2, 'a2')]
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import genai
+
+
+def test_replicate_result_goes_to_blob_store(stub_provider, image):
+    path = genai.run_sync(image, 'a1', 'replicate', timeout=10)
+    assert path is not None
+    assert Path(path).resolve().is_relative_to(Path('data/blobs').resolve())
+    assert Path(path).read_bytes() == stub_provider.png
+    assert stub_provider.predictions[0]['input']['prompt'] == genai.DEFAULT_PROMPT
+    assert stub_provider.predictions[0]['input']['image'].startswith('data:image/jpeg;base64,')
+
+
+def test_cached_result_is_not_requested_again(stub_provider, image):
+    first = genai.run_sync(image, 'a1', 'replicate', timeout=10)
+    second = genai.run_sync(image, 'a2', 'replicate', timeout=10)
+    assert first is not None and second == first
+    assert len(stub_provider.predictions) == 1
+
+
+def test_huggingface_wrapper_sends_prompt(stub_provider, image):
+    from utils import generate_reconstruction_huggingface
+    path = generate_reconstruction_huggingface(image, 'a1', prompt='reassemble the rim sherds')
+    assert path is not None and Path(path).read_bytes() == stub_provider.png
+    assert stub_provider.hf_inputs == ['reassemble the rim sherds']
+
+
+def test_huggingface_default_prompt(stub_provider, image):
+    from utils import generate_reconstruction_huggingface
+    assert generate_reconstruction_huggingface(image, 'a1') is not None
+    assert stub_provider.hf_inputs == [genai.DEFAULT_HF_PROMPT]
+
+
+def test_prepare_upload_shrinks_scan_over_pixel_guard(workdir, monkeypatch):
+    from PIL import Image
+    path = workdir / 'scan.jpg'
+    Image.new('RGB', (400, 300), (120, 90, 60)).save(path, quality=90)
+    # a "gigapixel" scan: over PIL's guard, and over the decode ceiling even in draft
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    monkeypatch.setattr(genai, 'max_decode_bytes', lambda: 1000)
+    data, mime, metrics = genai.prepare_upload(str(path), max_side=64)
+    assert mime == 'image/jpeg'
+    assert (metrics['width'], metrics['height']) == (64, 48)
+    assert Image.MAX_IMAGE_PIXELS == 1000
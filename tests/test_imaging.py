@@ -0,0 +1,55 @@
+import io
+
+import pytest
+from PIL import Image
+
+import imaging
+from utils import store_image
+
+
+def _jpeg(size=(800, 600), tags=None):
+    exif = Image.Exif()
+    exif.update(tags or {})
+    buf = io.BytesIO()
+    Image.new('RGB', size, (120, 90, 60)).save(buf, 'JPEG', quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def test_probe_reads_header_and_exif_from_the_stream():
+    data = _jpeg(tags={0x010F: 'Canon', 0x0110: 'Canon EOS 80D', 0x0112: 6, 0x0132: '2024:06:01 10:15:00'})
+    probe = imaging.ImageProbe('find.jpg')
+    for i in range(0, len(data), 1000):
+        probe.feed(data[i:i + 1000])
+    probe.finish()
+    assert (probe.format, probe.ext) == ('JPEG', '.jpg')
+    assert probe.header[:2] == ((800, 600), 'RGB')
+    assert probe.orientation == 6
+    assert probe.exif == {'captured_at': '2024-06-01T10:15:00', 'camera': 'Canon EOS 80D'}
+
+
+@pytest.mark.parametrize('data, why', [
+    (b'', 'empty or truncated'),
+    (b'%PDF-1.7 not an image', 'not a JPEG, PNG, TIFF or BMP'),
+    (b'\xff\xd8\xff' + b'\x00' * 64, 'unreadable image header'),
+])
+def test_probe_rejects_non_images(data, why):
+    probe = imaging.ImageProbe('upload.jpg')
+    with pytest.raises(imaging.InvalidImage, match=why):
+        probe.feed(data)
+        probe.finish()
+
+
+def test_stored_source_drafts_without_rereading_the_header(workdir, monkeypatch):
+    src, exif = store_image(io.BytesIO(_jpeg(tags={0x0112: 3})), 'find.jpg')
+    assert exif == {}
+    opened = []
+    monkeypatch.setattr(imaging, 'pil_open', lambda fp: opened.append(fp) or Image.open(fp))
+    assert src.size == (800, 600) and src.orientation == 3
+    assert opened == []
+    img = src.draft((200, 150))
+    assert img.size == (200, 150) and len(opened) == 1
+    assert src.content_hash() and src.decodes == 1
+    with pytest.raises(imaging.InvalidImage):
+        store_image(io.BytesIO(b'GIF89a' + b'\x00' * 64), 'find.gif')
+    assert sorted(p.name for p in (workdir / 'data' / 'blobs').rglob('*') if p.is_file()) == \
+        [f'{src.content_hash()}.jpg']
@@ -0,0 +1,28 @@
+import ingest
+import utils
+from conftest import make_record
+from db import get_artifact, insert_artifacts_batch
+
+CUP = [{'label': 'cup', 'score': 0.9}]
+
+
+def test_relabel_without_a_model_keeps_labels(conn, image, monkeypatch):
+    monkeypatch.delenv('SITESCAN_MODEL_SERVER', raising=False)
+    monkeypatch.setattr(utils, '_load_tf_model', lambda: None)
+    insert_artifacts_batch(conn, [make_record('a1', image_path=image, labels=CUP),
+                                  make_record('a2', image_path='missing.jpg', labels=CUP)])
+    assert ingest.relabel_artifacts(conn, log=lambda msg: None) == 0
+    assert get_artifact(conn, 'a1')['labels'] == CUP
+    assert get_artifact(conn, 'a2')['labels'] == CUP
+
+
+def test_relabel_skips_only_unreadable_images(conn, image, monkeypatch):
+    monkeypatch.delenv('SITESCAN_MODEL_SERVER', raising=False)
+    monkeypatch.setattr(utils, '_load_tf_model', lambda: object())
+    monkeypatch.setattr(utils, 'predict_labels', lambda model, arrays, *args: [
+        None if a is None else [{'label': 'bowl', 'score': 0.8}] for a in arrays])
+    insert_artifacts_batch(conn, [make_record('a1', image_path=image, labels=CUP),
+                                  make_record('a2', image_path='missing.jpg', labels=CUP)])
+    assert ingest.relabel_artifacts(conn, log=lambda msg: None) == 1
+    assert get_artifact(conn, 'a1')['labels'] == [{'label': 'bowl', 'score': 0.8}]
+    assert get_artifact(conn, 'a2')['labels'] == CUP
@@ -0,0 +1,56 @@
+import asyncio
+import os
+
+import pytest
+
+import jobs
+import utils
+from conftest import make_record
+from db import get_artifact, insert_artifact, update_labels_batch
+
+
+def test_genai_reconstruct_writes_only_its_column(conn, monkeypatch):
+    insert_artifact(conn, make_record('a1'))
+
+    class Client:
+        async def reconstruct(self, image_path, artifact_id, method, model=None):
+            # recognition finishes while the provider is still working
+            update_labels_batch(conn, {artifact_id: [{'label': 'cup', 'score': 0.9}]})
+            return 'data/blobs/ab/cd/abcd.png'
+
+    monkeypatch.setattr(jobs, '_get_genai_client', lambda: Client())
+    job = {'artifact_id': 'a1', 'params': {'method': 'replicate'}}
+    monkeypatch.setenv('GENAI_MODEL_VERSION', 'stub/model')
+    asyncio.run(jobs.handle_genai_reconstruct(conn, job, lambda pct: None))
+    rec = get_artifact(conn, 'a1')
+    assert rec['reconstruction_path'] == 'data/blobs/ab/cd/abcd.png'
+    assert rec['labels'] == [{'label': 'cup', 'score': 0.9}]
+
+
+def test_recognize_without_a_model_fails_and_keeps_labels(conn, image, monkeypatch):
+    monkeypatch.delenv('SITESCAN_MODEL_SERVER', raising=False)
+    monkeypatch.setattr(utils, '_load_tf_model', lambda: None)
+    insert_artifact(conn, make_record('a1', image_path=image, labels=[{'label': 'cup', 'score': 0.9}]))
+    with pytest.raises(RuntimeError):
+        jobs.handle_recognize(conn, {'artifact_id': 'a1'}, lambda pct: None)
+    assert get_artifact(conn, 'a1')['labels'] == [{'label': 'cup', 'score': 0.9}]
+
+
+def test_genai_reconstruct_passes_the_resolved_version_per_job(conn, monkeypatch):
+    insert_artifact(conn, make_record('a1'))
+    versions = iter(['v1', 'v2'])
+    models = []
+
+    class Client:
+        async def reconstruct(self, image_path, artifact_id, method, model=None):
+            models.append(model)
+            return 'data/blobs/ab/cd/abcd.png'
+
+    monkeypatch.setattr(jobs, '_get_genai_client', lambda: Client())
+    monkeypatch.setattr(utils, 'get_replicate_latest_version', lambda model: next(versions))
+    monkeypatch.delenv('GENAI_MODEL_VERSION', raising=False)
+    job = {'artifact_id': 'a1', 'params': {'method': 'replicate'}}
+    for _ in range(2):
+        asyncio.run(jobs.handle_genai_reconstruct(conn, job, lambda pct: None))
+    assert models == ['v1', 'v2']
+    assert 'GENAI_MODEL_VERSION' not in os.environ
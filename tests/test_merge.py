@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import make_record
+from db import ConnectionManager, get_artifact, insert_artifacts_batch, merge_db_file
+
+DERIVED = ('thumb_path', 'thumb_md_path', 'ocr_words', 'phash', 'dup_group')
+
+
+@pytest.fixture
+def remote(workdir):
+    """Path of a second database: a1 with another image, a2 with the same image but new notes."""
+    path = workdir / 'remote.db'
+    other = ConnectionManager(path).connection()
+    insert_artifacts_batch(other, [
+        make_record('a1', image_path='data/blobs/new.jpg', ocr_text='B'),
+        make_record('a2', image_path='data/images/a2.jpg', metadata={'site': 'Trench A', 'notes': 'rim'}),
+    ])
+    other.close()
+    return path
+
+
+@pytest.fixture
+def local(conn):
+    insert_artifacts_batch(conn, [make_record('a1', ocr_text='A'), make_record('a2')])
+    conn.execute('''UPDATE artifacts SET thumb_path = 'data/thumbs/' || id || '_sm.webp',
+        thumb_md_path = 'data/thumbs/' || id || '_md.webp', ocr_words = '[]', phash = 123, dup_group = 'a1' ''')
+    conn.commit()
+    return conn
+
+
+def _row(conn, aid):
+    return conn.execute(f"SELECT image_path, ocr_text, {', '.join(DERIVED)} FROM artifacts WHERE id=?", (aid,)).fetchone()
+
+
+def _set_remote_changed_at(path, aid, when):
+    other = ConnectionManager(path).connection()
+    other.execute('UPDATE changes SET changed_at=? WHERE artifact_id=?', (when, aid))
+    other.commit()
+    other.close()
+
+
+def test_keep_local_leaves_rows_alone(local, remote):
+    before = [_row(local, 'a1'), _row(local, 'a2')]
+    report = merge_db_file(local, remote, policy='keep_local')
+    assert (report['updated'], report['skipped']) == (0, 2)
+    assert [_row(local, 'a1'), _row(local, 'a2')] == before
+
+
+def test_keep_remote_clears_columns_derived_from_a_replaced_image(local, remote):
+    report = merge_db_file(local, remote, policy='keep_remote')
+    assert report['updated'] == 2
+    assert _row(local, 'a1') == ('data/blobs/new.jpg', 'B') + (None,) * len(DERIVED)
+    # same image, only the notes changed: thumbnails and hash still describe it
+    assert _row(local, 'a2')[2:] == ('data/thumbs/a2_sm.webp', 'data/thumbs/a2_md.webp', '[]', 123, 'a1')
+    assert get_artifact(local, 'a2')['metadata']['notes'] == 'rim'
+
+
+def test_keep_newest_takes_the_later_side(local, remote):
+    _set_remote_changed_at(remote, 'a1', '2000-01-01T00:00:00Z')
+    _set_remote_changed_at(remote, 'a2', '2999-01-01T00:00:00Z')
+    before = _row(local, 'a1')
+    report = merge_db_file(local, remote, policy='keep_newest')
+    assert (report['updated'], report['skipped']) == (1, 1)
+    assert _row(local, 'a1') == before
+    assert get_artifact(local, 'a2')['metadata']['notes'] == 'rim'
+    assert _row(local, 'a2')[5] == 123
+
+
+def test_keep_newest_clears_derived_columns_of_a_newer_remote_image(local, remote):
+    _set_remote_changed_at(remote, 'a1', '2999-01-01T00:00:00Z')
+    merge_db_file(local, remote, policy='keep_newest')
+    assert _row(local, 'a1') == ('data/blobs/new.jpg', 'B') + (None,) * len(DERIVED)
@@ -0,0 +1,46 @@
+import os
+import stat
+
+import pytest
+
+import model_server
+
+
+@pytest.fixture
+def key_file(workdir, monkeypatch):
+    monkeypatch.delenv('SITESCAN_MODEL_SERVER_KEY', raising=False)
+    path = workdir / 'data' / 'model_server.key'
+    monkeypatch.setattr(model_server, 'KEY_FILE', path)
+    return path
+
+
+@pytest.mark.parametrize('address', ['0.0.0.0:8765', '10.1.2.3:8765', 'example.org:8765'])
+def test_non_loopback_addresses_are_refused(address):
+    with pytest.raises(ValueError):
+        model_server.parse_address(address)
+
+
+def test_loopback_and_socket_addresses():
+    assert model_server.parse_address('127.0.0.1:8765') == ('127.0.0.1', 8765)
+    assert model_server.parse_address('localhost:9000') == ('localhost', 9000)
+    assert model_server.parse_address('/tmp/sitescan.sock') == '/tmp/sitescan.sock'
+
+
+def test_server_generates_private_key_that_clients_read(key_file):
+    assert model_server.authkey() is None
+    key = model_server.authkey(create=True)
+    assert len(key) == 64
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert model_server.authkey() == key
+
+
+def test_world_readable_key_file_is_refused(key_file):
+    model_server.authkey(create=True)
+    os.chmod(key_file, 0o644)
+    with pytest.raises(PermissionError):
+        model_server.authkey()
+
+
+def test_client_without_key_falls_back(key_file, monkeypatch):
+    monkeypatch.setattr(model_server, '_down_until', 0.0)
+    assert model_server.recognize_remote(['x.jpg'], address='127.0.0.1:1') is None
@@ -0,0 +1,26 @@
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+import ocr
+
+LABELS = ['TRENCH A-3 CTX 1042', 'SQ B7 LOCUS 311', 'FIND 0925 BONE', 'UNIT 12 BAG 88']
+
+
+def test_text_regions_keep_text_touching_a_label_outline():
+    try:
+        font = ImageFont.truetype('DejaVuSans-Bold.ttf', 48)
+    except OSError:
+        font = ImageFont.load_default(size=48)
+    # an A4 sheet of framed labels at 300 dpi, as _ocr_whole hands it over
+    page = Image.new('L', (2480, 3508), 250)
+    draw = ImageDraw.Draw(page)
+    texts = []
+    for j in range(8):
+        x, y = 150 + (j % 2) * 1150, 200 + (j // 2) * 800 + (74 + j * 53) % 200
+        draw.rectangle((x, y, x + 900, y + 120), fill=235, outline=120, width=3)
+        draw.text((x + 30, y + 30), LABELS[(2 + j) % 4], fill=20, font=font)
+        texts.append(draw.textbbox((x + 30, y + 30), LABELS[(2 + j) % 4], font=font))
+    f = 2500 / 3508
+    gray = ImageOps.autocontrast(page.resize((int(2480 * f), 2500), Image.LANCZOS))
+    regions = ocr.find_text_regions(gray)
+    for x0, y0, x1, y1 in texts:
+        assert any(r[0] <= x0 * f and r[1] <= y0 * f and r[2] >= x1 * f and r[3] >= y1 * f for r in regions)
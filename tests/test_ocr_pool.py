@@ -0,0 +1,23 @@
+from ocr_pool import DATA_KEYS, parse_tsv
+
+HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext'
+
+
+def test_parse_tsv_matches_image_to_data_layout():
+    tsv = '\n'.join([
+        HEADER,
+        '1\t1\t0\t0\t0\t0\t0\t0\t520\t70\t-1\t',
+        '4\t1\t1\t1\t1\t0\t12\t14\t330\t40\t-1',  # non-word row: the text cell is missing
+        '5\t1\t1\t1\t1\t1\t12\t14\t120\t40\t96.5\tUNIT',
+        '5\t1\t1\t1\t1\t2\t140\t14\t60\t40\t91\t12',
+    ]) + '\n'
+    data = parse_tsv(tsv)
+    assert set(data) == set(DATA_KEYS)
+    assert data['text'] == ['', '', 'UNIT', '12']
+    assert data['conf'] == [-1.0, -1.0, 96.5, 91.0]
+    assert data['left'][2:] == [12, 140]
+    assert data['line_num'] == [0, 1, 1, 1]
+
+
+def test_parse_tsv_empty_output():
+    assert parse_tsv('') == {k: [] for k in DATA_KEYS}
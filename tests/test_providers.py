@@ -0,0 +1,69 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+import genai
+import providers
+from providers import CircuitBreaker, ProviderUnavailable
+
+
+@pytest.fixture
+def breaker(workdir, monkeypatch):
+    b = CircuitBreaker('replicate', failure_threshold=1, reset_timeout=0.05)
+    monkeypatch.setitem(providers._breakers, 'replicate', b)
+    return b
+
+
+async def _call(exc):
+    async with genai.provider_call('replicate'):
+        raise exc
+
+
+def _half_open(breaker):
+    with pytest.raises(aiohttp.ClientConnectionError):
+        asyncio.run(_call(aiohttp.ClientConnectionError()))
+    assert breaker.is_open()
+    asyncio.run(asyncio.sleep(0.06))
+
+
+def _bad_request():
+    return aiohttp.ClientResponseError(None, (), status=400)
+
+
+def test_provider_failure_reopens_breaker(breaker):
+    _half_open(breaker)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        asyncio.run(_call(aiohttp.ClientConnectionError()))
+    assert breaker.is_open()
+    with pytest.raises(ProviderUnavailable):
+        breaker.check()
+
+
+def test_client_error_on_trial_closes_breaker(breaker):
+    _half_open(breaker)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(_call(_bad_request()))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize('exc', [OSError('disk full'), asyncio.CancelledError()])
+def test_trial_ending_without_an_answer_is_released(breaker, exc):
+    _half_open(breaker)
+    with pytest.raises(type(exc)):
+        asyncio.run(_call(exc))
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # the next request becomes the new trial instead of failing fast forever
+    breaker.check()
+    with pytest.raises(ProviderUnavailable):
+        breaker.check()
+
+
+def test_model_version_lookup_reports_to_breaker(stub_provider, breaker):
+    from utils import get_replicate_latest_version
+    assert get_replicate_latest_version('stub/ok') == 'v2'
+    stub_provider.model_status = 503
+    assert get_replicate_latest_version('stub/down') is None
+    assert breaker.is_open()
+    # fails fast while open, without a request
+    assert get_replicate_latest_version('stub/other') is None
@@ -0,0 +1,56 @@
+import pytest
+from PIL import Image
+
+import imaging
+import tiles
+
+
+@pytest.fixture
+def photo(workdir):
+    path = workdir / 'photo.jpg'
+    Image.new('RGB', (800, 600), (120, 90, 60)).save(path, quality=90)
+    return str(path)
+
+
+def test_pil_open_lifts_the_pixel_guard_for_its_call_only(photo, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(photo)
+    with tiles.pil_open(photo) as img:
+        assert img.size == (800, 600)
+    assert Image.MAX_IMAGE_PIXELS == 1000
+
+
+def test_draft_decodes_jpeg_at_reduced_scale(photo):
+    src = imaging.ImageSource(photo)
+    img = src.draft((200, 150))
+    assert img.mode == 'RGB'
+    assert img.size == (200, 150)  # DCT scale 1/4, not a full decode
+    assert src.draft((100, 75)) is img
+    assert src.decodes == 1
+
+
+def test_draft_over_decode_ceiling_uses_overview(photo, monkeypatch):
+    monkeypatch.setattr(imaging, 'max_decode_bytes', lambda: 1000)
+    src = imaging.ImageSource(photo)
+    assert src.too_large()
+    img = src.draft((200, 150))
+    assert img.mode == 'RGB' and max(img.size) >= 200
+    with pytest.raises(tiles.ImageTooLarge):
+        src.image()
+
+
+def test_tiles_of_a_mapped_raster_cover_it_once(workdir):
+    path = workdir / 'scan.bmp'
+    Image.new('L', (300, 200), 128).save(path)
+    raster = tiles.open_raster(str(path))
+    try:
+        assert raster.size == (300, 200)
+        area = 0
+        for x, y, (x0, y0, x1, y1), arr in tiles.iter_tiles(raster, 128, 16):
+            assert arr.shape[0] >= y1 - y0 and arr.shape[1] >= x1 - x0
+            area += (x1 - x0) * (y1 - y0)
+        assert area == 300 * 200
+        assert max(raster.overview(60).size) == 60
+    finally:
+        raster.close()
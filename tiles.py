@@ -0,0 +1,233 @@
+"""
+Memory-bounded access to rasters too large to decode whole.
+
+`imaging.ImageSource` refuses to decode a file whose full raster would exceed
+SITESCAN_MAX_DECODE_MB. Such files are read through a `Raster` from
+`open_raster` instead, which never holds more than one tile or band in memory:
+
+  - pyvips, when installed: any format libvips reads, with shrink-on-load
+    overviews and random-access regions.
+  - uncompressed TIFF, PPM and BMP: the pixel data is memory-mapped with NumPy
+    straight from the file (no decoder involved).
+  - JPEG: the smallest DCT-scaled decode (1/2 to 1/8) that fits the ceiling;
+    regions then come from that reduced image (`Raster.scale` < 1).
+
+Anything else raises `ImageTooLarge`; install pyvips to handle large PNG and
+compressed TIFF files.
+
+`overview(max_side)` is what thumbnails, recognition and the reconstruction
+use (through `ImageSource.draft`). `iter_tiles` walks full-resolution tiles
+with overlap for OCR.
+"""
+import math
+import os
+import threading
+
+# rows per band when building an overview from a memory-mapped raster
+BAND_BYTES = 64 * 1024 * 1024
+
+# raw PIL modes we can map: bytes per pixel and whether the channels are reversed
+_RAW_MODES = {'L': (1, False), 'RGB': (3, False), 'BGR': (3, True), 'RGBX': (4, False), 'RGBA': (4, False),
+              'BGRX': (4, True), 'BGRA': (4, True)}
+
+# serialises pil_open's override of Image.MAX_IMAGE_PIXELS
+_pil_guard = threading.Lock()
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def max_decode_bytes():
+    return int(os.environ.get('SITESCAN_MAX_DECODE_MB', '768')) * 1024 * 1024
+
+
+def pil_open(fp):
+    """
+    Image.open (path or file object) for readers that bound the decode themselves,
+    through SITESCAN_MAX_DECODE_MB or tiled reads. Only the header is parsed, with
+    PIL's pixel-count guard lifted for the duration of the call.
+    """
+    import warnings
+    from PIL import Image
+    # MAX_IMAGE_PIXELS is process-wide: the lock keeps concurrent callers from
+    # restoring each other's override, and only the header parse runs under it
+    with _pil_guard:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                return Image.open(fp)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _to_mode(arr):
+    """(h, w, 1|3) uint8 array -> PIL image ('L' or 'RGB')."""
+    from PIL import Image
+    return Image.fromarray(arr[..., 0] if arr.shape[2] == 1 else arr, 'L' if arr.shape[2] == 1 else 'RGB')
+
+
+class Raster:
+    """Base class: subclasses set size, bands and scale and implement region()."""
+    size = (0, 0)
+    bands = 3
+    # resolution this raster delivers relative to the file (1.0 = full)
+    scale = 1.0
+
+    def region(self, x, y, w, h):
+        """uint8 array (h, w, bands) of a box in this raster's (scaled) pixels; bands is 1 or 3."""
+        raise NotImplementedError
+
+    def overview(self, max_side):
+        """PIL image ('L' or 'RGB') of the whole raster with the longest side at most `max_side`."""
+        import cv2
+        import numpy as np
+        w, h = self.size
+        f = min(1.0, max_side / float(max(w, h)))
+        out_w, out_h = max(1, int(w * f)), max(1, int(h * f))
+        # whole output rows per band, so bands resize independently without seams
+        rows_out = max(1, int(BAND_BYTES / (w * self.bands) * f))
+        parts = []
+        for oy in range(0, out_h, rows_out):
+            oy1 = min(out_h, oy + rows_out)
+            y0, y1 = int(oy / f), min(h, int(math.ceil(oy1 / f)))
+            band = self.region(0, y0, w, y1 - y0)
+            parts.append(cv2.resize(band, (out_w, oy1 - oy), interpolation=cv2.INTER_AREA).reshape(oy1 - oy, out_w, -1))
+        return _to_mode(np.concatenate(parts))
+
+    def close(self):
+        pass
+
+
+class _VipsRaster(Raster):
+    def __init__(self, path):
+        import pyvips
+        self._pyvips = pyvips
+        self.path = path
+        self.image = self._normalise(pyvips.Image.new_from_file(path, access='random'))
+        self.size = (self.image.width, self.image.height)
+        self.bands = self.image.bands
+
+    @staticmethod
+    def _normalise(img):
+        if img.hasalpha():
+            img = img.flatten(background=255)
+        if img.format == 'ushort':
+            img = (img >> 8).cast('uchar')
+        elif img.format != 'uchar':
+            img = img.cast('uchar')
+        if img.bands == 2:
+            img = img[0]
+        elif img.bands > 3:
+            img = img[0:3]
+        return img
+
+    def region(self, x, y, w, h):
+        arr = self.image.crop(x, y, w, h).numpy()
+        return arr.reshape(h, w, -1)
+
+    def overview(self, max_side):
+        # shrink-on-load: JPEG DCT scaling, pyramid levels, streaming for the rest
+        img = self._normalise(self._pyvips.Image.thumbnail(self.path, max_side, size='down', no_rotate=True))
+        return _to_mode(img.numpy().reshape(img.height, img.width, -1))
+
+
+class _MemmapRaster(Raster):
+    def __init__(self, path, img):
+        self.path = path
+        self.size = img.size
+        self._pieces = []
+        for tile in img.tile:
+            name, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+            rawmode = args if isinstance(args, str) else args[0]
+            stride = 0 if isinstance(args, str) or len(args) < 2 else args[1]
+            orientation = 1 if isinstance(args, str) or len(args) < 3 else args[2]
+            if name != 'raw' or rawmode not in _RAW_MODES:
+                raise ImageTooLarge(f'{path}: {name}/{rawmode} data cannot be memory-mapped')
+            bpp, reverse = _RAW_MODES[rawmode]
+            x0, y0, x1, y1 = extents
+            stride = stride or (x1 - x0) * bpp
+            self._pieces.append((extents, offset, bpp, reverse, stride, orientation))
+        self.bands = 1 if self._pieces[0][2] == 1 else 3
+
+    def region(self, x, y, w, h):
+        import numpy as np
+        out = np.empty((h, w, self.bands), np.uint8)
+        for (x0, y0, x1, y1), offset, bpp, reverse, stride, orientation in self._pieces:
+            ix0, iy0, ix1, iy1 = max(x, x0), max(y, y0), min(x + w, x1), min(y + h, y1)
+            if ix0 >= ix1 or iy0 >= iy1:
+                continue
+            rows = np.memmap(self.path, np.uint8, 'r', offset=offset, shape=(y1 - y0, stride))
+            if orientation < 0:
+                # bottom-up (BMP): file row 0 is the last image row
+                rows = rows[::-1]
+            block = rows[iy0 - y0:iy1 - y0, (ix0 - x0) * bpp:(ix1 - x0) * bpp].reshape(iy1 - iy0, ix1 - ix0, bpp)
+            block = block[..., :self.bands]
+            if reverse:
+                block = block[..., ::-1]
+            out[iy0 - y:iy1 - y, ix0 - x:ix1 - x] = block
+            del rows
+        return out
+
+
+class _DraftRaster(Raster):
+    def __init__(self, path, img, limit):
+        w, h = img.size
+        for denom in (2, 4, 8):
+            if (w // denom) * (h // denom) * 3 <= limit:
+                break
+        else:
+            raise ImageTooLarge(f'{path}: {w}x{h} JPEG is too large even at 1/8 scale')
+        img.draft('RGB', (w // denom, h // denom))
+        img.load()
+        self.image = img if img.mode in ('L', 'RGB') else img.convert('RGB')
+        self.size = self.image.size
+        self.bands = 1 if self.image.mode == 'L' else 3
+        self.scale = self.size[0] / float(w)
+
+    def region(self, x, y, w, h):
+        import numpy as np
+        return np.asarray(self.image.crop((x, y, x + w, y + h))).reshape(h, w, -1)
+
+    def overview(self, max_side):
+        img = self.image.copy()
+        img.thumbnail((max_side, max_side))
+        return img
+
+    def close(self):
+        self.image = None
+
+
+def open_raster(path, limit=None):
+    """A Raster for `path` that stays within `limit` bytes (default SITESCAN_MAX_DECODE_MB)."""
+    limit = limit or max_decode_bytes()
+    try:
+        return _VipsRaster(path)
+    except ImportError:
+        pass
+    img = pil_open(path)
+    if img.format == 'JPEG':
+        # keeps the (reduced) decode; closing would discard it
+        return _DraftRaster(path, img, limit)
+    try:
+        if img.tile and all(t[0] == 'raw' for t in img.tile):
+            return _MemmapRaster(path, img)
+        raise ImageTooLarge(f'{path}: {img.size[0]}x{img.size[1]} {img.format} needs pyvips to be processed in tiles')
+    finally:
+        img.close()
+
+
+def iter_tiles(raster, tile, overlap):
+    """
+    Yield (x, y, core, array) over the raster: `array` covers the tile at (x, y)
+    grown by `overlap` on every side (clipped to the raster), `core` is the
+    (x0, y0, x1, y1) box the tile is responsible for, in raster pixels.
+    """
+    w, h = raster.size
+    for y in range(0, h, tile):
+        for x in range(0, w, tile):
+            x0, y0 = max(0, x - overlap), max(0, y - overlap)
+            x1, y1 = min(w, x + tile + overlap), min(h, y + tile + overlap)
+            yield x0, y0, (x, y, min(w, x + tile), min(h, y + tile)), raster.region(x0, y0, x1 - x0, y1 - y0)
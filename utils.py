@@ -1,20 +1,27 @@
 import uuid
 from pathlib import Path
 from datetime import datetime
-import pytesseract
-from PIL import Image, ImageOps, ImageFilter
-import numpy as np
-import qrcode
-import io
 import base64
+import mimetypes
 import os
-import time
-import requests
 from typing import Optional
-
-# TensorFlow model (lazy load)
+from concurrent.futures import ThreadPoolExecutor
+from blobstore import put_bytes, put_stream
+from cache import get_cache, make_key
+from imaging import ImageProbe, ImageSource, as_source
+from providers import ProviderUnavailable, ttl_cached, get_breaker, get_limiter
+
+# Heavy dependencies (PIL, numpy, pytesseract, qrcode, requests, TensorFlow) are
+# imported inside the functions that use them, so importing this module stays cheap
+# for the app's first render and for CLIs that only need part of it.
 _tf_model = None
 
+# bump when the corresponding stage changes output, so stale cache entries are ignored
+RECOGNITION_MODEL_VERSION = 'mobilenet_v2-imagenet-1'
+
+# seconds a resolved Replicate model version is reused
+MODEL_VERSION_TTL = int(os.environ.get('GENAI_MODEL_VERSION_TTL', '3600'))
+
 
 def generate_id():
     return str(uuid.uuid4())
@@ -25,29 +32,89 @@ def timestamp():
 
 
 def ensure_dirs():
-    Path('data/images').mkdir(parents=True, exist_ok=True)
-    Path('data/qrcodes').mkdir(parents=True, exist_ok=True)
-    Path('data/reconstructions').mkdir(parents=True, exist_ok=True)
+    # images, QR codes and reconstructions live in the blob store (blobstore.py)
+    Path('data/thumbs').mkdir(parents=True, exist_ok=True)
 
 
-def save_image_file(uploaded_file, artifact_id):
-    ensure_dirs()
-    ext = Path(uploaded_file.name).suffix or '.png'
-    out_path = Path('data/images') / f"{artifact_id}{ext}"
-    with open(out_path, 'wb') as f:
-        f.write(uploaded_file.getbuffer())
-    return str(out_path)
+# longest edge in px: 'small' for gallery tiles, 'medium' for previews
+THUMB_SIZES = {'small': 160, 'medium': 640}
+
+
+def _thumb_format():
+    from PIL import features
+    return ('WEBP', '.webp') if features.check('webp') else ('JPEG', '.jpg')
+
+
+def thumbnail_paths(artifact_id):
+    """(small, medium) thumbnail paths for an artifact."""
+    _, ext = _thumb_format()
+    return (str(Path('data/thumbs') / f"{artifact_id}_sm{ext}"),
+            str(Path('data/thumbs') / f"{artifact_id}_md{ext}"))
 
 
-def run_ocr(image_path):
+def existing_thumbnails(artifact_id):
+    """Like thumbnail_paths, with None for thumbnails that were not written."""
+    return tuple(p if os.path.exists(p) else None for p in thumbnail_paths(artifact_id))
+
+
+def make_thumbnails(image, artifact_id):
+    """
+    Write small and medium thumbnails next to the original. `image` is a path or an
+    ImageSource. Returns (small, medium) paths, or (None, None) if the image cannot
+    be decoded.
+    """
+    from PIL import Image
+    ensure_dirs()
+    fmt, _ = _thumb_format()
+    small_path, medium_path = thumbnail_paths(artifact_id)
     try:
-        img = Image.open(image_path).convert('L')
-        # basic preprocessing
-        img = ImageOps.autocontrast(img)
-        txt = pytesseract.image_to_string(img)
-        return txt.strip()
-    except Exception as e:
-        return ''
+        src = as_source(image)
+        # reduced-scale decode; we never need more than the medium size
+        img = src.oriented(src.draft((THUMB_SIZES['medium'], THUMB_SIZES['medium'])))
+        img.thumbnail((THUMB_SIZES['medium'], THUMB_SIZES['medium']), Image.LANCZOS)
+        img.save(medium_path, fmt, quality=80)
+        img.thumbnail((THUMB_SIZES['small'], THUMB_SIZES['small']), Image.LANCZOS)
+        img.save(small_path, fmt, quality=75)
+    except Exception:
+        return None, None
+    return small_path, medium_path
+
+
+def store_image(fileobj, name=''):
+    """
+    Stream an image into the blob store in one pass over its bytes: the content hash,
+    the header check and EXIF extraction happen while it is written. Raises
+    imaging.InvalidImage (and stores nothing) if it is not a readable image.
+    Returns an ImageSource that already knows its hash, size and orientation, and
+    the EXIF capture fields (imaging.exif_metadata) for the record's metadata.
+    """
+    probe = ImageProbe(name)
+    path, digest = put_stream(fileobj, feed=probe.feed, verify=lambda tmp: probe.finish(tmp).ext)
+    return ImageSource(path, content_hash=digest, probe=probe), probe.exif
+
+
+def save_image_file(uploaded_file, artifact_id, thumbnails=True):
+    """Store an upload in the blob store; returns its path. Identical photos share one file."""
+    uploaded_file.seek(0)
+    src, _ = store_image(uploaded_file, uploaded_file.name)
+    if thumbnails:
+        make_thumbnails(src, artifact_id)
+    return src.path
+
+
+def copy_image_file(src_path, artifact_id, thumbnails=True):
+    """Copy an image already on disk (e.g. from an SD card) into the blob store."""
+    with open(src_path, 'rb') as f:
+        src, _ = store_image(f, Path(src_path).name)
+    if thumbnails:
+        make_thumbnails(src, artifact_id)
+    return src.path
+
+
+def run_ocr(image, **settings):
+    """OCR text of a path or ImageSource ('' on failure); see ocr.ocr_image for settings and word confidences."""
+    from ocr import ocr_image
+    return ocr_image(image, **settings)['text']
 
 
 def _load_tf_model():
@@ -62,62 +129,111 @@ def _load_tf_model():
     return _tf_model
 
 
-def recognize_image(image_path, top=3):
-    model_tuple = _load_tf_model()
-    if model_tuple is None:
-        return []
-    model, preprocess_input, decode_predictions = model_tuple
-    img = Image.open(image_path).convert('RGB').resize((224,224))
-    arr = np.array(img)
-    x = np.expand_dims(arr, axis=0).astype('float32')
-    x = preprocess_input(x)
-    preds = model.predict(x)
-    decoded = decode_predictions(preds, top=top)[0]
-    return [{'label': p[1], 'score': float(p[2])} for p in decoded]
+RECOGNITION_SIZE = (224, 224)
+RECOGNITION_BATCH_SIZE = 32
 
 
-def generate_qr(artifact_id, base_url=None):
-    ensure_dirs()
-    if base_url:
-        url = f"{base_url}?id={artifact_id}"
-    else:
-        url = f"{artifact_id}"
-    qr = qrcode.QRCode(box_size=6, border=2)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="#2D5F4C", back_color="white")
-    out_path = Path('data/qrcodes') / f"{artifact_id}.png"
-    img.save(out_path)
-    return str(out_path)
-
-
-def reconstruct_stub(image_path, artifact_id):
-    # Simple heuristic reconstruction: upscale + slight denoise + mirror to "fill" missing pieces.
-    ensure_dirs()
-    img = Image.open(image_path).convert('RGB')
-    w,h = img.size
-    # upscale
-    recon = img.resize((int(w*1.6), int(h*1.6)), Image.LANCZOS)
-    # slight blur and sharpen to create "estimated" look
-    recon = recon.filter(ImageFilter.GaussianBlur(radius=1))
-    recon = ImageOps.autocontrast(recon)
-    # save
-    out_path = Path('data/reconstructions') / f"{artifact_id}.png"
-    recon.save(out_path)
-    return str(out_path)
-
-
-def _download_image_to_path(url, out_path):
+def _load_recognition_array(image):
     try:
-        r = requests.get(url, stream=True, timeout=30)
-        r.raise_for_status()
-        with open(out_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        return True
+        # JPEG can decode straight at reduced scale, much cheaper than a full decode + resize
+        return as_source(image).recognition_array(RECOGNITION_SIZE)
     except Exception:
-        return False
+        return None
+
+
+def load_recognition_arrays(images, workers=None):
+    """Decode and resize images (paths or ImageSources) on a thread pool; None for unreadable ones."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_load_recognition_array, images))
+
+
+def predict_labels(model_tuple, arrays, top=3, batch_size=RECOGNITION_BATCH_SIZE):
+    """
+    Run decoded arrays through the model; returns one label list per array (None where
+    the array is None). Arrays are stacked into fixed-size batches, the last one
+    zero-padded so the graph is not retraced, and each batch is a single forward pass.
+    """
+    import numpy as np
+    model, preprocess_input, decode_predictions = model_tuple
+    labels = [None] * len(arrays)
+    valid = [i for i, a in enumerate(arrays) if a is not None]
+    for start in range(0, len(valid), batch_size):
+        idx = valid[start:start + batch_size]
+        x = np.zeros((batch_size,) + RECOGNITION_SIZE + (3,), dtype=np.float32)
+        for j, i in enumerate(idx):
+            x[j] = arrays[i]
+        x = preprocess_input(x)
+        preds = np.asarray(model.predict_on_batch(x))[:len(idx)]
+        for i, decoded in zip(idx, decode_predictions(preds, top=top)):
+            labels[i] = [{'label': p[1], 'score': float(p[2])} for p in decoded]
+    return labels
+
+
+def recognize_images(images, top=3, batch_size=RECOGNITION_BATCH_SIZE, workers=None):
+    """
+    Batched recognition: returns one label list per image (path or ImageSource), or
+    None where there is no answer: the image could not be read, or neither the model
+    server nor TensorFlow is available. Callers must not store None as "no labels".
+
+    Cached results are returned directly. The rest go to the model server when
+    SITESCAN_MODEL_SERVER is set and reachable (see model_server.py), otherwise
+    through a model loaded in this process.
+    """
+    from model_server import recognize_remote
+    sources = [as_source(image) for image in images]
+    results = [None] * len(sources)
+    if not sources:
+        return results
+    cache = get_cache()
+    keys = [None] * len(sources)
+    todo = []
+    for i, src in enumerate(sources):
+        try:
+            keys[i] = make_key(src.content_hash(), 'recognition', RECOGNITION_MODEL_VERSION, {'top': top})
+        except OSError:
+            continue
+        cached = cache.get_json(keys[i])
+        if cached is not None:
+            results[i] = cached
+        else:
+            todo.append(i)
+    if not todo:
+        return results
+    # the model server decodes on its side, so it only gets paths
+    labels = recognize_remote([sources[i].path for i in todo], top=top)
+    if labels is None:
+        model_tuple = _load_tf_model()
+        if model_tuple is None:
+            return results
+        labels = predict_labels(model_tuple, load_recognition_arrays([sources[i] for i in todo], workers), top, batch_size)
+    for i, lab in zip(todo, labels):
+        if lab is not None:
+            results[i] = lab
+            cache.put_json(keys[i], 'recognition', lab)
+    return results
+
+
+def recognize_image(image, top=3):
+    return recognize_images([image], top=top, batch_size=1)[0]
+
+
+def reconstruct_stub(image, artifact_id, preset=None):
+    """
+    Local (non-generative) reconstruction of a path or ImageSource, saved as a PNG
+    in the blob store; returns its path. See reconstruction.py for the engine and
+    the presets (default RECONSTRUCTION_PRESET).
+    """
+    from reconstruction import reconstruct, encode_png, get_preset, RECONSTRUCTION_VERSION
+    src = as_source(image)
+    name, params = get_preset(preset)
+    key = make_key(src.content_hash(), 'reconstruction', RECONSTRUCTION_VERSION, dict(params, preset=name))
+    data = get_cache().get(key)
+    if data is None:
+        # a draft decode is enough: the engine never works above the preset's max_side
+        recon, _ = reconstruct(src.draft((params['max_side'], params['max_side'])), name)
+        data = encode_png(recon)
+        get_cache().put(key, 'reconstruction', data)
+    return put_bytes(data, '.png')
 
 
 def generate_reconstruction_genai(image_path, artifact_id, prompt=None, timeout=180):
@@ -129,87 +245,59 @@ def generate_reconstruction_genai(image_path, artifact_id, prompt=None, timeout=
       - GENAI_TOKEN=<replicate api token>
       - GENAI_MODEL_VERSION=<replicate model version id>
 
-    The function will POST a prediction request and poll until completion, then download
-    the resulting image to `data/reconstructions/{artifact_id}_ai.png`.
+    The prediction is polled until completion and the resulting image downloaded
+    into the blob store. Blocking wrapper around
+    `genai.AsyncGenAIClient`, which the job worker uses directly.
     """
-    provider = os.environ.get('GENAI_PROVIDER')
-    token = os.environ.get('GENAI_TOKEN')
-    model_version = os.environ.get('GENAI_MODEL_VERSION')
-    ensure_dirs()
-    out_path = Path('data/reconstructions') / f"{artifact_id}_ai.png"
-
-    if provider != 'replicate' or not token or not model_version:
+    if os.environ.get('GENAI_PROVIDER') != 'replicate':
         return None
-
-    # read image and convert to data URI
-    with open(image_path, 'rb') as f:
-        b = f.read()
-    data_uri = image_to_datauri(image_path)
-
-    headers = {
-        'Authorization': f'Token {token}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'version': model_version,
-        'input': {
-            'image': data_uri,
-            'prompt': prompt or 'AI-based reconstruction of an archaeological artifact; realistic, natural textures, fill missing parts'
-        }
-    }
-    try:
-        resp = requests.post('https://api.replicate.com/v1/predictions', json=payload, headers=headers, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        pred_id = data.get('id')
-        if not pred_id:
-            return None
-        # poll
-        start = time.time()
-        status = data.get('status')
-        poll_url = f'https://api.replicate.com/v1/predictions/{pred_id}'
-        while status not in ('succeeded', 'failed') and (time.time() - start) < timeout:
-            time.sleep(2)
-            r = requests.get(poll_url, headers=headers, timeout=30)
-            r.raise_for_status()
-            data = r.json()
-            status = data.get('status')
-        if status != 'succeeded':
-            return None
-        output = data.get('output')
-        # output is typically a list of URLs
-        if not output:
-            return None
-        img_url = output[0]
-        ok = _download_image_to_path(img_url, out_path)
-        if ok:
-            return str(out_path)
-    except Exception:
-        return None
-    return None
+    from genai import run_sync
+    return run_sync(image_path, artifact_id, 'replicate', prompt=prompt, timeout=timeout)
 
 
+@ttl_cached(MODEL_VERSION_TTL)
 def get_replicate_latest_version(model_name: str, token: Optional[str] = None) -> Optional[str]:
     """
     Fetch the latest model version id from Replicate for a given `owner/model` string.
-    Returns the version id string or None.
+    Returns the version id string or None. Successful lookups are cached for
+    MODEL_VERSION_TTL seconds so queued jobs do not each hit the API.
     """
+    import requests
     token = token or os.environ.get('GENAI_TOKEN')
     if not token:
         return None
+    # same guards as genai.provider_call: outages seen here count towards the breaker
+    breaker = get_breaker('replicate')
+    try:
+        breaker.check()
+    except ProviderUnavailable:
+        return None
+    get_limiter('replicate').acquire()
     headers = {'Authorization': f'Token {token}'}
-    url = f'https://api.replicate.com/v1/models/{model_name}'
+    url = f"{os.environ.get('REPLICATE_API_URL', 'https://api.replicate.com/v1').rstrip('/')}/models/{model_name}"
     try:
         r = requests.get(url, headers=headers, timeout=20)
         r.raise_for_status()
         d = r.json()
-        versions = d.get('versions')
-        if not versions:
-            return None
-        # choose first version (most recent)
-        return versions[0].get('id')
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        if status == 429 or status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return None
+    except (requests.ConnectionError, requests.Timeout):
+        breaker.record_failure()
+        return None
     except Exception:
+        breaker.release_trial()
+        return None
+    breaker.record_success()
+    versions = d.get('versions')
+    if not versions:
         return None
+    # choose first version (most recent)
+    return versions[0].get('id')
 
 
 def generate_reconstruction_huggingface(image_path, artifact_id, prompt=None):
@@ -217,41 +305,14 @@ def generate_reconstruction_huggingface(image_path, artifact_id, prompt=None):
     Basic Hugging Face Inference API integration (requires HF token in GENAI_TOKEN and model id in GENAI_MODEL_VERSION).
     This attempts to call the model endpoint and save a single image result.
     """
-    hf_token = os.environ.get('GENAI_TOKEN')
-    model = os.environ.get('GENAI_MODEL_VERSION')
-    ensure_dirs()
-    out_path = Path('data/reconstructions') / f"{artifact_id}_ai_hf.png"
-    if not hf_token or not model:
-        return None
-    headers = {'Authorization': f'Bearer {hf_token}'}
-    url = f'https://api-inference.huggingface.co/models/{model}'
-    try:
-        with open(image_path, 'rb') as f:
-            files = {'image': f}
-            payload = {'inputs': prompt or 'AI reconstruction of an archaeological artifact, fill missing parts, photorealistic'}
-            r = requests.post(url, headers=headers, data=payload, files=files, timeout=120)
-            r.raise_for_status()
-            # HF may return an image directly
-            content_type = r.headers.get('content-type','')
-            if 'image' in content_type:
-                with open(out_path, 'wb') as out:
-                    out.write(r.content)
-                return str(out_path)
-            # or JSON with output URL(s)
-            j = r.json()
-            if isinstance(j, dict) and 'generated_image' in j:
-                img_url = j['generated_image']
-                if _download_image_to_path(img_url, out_path):
-                    return str(out_path)
-    except Exception:
-        return None
-    return None
+    from genai import run_sync
+    return run_sync(image_path, artifact_id, 'huggingface', prompt=prompt, timeout=120)
 
 
 def image_to_datauri(path):
     with open(path, 'rb') as f:
         data = f.read()
-    mime = 'image/png'
+    mime = mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
     b64 = base64.b64encode(data).decode('utf-8')
     return f"data:{mime};base64,{b64}"
 